@@ -3,6 +3,7 @@ from typing import Tuple
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from chunked_attention import checkpoint
 from einops import rearrange
 from torch import Tensor
 
@@ -48,6 +49,16 @@ class TopkRouting(nn.Module):
 
 
 class KVGather(nn.Module):
+    """
+    按路由索引取出每个 query 窗口对应的 topk 个 key/value 窗口。
+
+    原实现在 expand 成 (n, p^2, p^2, w^2, c_kv) 的视图上做 torch.gather，再 rearrange 成多头布局，
+    选中的窗口被复制两次（gather 一次、rearrange 一次）。这里把 kv 先排成多头在前的 (n*m*p^2, w^2, c) 行，
+    把 (batch, head, 窗口) 展平成一维索引后用一次 index_select 取行，结果直接是 attention 需要的
+    (n, m, q, topk*w^2, c) 连续张量，只复制一次。r_idx 可以只包含一部分 query 窗口（q <= p^2），
+    BiLevelRoutingAttention 据此按 query 窗口分块，见其 win_chunk 参数。
+    """
+
     def __init__(self, mul_weight='none'):
         super().__init__()
         assert mul_weight in ['none', 'soft', 'hard']
@@ -61,25 +72,36 @@ class KVGather(nn.Module):
         Return:
             (n, p^2, topk, w^2, c_kq+c_v) tensor
         """
-        # select kv according to routing index
         n, p2, w2, c_kv = kv.size()
         topk = r_idx.size(-1)
-        # print(r_idx.size(), r_weight.size())
-        # FIXME: gather consumes much memory (topk times redundancy), write cuda kernel?
-        topk_kv = torch.gather(kv.view(n, 1, p2, w2, c_kv).expand(-1, p2, -1, -1, -1),
-                               # (n, p^2, p^2, w^2, c_kv) without mem cpy
-                               dim=2,
-                               index=r_idx.view(n, p2, topk, 1, 1).expand(-1, -1, -1, w2, c_kv)
-                               # (n, p^2, k, w^2, c_kv)
-                               )
+        # 展平索引后 index_select，不需要 expand 出 (n, p^2, topk, w^2, c_kv) 的 int64 索引
+        flat_idx = (r_idx + torch.arange(n, device=r_idx.device).view(n, 1, 1) * p2).reshape(-1)
+        topk_kv = kv.reshape(n * p2, w2, c_kv).index_select(0, flat_idx).view(n, -1, topk, w2, c_kv)
+        return self._weight(topk_kv, r_weight.view(n, -1, topk, 1, 1))
 
+    def gather_heads(self, r_idx: Tensor, r_weight: Tensor, kv: Tensor):
+        """
+        r_idx: (n, q, topk) tensor, q 个 query 窗口的路由索引
+        r_weight: (n, q, topk) tensor
+        kv: (n, m, p^2, w^2, c) tensor, 多头在窗口维之前
+        Return:
+            (n, m, q, topk*w^2, c) tensor
+        """
+        n, m, p2, w2, c = kv.size()
+        q, topk = r_idx.shape[1:]
+        offset = torch.arange(n * m, device=r_idx.device).view(n, m, 1, 1) * p2
+        flat_idx = (r_idx.unsqueeze(1) + offset).reshape(-1)  # (n*m*q*topk)
+        topk_kv = kv.reshape(n * m * p2, w2, c).index_select(0, flat_idx).view(n, m, q, topk, w2, c)
+        topk_kv = self._weight(topk_kv, r_weight.view(n, 1, q, topk, 1, 1))
+        return topk_kv.view(n, m, q, topk * w2, c)
+
+    def _weight(self, topk_kv, r_weight):
         if self.mul_weight == 'soft':
-            topk_kv = r_weight.view(n, p2, topk, 1, 1) * topk_kv  # (n, p^2, k, w^2, c_kv)
+            topk_kv = r_weight * topk_kv
         elif self.mul_weight == 'hard':
             raise NotImplementedError('differentiable hard routing TBA')
         # else: #'none'
         #     topk_kv = topk_kv # do nothing
-
         return topk_kv
 
 
@@ -106,13 +128,24 @@ class BiLevelRoutingAttention(nn.Module):
     param_routing: extra linear for routing
     diff_routing: wether to set routing differentiable
     soft_routing: wether to multiply soft routing weights
+    win_chunk: 每次处理的 query 窗口数。
+        一块中选中的 key/value 和注意力分数的峰值内存（float32，字节）为
+            4 * n * win_chunk * topk * w^2 * (c_qk + c_v + num_heads * w^2)
+        其中 w^2 = H * W / n_win^2。一次处理全部 p^2 个窗口时，这一项是 topk 倍的 key/value 冗余。
+        win_chunk 和 mem_budget 都为 None 时默认 win_chunk = p^2 // topk: 一块选中的 key/value 不超过
+        k_pix + v_pix 本身的大小，分数不超过 p^2 个窗口各自做窗口内注意力时的大小，峰值与 topk 无关。
+        推理（no_grad）时块之间的中间结果会被释放，峰值与 win_chunk 成正比；
+        训练时每块的中间结果仍要保留给反向传播，除非 attn_checkpoint=True（每块只保存输入，反向时重算）。
+        win_chunk 为 None 且设置了 mem_budget（字节）时，按上式由 mem_budget 自动选取，
+        见 CoorLGNet.set_attention_chunking。
+        输出与不分块时相同（逐块的 matmul/softmax 只在求和顺序上可能有浮点舍入差异）。
     """
 
     def __init__(self, dim, num_heads=8, n_win=7, qk_dim=None, qk_scale=None,
                  kv_per_win=4, kv_downsample_ratio=4, kv_downsample_kernel=None, kv_downsample_mode='identity',
                  topk=4, param_attention="qkvo", param_routing=False, diff_routing=False, soft_routing=False,
                  side_dwconv=3,
-                 auto_pad=False):
+                 auto_pad=False, win_chunk=None):
         super().__init__()
         # local attention setting
         self.dim = dim
@@ -193,20 +226,43 @@ class BiLevelRoutingAttention(nn.Module):
         self.attn_act = nn.Softmax(dim=-1)
 
         self.auto_pad = auto_pad
+        self.win_chunk = win_chunk
+        self.mem_budget = None
+        self.attn_checkpoint = False
+
+    def _win_chunk(self, q_pix, k_pix, v_pix, topk):
+        p2 = self.n_win * self.n_win
+        if self.win_chunk:
+            return min(self.win_chunk, p2)
+        if not self.mem_budget:
+            # 默认: 一块选中的 key/value 总量不超过 k_pix / v_pix 本身（见类的说明）
+            return max(1, p2 // max(topk, 1))
+        # 一个 query 窗口: 选中的 key/value 加上 num_heads 个 (w^2, topk*w^2) 的分数
+        n, m, _, w2, _ = q_pix.shape
+        w2_kv = k_pix.shape[3]
+        per_win = n * topk * w2_kv * (m * (k_pix.shape[-1] + v_pix.shape[-1]) + m * w2 * 3) * q_pix.element_size()
+        return max(1, min(p2, int(self.mem_budget // per_win)))
+
+    def _attend(self, q_pix, r_idx, r_weight, k_pix, v_pix):
+        k_pix_sel = self.kv_gather.gather_heads(r_idx, r_weight, k_pix)  # (n, m, q, topk*h_kv*w_kv, c_qk//m)
+        v_pix_sel = self.kv_gather.gather_heads(r_idx, r_weight, v_pix)  # (n, m, q, topk*h_kv*w_kv, c_v//m)
+        # param-free multihead attention
+        attn_weight = (q_pix * self.scale) @ k_pix_sel.transpose(-2, -1)  # (n, m, q, w^2, topk*h_kv*w_kv)
+        attn_weight = self.attn_act(attn_weight)
+        return attn_weight @ v_pix_sel, attn_weight
 
     def forward(self, x, H, W, ret_attn_mask=False):
         """
-        x: NHWC tensor
+        x: [B, H*W, C] tensor
         Return:
-            NHWC tensor
+            [B, H*W, C] tensor
         """
         B, N, C = x.shape   # [B, 3136, 64]
         x = x.reshape(B, H, W, C)
         # NOTE: use padding for semantic segmentation
         ###################################################
+        H_in, W_in = H, W
         if self.auto_pad:
-            N, H_in, W_in, C = x.size()
-
             pad_l = pad_t = 0
             pad_r = (self.n_win - W_in % self.n_win) % self.n_win
             pad_b = (self.n_win - H_in % self.n_win) % self.n_win
@@ -215,7 +271,6 @@ class BiLevelRoutingAttention(nn.Module):
                           pad_t, pad_b))  # dim=-3
             _, H, W, _ = x.size()  # padded size
         else:
-            N, H, W, C = x.size()
             assert H % self.n_win == 0 and W % self.n_win == 0  #
         ###################################################
 
@@ -248,26 +303,34 @@ class BiLevelRoutingAttention(nn.Module):
 
         r_weight, r_idx = self.router(q_win, k_win)  # both are (n, p^2, topk) tensors
 
-        kv_pix_sel = self.kv_gather(r_idx=r_idx, r_weight=r_weight, kv=kv_pix)  # (n, p^2, topk, h_kv*w_kv, c_qk+c_v)
-        k_pix_sel, v_pix_sel = kv_pix_sel.split([self.qk_dim, self.dim], dim=-1)
-        # kv_pix_sel: (n, p^2, topk, h_kv*w_kv, c_qk)
-        # v_pix_sel: (n, p^2, topk, h_kv*w_kv, c_v)
-
-        ######### do attention as normal ####################
-        k_pix_sel = rearrange(k_pix_sel, 'n p2 k w2 (m c) -> (n p2) m c (k w2)',
-                              m=self.num_heads)  # flatten to BMLC, (n*p^2, m, topk*h_kv*w_kv, c_kq//m) transpose here?
-        v_pix_sel = rearrange(v_pix_sel, 'n p2 k w2 (m c) -> (n p2) m (k w2) c',
-                              m=self.num_heads)  # flatten to BMLC, (n*p^2, m, topk*h_kv*w_kv, c_v//m)
-        q_pix = rearrange(q_pix, 'n p2 w2 (m c) -> (n p2) m w2 c',
-                          m=self.num_heads)  # to BMLC tensor (n*p^2, m, w^2, c_qk//m)
-
-        # param-free multihead attention
-        attn_weight = (
-                                  q_pix * self.scale) @ k_pix_sel  # (n*p^2, m, w^2, c) @ (n*p^2, m, c, topk*h_kv*w_kv) -> (n*p^2, m, w^2, topk*h_kv*w_kv)
-        attn_weight = self.attn_act(attn_weight)
-        out = attn_weight @ v_pix_sel  # (n*p^2, m, w^2, topk*h_kv*w_kv) @ (n*p^2, m, topk*h_kv*w_kv, c) -> (n*p^2, m, w^2, c)
-        out = rearrange(out, '(n j i) m (h w) c -> n (j h) (i w) (m c)', j=self.n_win, i=self.n_win,
+        # 多头在窗口维之前，gather 的结果直接用于 matmul，不再 rearrange
+        # q_pix: (n, m, p^2, w^2, c_qk//m), k_pix/v_pix: (n, m, p^2, h_kv*w_kv, c//m)
+        q_pix = rearrange(q_pix, 'n p2 w2 (m c) -> n m p2 w2 c', m=self.num_heads)
+        k_pix = rearrange(kv_pix[..., :self.qk_dim], 'n p2 w2 (m c) -> n m p2 w2 c', m=self.num_heads)
+        v_pix = rearrange(kv_pix[..., self.qk_dim:], 'n p2 w2 (m c) -> n m p2 w2 c', m=self.num_heads)
+        # 每个分块都会 gather 整个 k_pix / v_pix，只在分块循环之前转换一次为连续内存
+        k_pix, v_pix = k_pix.contiguous(), v_pix.contiguous()
+
+        ######### do attention as normal, chunked over query windows ####################
+        p2 = self.n_win * self.n_win
+        chunk = self._win_chunk(q_pix, k_pix, v_pix, r_idx.shape[-1])
+        use_checkpoint = self.attn_checkpoint and torch.is_grad_enabled()
+        outs, attn_weights = [], []
+        for s in range(0, p2, chunk):
+            e = min(s + chunk, p2)
+            args = (q_pix[:, :, s:e], r_idx[:, s:e], r_weight[:, s:e], k_pix, v_pix)
+            out, attn_weight = checkpoint(self._attend, *args) if use_checkpoint \
+                else self._attend(*args)
+            outs.append(out)  # (n, m, q, w^2, c_v//m)
+            if ret_attn_mask:
+                attn_weights.append(attn_weight)
+            del attn_weight
+        out = outs[0] if len(outs) == 1 else torch.cat(outs, dim=2)
+        out = rearrange(out, 'n m (j i) (h w) c -> n (j h) (i w) (m c)', j=self.n_win, i=self.n_win,
                         h=H // self.n_win, w=W // self.n_win)
+        if ret_attn_mask:
+            # 与原实现相同的 (n*p^2, m, w^2, topk*h_kv*w_kv) 布局
+            attn_weight = rearrange(torch.cat(attn_weights, dim=2), 'n m p2 w2 k -> (n p2) m w2 k')
 
         out = out + lepe
         # output linear
@@ -278,7 +341,7 @@ class BiLevelRoutingAttention(nn.Module):
         if self.auto_pad and (pad_r > 0 or pad_b > 0):
             out = out[:, :H_in, :W_in, :].contiguous()
 
-        out = out.reshape(B, H * W, C)
+        out = out.reshape(B, H_in * W_in, C)
 
         if ret_attn_mask:
             return out, r_weight, r_idx, attn_weight
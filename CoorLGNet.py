@@ -1,18 +1,21 @@
+import sys
 import math
+import inspect
 import logging
 from functools import partial
+from contextlib import contextmanager
 from collections import OrderedDict
 from torch import Tensor
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from timm.data import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD
-from timm.models.helpers import load_pretrained
-from timm.models.layers import DropPath, to_2tuple, trunc_normal_
-from timm.models.resnet import resnet26d, resnet50d
-from timm.models.registry import register_model
+# 推理路径上不导入 timm（导入 timm 会加载全部模型定义），只在需要时延迟导入
+from model_layers import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD, DropPath, to_2tuple, trunc_normal_
 from CA_Block import CoordAtt
+from token_merging import TokenMerge
+from chunked_attention import chunked_attention
+from linear_attention import LinearAttention, LowRankRelativePos
 from eca_module import eca_layer
 # from dynamic_conv import DynamicConv
 from cbam_module import SpatialAttention, ChannelAttention
@@ -301,8 +304,9 @@ class WindowAttention(nn.Module):
             torch.zeros((2 * window_size[0] - 1) * (2 * window_size[1] - 1), num_heads))  # [2*Mh-1 * 2*Mw-1, nH]
 
         # get pair-wise relative position index for each token inside the window
-        coords_h = torch.arange(self.window_size[0])
-        coords_w = torch.arange(self.window_size[1])
+        # 固定在 CPU 上计算（meta device 上构建模型时也能得到真实的索引）
+        coords_h = torch.arange(self.window_size[0], device="cpu")
+        coords_w = torch.arange(self.window_size[1], device="cpu")
         coords = torch.stack(torch.meshgrid([coords_h, coords_w], indexing="ij"))  # [2, Mh, Mw]
         coords_flatten = torch.flatten(coords, 1)  # [2, Mh*Mw]
         # [2, Mh*Mw, 1] - [2, 1, Mh*Mw]
@@ -326,6 +330,9 @@ class WindowAttention(nn.Module):
 
         nn.init.trunc_normal_(self.relative_position_bias_table, std=.02)
         self.softmax = nn.Softmax(dim=-1)
+        # 按 query 分块计算注意力的内存预算（字节）和是否在反向时重算，见 CoorLGNet.set_attention_chunking
+        self.mem_budget = None
+        self.attn_checkpoint = False
 
     def forward(self, x):
         B_, N, C = x.shape
@@ -337,21 +344,26 @@ class WindowAttention(nn.Module):
         # transpose: -> [batch_size*num_windows, num_heads, embed_dim_per_head, Mh*Mw]
         # @: multiply -> [batch_size*num_windows, num_heads, Mh*Mw, Mh*Mw]
         q = q * self.scale
-        attn = (q @ k.transpose(-2, -1))
 
         # relative_position_bias_table.view: [Mh*Mw*Mh*Mw,nH] -> [Mh*Mw,Mh*Mw,nH]
         relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
             self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)
         relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # [nH, Mh*Mw, Mh*Mw]
-        attn = attn + relative_position_bias.unsqueeze(0)
-        attn = self.softmax(attn)
+        if self.mem_budget or self.attn_checkpoint:
+            x = chunked_attention(q, k, v, relative_position_bias.unsqueeze(0), self.mem_budget,
+                                  self.attn_checkpoint, self.attn_drop)
+        else:
+            attn = (q @ k.transpose(-2, -1))
+            attn = attn + relative_position_bias.unsqueeze(0)
+            attn = self.softmax(attn)
 
-        attn = self.attn_drop(attn)
+            attn = self.attn_drop(attn)
+            x = attn @ v
 
         # @: multiply -> [batch_size*num_windows, num_heads, Mh*Mw, embed_dim_per_head]
         # transpose: -> [batch_size*num_windows, Mh*Mw, num_heads, embed_dim_per_head]
         # reshape: -> [batch_size*num_windows, Mh*Mw, total_embed_dim]
-        x = (attn @ v).transpose(1, 2).reshape(B_, N, C)
+        x = x.transpose(1, 2).reshape(B_, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -383,10 +395,23 @@ class Attention(nn.Module):
                 nn.Conv2d(dim, dim, kernel_size=sr_ratio, stride=sr_ratio, groups=dim, bias=True),
                 nn.BatchNorm2d(dim, eps=1e-5),
             )
+        # 按 query 分块计算注意力的内存预算（字节）和是否在反向时重算，见 CoorLGNet.set_attention_chunking
+        self.mem_budget = None
+        self.attn_checkpoint = False
 
-    def forward(self, x, H, W, relative_pos):
+    def forward(self, x, H, W, relative_pos, tome=None):
+        """tome: TokenMerge，给出时 query 为合并后的 token，key/value 仍由完整的特征图计算，输出再 unmerge 回 N 个 token"""
         B, N, C = x.shape
-        q = self.q(x).reshape(B, N, self.num_heads, self.qk_dim // self.num_heads).permute(0, 2, 1, 3)   # self.qk_dim // self.num_heads表示多头时，分出来的头的dimension
+        if tome is not None:
+            # 合并后 token 的相对位置偏置取其代表位置的偏置
+            nH, _, M = relative_pos.shape
+            relative_pos = tome.merge_rows(relative_pos.permute(1, 0, 2).reshape(N, nH * M))
+            relative_pos = relative_pos.reshape(B, -1, nH, M).permute(0, 2, 1, 3)
+            q = tome.merge(x)
+        else:
+            q = x
+        Nq = q.shape[1]
+        q = self.q(q).reshape(B, Nq, self.num_heads, self.qk_dim // self.num_heads).permute(0, 2, 1, 3)   # self.qk_dim // self.num_heads表示多头时，分出来的头的dimension
 
         if self.sr_ratio > 1:
             x_ = x.permute(0, 2, 1).reshape(B, C, H, W)
@@ -397,12 +422,19 @@ class Attention(nn.Module):
             k = self.k(x).reshape(B, N, self.num_heads, self.qk_dim // self.num_heads).permute(0, 2, 1, 3)
             v = self.v(x).reshape(B, N, self.num_heads, C // self.num_heads).permute(0, 2, 1, 3)
 
-        attn = (q @ k.transpose(-2, -1)) * self.scale + relative_pos   # q × k的转置  @表示矩阵乘法   此处是矩阵乘法
-        attn = attn.softmax(dim=-1)   # 对得到结果的每一行进行softmax处理  dim=-1代表最后一个维度  即每一行
-        attn = self.attn_drop(attn)
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+        if self.mem_budget or self.attn_checkpoint:
+            x = chunked_attention(q * self.scale, k, v, relative_pos, self.mem_budget, self.attn_checkpoint,
+                                  self.attn_drop)
+        else:
+            attn = (q @ k.transpose(-2, -1)) * self.scale + relative_pos   # q × k的转置  @表示矩阵乘法   此处是矩阵乘法
+            attn = attn.softmax(dim=-1)   # 对得到结果的每一行进行softmax处理  dim=-1代表最后一个维度  即每一行
+            attn = self.attn_drop(attn)
+            x = attn @ v
+        x = x.transpose(1, 2).reshape(B, Nq, C)
         x = self.proj(x)
         x = self.proj_drop(x)
+        if tome is not None:
+            x = tome.unmerge(x)
         return x
 
 
@@ -410,9 +442,12 @@ class Attention(nn.Module):
 
 class Block(nn.Module):
     def __init__(self, dim, num_heads, mlp_ratio=1., qkv_bias=False, qk_scale=None, drop=0.2, attn_drop=0.,
-                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, qk_ratio=1, sr_ratio=1, window_size=7):
+                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, qk_ratio=1, sr_ratio=1, window_size=7,
+                 tome_ratio=0., global_attn='sr', n_win=7, topk=4):
         super().__init__()
         self.dim = dim
+        # 全局 Attention 和 FFN 分支前合并掉的 token 比例（见 token_merging.py），0 表示不合并
+        self.tome_ratio = tome_ratio
         self.num_heads = num_heads
         self.window_size = window_size
         self.mlp_ratio = mlp_ratio
@@ -422,9 +457,23 @@ class Block(nn.Module):
             dim, window_size=(self.window_size, self.window_size), num_heads=num_heads, qkv_bias=qkv_bias,
             attn_drop=attn_drop, proj_drop=drop, qk_ratio=qk_ratio, sr_ratio=sr_ratio)
 
-        self.attn = Attention(
-            dim, num_heads=num_heads, qkv_bias=qkv_bias, qk_scale=qk_scale,
-            attn_drop=attn_drop, proj_drop=drop, qk_ratio=qk_ratio, sr_ratio=sr_ratio)
+        # 全局注意力分支: 'sr' 为空间缩减注意力（需要 relative_pos），'bra' 为双层路由注意力（BRA.py），
+        # 'linear' 为线性复杂度的核函数注意力（linear_attention.py，relative_pos 为低秩近似）
+        assert global_attn in ('sr', 'bra', 'linear'), "unknown global_attn {}".format(global_attn)
+        self.global_attn = global_attn
+        if global_attn == 'bra':
+            # BRA 依赖 einops，只在使用时导入
+            from BRA import BiLevelRoutingAttention
+            self.attn = BiLevelRoutingAttention(
+                dim, num_heads=num_heads, n_win=n_win, qk_scale=qk_scale, topk=topk, side_dwconv=3, auto_pad=True)
+        elif global_attn == 'linear':
+            self.attn = LinearAttention(
+                dim, num_heads=num_heads, qkv_bias=qkv_bias, qk_scale=qk_scale,
+                attn_drop=attn_drop, proj_drop=drop, qk_ratio=qk_ratio, sr_ratio=sr_ratio)
+        else:
+            self.attn = Attention(
+                dim, num_heads=num_heads, qkv_bias=qkv_bias, qk_scale=qk_scale,
+                attn_drop=attn_drop, proj_drop=drop, qk_ratio=qk_ratio, sr_ratio=sr_ratio)
         # NOTE: drop path for stochastic depth, we shall see if this is better than dropout here
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
         self.norm2 = norm_layer(dim)
@@ -441,6 +490,13 @@ class Block(nn.Module):
         self.ca_att = CoordAtt(dim, dim)      # CA Attention
         # self.dropout = nn.Dropout(drop)
 
+    def _token_merge(self, x, H, W):
+        """tome_ratio > 0 时由 x 的相似度匹配要合并的 token，没有可合并的 token 时返回 None"""
+        if self.tome_ratio <= 0:
+            return None
+        tome = TokenMerge(x, int(H * W * self.tome_ratio))
+        return tome if tome.r > 0 else None
+
     def forward(self, x, H, W, relative_pos):
         B, N, C = x.shape   # [B, 3136, 64]
         cnn_feat = x.permute(0, 2, 1).reshape(B, C, H, W)   # [B, 64, 56, 56]
@@ -486,10 +542,20 @@ class Block(nn.Module):
 
         x = x.view(B, H * W, C)
         x = shortcut + self.drop_path(x)
-        x = x + self.drop_path(self.ffn(self.norm2(x)))
+        tome = self._token_merge(x, H, W)
+        if tome is not None:
+            x = x + self.drop_path(tome.unmerge(self.ffn(tome.merge(self.norm2(x)))))
+        else:
+            x = x + self.drop_path(self.ffn(self.norm2(x)))
 
 
-        x = x + self.drop_path(self.attn(self.norm1(x), H, W, relative_pos))
+        if self.global_attn == 'bra':
+            # BRA 按窗口路由，需要完整的 H × W 布局，不做 token 合并
+            x = x + self.drop_path(self.attn(self.norm1(x), H, W))
+        else:
+            # FFN 改变了 x，全局注意力分支的合并在 FFN 之后的 x 上重新匹配
+            tome = self._token_merge(x, H, W)
+            x = x + self.drop_path(self.attn(self.norm1(x), H, W, relative_pos, tome))
         x = x + self.drop_path(self.mlp(self.norm2(x), H, W))    # [B, 3136, 64]
 
 
@@ -530,6 +596,36 @@ class PatchEmbed(nn.Module):
         return x, (H, W)
 
 
+class ExitHead(nn.Module):
+    """早退分类头：LayerNorm + token 平均池化 + Linear，参数量和计算量都很小"""
+
+    def __init__(self, dim, num_classes):
+        super().__init__()
+        self.norm = nn.LayerNorm(dim)
+        self.head = nn.Linear(dim, num_classes)
+
+    def forward(self, x):
+        # x: [B, N, C]
+        return self.head(self.norm(x).mean(dim=1))
+
+
+def select_exits(exit_logits, thresholds):
+    """
+    按早退规则从各出口的 logits 中选出每个样本的结果：取第一个 softmax 最大概率 >= 阈值的出口，
+    都不满足时取最后一个出口。与 CoorLGNet.forward_early_exit 的结果相同，用于由 forward_exits 的输出调阈值。
+    Returns:
+        logits: [B, num_classes]
+        exit_ids: [B]，0..len(thresholds)
+    """
+    logits = exit_logits[-1].clone()
+    exit_ids = torch.full((logits.shape[0],), len(exit_logits) - 1, dtype=torch.long, device=logits.device)
+    undecided = torch.ones_like(exit_ids, dtype=torch.bool)
+    for k, threshold in enumerate(thresholds):
+        done = undecided & (F.softmax(exit_logits[k].float(), dim=-1).max(dim=-1)[0] >= threshold)
+        logits[done] = exit_logits[k][done].to(logits.dtype)
+        exit_ids[done] = k
+        undecided &= ~done
+    return logits, exit_ids
 
 
 class CoorLGNet(nn.Module):
@@ -538,8 +634,13 @@ class CoorLGNet(nn.Module):
                  num_heads=[1, 2, 4, 8], mlp_ratios=[3.6, 3.6, 3.6, 3.6], qkv_bias=True, qk_scale=None,
                  representation_size=None,
                  drop_rate=0.2, attn_drop_rate=0., drop_path_rate=0., hybrid_backbone=None, norm_layer=None,
-                 depths=[2, 2, 10, 2], qk_ratio=1, sr_ratios=[8, 4, 2, 1], dp=0.1):
+                 depths=[2, 2, 10, 2], qk_ratio=1, sr_ratios=[8, 4, 2, 1], dp=0.1, init='normal',
+                 early_exits=False, exit_c_block=7, exit_thresholds=(0.9, 0.9), window_size=7,
+                 tome_ratios=(0., 0., 0., 0.), global_attn='sr', bra_n_win=None, bra_topk=(1, 4, 16, -1),
+                 attn_mem_budget_mb=None, attn_checkpoint=False, linear_rank=4):
         super().__init__()
+        # init != 'normal' 时参数随后会被 checkpoint 覆盖，不做随机初始化（见 _create_model）
+        assert init in ('normal', 'skip', 'meta'), "unknown init mode {}".format(init)
         self.num_classes = num_classes
         self.num_features = self.embed_dim = embed_dims[-1]
         norm_layer = norm_layer or partial(nn.LayerNorm, eps=1e-6)
@@ -567,47 +668,68 @@ class CoorLGNet(nn.Module):
         self.patch_embed_d = PatchEmbed(
             img_size=img_size // 16, patch_size=2, in_chans=embed_dims[2], embed_dim=embed_dims[3])
 
-        self.relative_pos_a = nn.Parameter(torch.randn(
-            num_heads[0], self.patch_embed_a.num_patches,     #  torch.randn(1, 3136, 49)
-            self.patch_embed_a.num_patches // sr_ratios[0] // sr_ratios[0]))
-        self.relative_pos_b = nn.Parameter(torch.randn(
-            num_heads[1], self.patch_embed_b.num_patches,
-            self.patch_embed_b.num_patches // sr_ratios[1] // sr_ratios[1]))
-        self.relative_pos_c = nn.Parameter(torch.randn(
-            num_heads[2], self.patch_embed_c.num_patches,
-            self.patch_embed_c.num_patches // sr_ratios[2] // sr_ratios[2]))
-        self.relative_pos_d = nn.Parameter(torch.randn(
-            num_heads[3], self.patch_embed_d.num_patches,
-            self.patch_embed_d.num_patches // sr_ratios[3] // sr_ratios[3]))
-
-        dpr = [x.item() for x in torch.linspace(0, drop_path_rate, sum(depths))]  # stochastic depth decay rule
+        # 每个阶段的全局注意力: 'sr'、'bra' 或 'linear'
+        global_attns = list(global_attn) if isinstance(global_attn, (list, tuple)) else [global_attn] * 4
+        # BRA 的窗口数: 默认让 224 输入时每个窗口为 8/4/2/1 个 token 见方，分辨率变大时窗口数随之增加；
+        # topk 为每个 query 窗口路由到的窗口数，-1 表示全部窗口
+        resolutions = [img_size // 4, img_size // 8, img_size // 16, img_size // 32]
+        n_wins = list(bra_n_win) if bra_n_win is not None else \
+            [max(1, math.ceil(r / w)) for r, w in zip(resolutions, [8, 4, 2, 1])]
+        topks = [n * n if k < 0 else min(k, n * n) for k, n in zip(bra_topk, n_wins)]
+
+        randn = torch.randn if init == 'normal' else torch.empty
+
+        def make_relative_pos(i, patch_embed):
+            # 'sr': [heads, N, N / sr^2] 的偏置；'linear': 低秩近似（LowRankRelativePos）；'bra' 不使用
+            if global_attns[i] == 'sr':
+                return nn.Parameter(randn(
+                    num_heads[i], patch_embed.num_patches,     #  torch.randn(1, 3136, 49)
+                    patch_embed.num_patches // sr_ratios[i] // sr_ratios[i]))
+            if global_attns[i] == 'linear':
+                H, W = (n // p for n, p in zip(patch_embed.img_size, patch_embed.patch_size))
+                return LowRankRelativePos(num_heads[i], (H, W), (H // sr_ratios[i], W // sr_ratios[i]), linear_rank)
+            return None
+
+        self.relative_pos_a = make_relative_pos(0, self.patch_embed_a)
+        self.relative_pos_b = make_relative_pos(1, self.patch_embed_b)
+        self.relative_pos_c = make_relative_pos(2, self.patch_embed_c)
+        self.relative_pos_d = make_relative_pos(3, self.patch_embed_d)
+
+        # W-MSA 的窗口大小，可以每个阶段单独指定
+        window_sizes = list(window_size) if isinstance(window_size, (list, tuple)) else [window_size] * 4
+
+        dpr = [x.item() for x in torch.linspace(0, drop_path_rate, sum(depths), device="cpu")]  # stochastic depth decay rule
         cur = 0
         self.blocks_a = nn.ModuleList([
             Block(
                 dim=embed_dims[0], num_heads=num_heads[0], mlp_ratio=mlp_ratios[0], qkv_bias=qkv_bias,
                 qk_scale=qk_scale, drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[cur + i],
-                norm_layer=norm_layer, qk_ratio=qk_ratio, sr_ratio=sr_ratios[0], window_size=7)
+                norm_layer=norm_layer, qk_ratio=qk_ratio, sr_ratio=sr_ratios[0], window_size=window_sizes[0],
+                global_attn=global_attns[0], n_win=n_wins[0], topk=topks[0])
             for i in range(depths[0])])
         cur += depths[0]
         self.blocks_b = nn.ModuleList([
             Block(
                 dim=embed_dims[1], num_heads=num_heads[1], mlp_ratio=mlp_ratios[1], qkv_bias=qkv_bias,
                 qk_scale=qk_scale, drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[cur + i],
-                norm_layer=norm_layer, qk_ratio=qk_ratio, sr_ratio=sr_ratios[1], window_size=7)
+                norm_layer=norm_layer, qk_ratio=qk_ratio, sr_ratio=sr_ratios[1], window_size=window_sizes[1],
+                global_attn=global_attns[1], n_win=n_wins[1], topk=topks[1])
             for i in range(depths[1])])
         cur += depths[1]
         self.blocks_c = nn.ModuleList([
             Block(
                 dim=embed_dims[2], num_heads=num_heads[2], mlp_ratio=mlp_ratios[2], qkv_bias=qkv_bias,
                 qk_scale=qk_scale, drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[cur + i],
-                norm_layer=norm_layer, qk_ratio=qk_ratio, sr_ratio=sr_ratios[2], window_size=7)
+                norm_layer=norm_layer, qk_ratio=qk_ratio, sr_ratio=sr_ratios[2], window_size=window_sizes[2],
+                global_attn=global_attns[2], n_win=n_wins[2], topk=topks[2])
             for i in range(depths[2])])
         cur += depths[2]
         self.blocks_d = nn.ModuleList([
             Block(
                 dim=embed_dims[3], num_heads=num_heads[3], mlp_ratio=mlp_ratios[3], qkv_bias=qkv_bias,
                 qk_scale=qk_scale, drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[cur + i],
-                norm_layer=norm_layer, qk_ratio=qk_ratio, sr_ratio=sr_ratios[3], window_size=7)
+                norm_layer=norm_layer, qk_ratio=qk_ratio, sr_ratio=sr_ratios[3], window_size=window_sizes[3],
+                global_attn=global_attns[3], n_win=n_wins[3], topk=topks[3])
             for i in range(depths[3])])
 
         # Representation layer
@@ -627,7 +749,21 @@ class CoorLGNet(nn.Module):
         self._avg_pooling = nn.AdaptiveAvgPool2d(1)
         self._drop = nn.Dropout(dp)
         self.head = nn.Linear(fc_dim, num_classes) if num_classes > 0 else nn.Identity()
-        self.apply(self._init_weights)
+
+        # 早退出口：stage b 之后、stage c 的第 exit_c_block 个 block 之后（见 forward_exits / forward_early_exit）
+        self.num_exits = 3 if early_exits else 1
+        if early_exits:
+            assert 0 <= exit_c_block < depths[2] - 1, \
+                "exit_c_block should be in [0, {}), got {}".format(depths[2] - 1, exit_c_block)
+            self.exit_c_block = exit_c_block
+            self.exit_thresholds = tuple(exit_thresholds)
+            self.exit_b = ExitHead(embed_dims[1], num_classes)
+            self.exit_c = ExitHead(embed_dims[2], num_classes)
+        if init == 'normal':
+            self.apply(self._init_weights)
+        self.set_token_merging(tome_ratios)
+        self.set_attention_chunking(attn_mem_budget_mb, attn_checkpoint)
+        self._profiler = None
 
     def _init_weights(self, m):
         if isinstance(m, nn.Linear):
@@ -650,6 +786,41 @@ class CoorLGNet(nn.Module):
             if isinstance(m, Attention):
                 m.update_temperature()
 
+    def set_token_merging(self, ratios):
+        """设置每个阶段的 token 合并比例（无需重新训练即可使用），如 [0, 0.3, 0.3, 0]"""
+        for s, ratio in zip(('a', 'b', 'c', 'd'), ratios):
+            for blk in getattr(self, 'blocks_' + s):
+                blk.tome_ratio = ratio
+
+    def set_attention_chunking(self, mem_budget_mb=None, checkpoint=False):
+        """
+        按 query 分块计算 Attention / WindowAttention / BiLevelRoutingAttention 的注意力（见 chunked_attention.py）。
+        mem_budget_mb: 每块注意力分数的内存上限（MB），块大小按输入形状自动选取，None 表示不分块
+        checkpoint: 训练时每块只保存输入，反向时重算注意力分数
+        """
+        mem_budget = int(mem_budget_mb * 2 ** 20) if mem_budget_mb else None
+        for m in self.modules():
+            if hasattr(m, 'attn_checkpoint'):
+                m.mem_budget = mem_budget
+                m.attn_checkpoint = checkpoint
+
+    def enable_profiling(self, level='branch', trace=False, sync=True):
+        """
+        在各阶段 / Block / 分支上注册计时 hook（见 profiling.py），返回 ModelProfiler，
+        用 profiler.report() 查看结果。再次调用会替换之前的 profiler。
+        """
+        from profiling import ModelProfiler
+        self.disable_profiling()
+        self._profiler = ModelProfiler(self, level=level, trace=trace, sync=sync)
+        return self._profiler
+
+    def disable_profiling(self):
+        """移除所有 hook，返回之前的 profiler（已收集的数据仍可读取）"""
+        profiler, self._profiler = self._profiler, None
+        if profiler is not None:
+            profiler.remove()
+        return profiler
+
     @torch.jit.ignore
     def no_weight_decay(self):
         return {'pos_embed', 'cls_token'}
@@ -727,6 +898,105 @@ class CoorLGNet(nn.Module):
         x = self.head(x)
         return x
 
+    def _forward_stem(self, x):
+        x = self.stem_norm1(self.stem_relu1(self.stem_conv1(x)))
+        x = self.stem_norm2(self.stem_relu2(self.stem_conv2(x)))
+        x = self.stem_norm3(self.stem_relu3(self.stem_conv3(x)))
+        return x
+
+    def _forward_stage(self, x, stage, H=None, W=None, start=0, end=None):
+        """start == 0 时 x 为上一阶段的特征图 [B, C, H, W]，先做 patch embedding；否则 x 为 token [B, N, C]"""
+        if start == 0:
+            x, (H, W) = getattr(self, 'patch_embed_' + stage)(x)
+        blocks = getattr(self, 'blocks_' + stage)
+        relative_pos = getattr(self, 'relative_pos_' + stage)
+        for i in range(start, len(blocks) if end is None else end):
+            x = blocks[i](x, H, W, relative_pos)
+        return x, (H, W)
+
+    @staticmethod
+    def _to_map(x, H, W):
+        return x.reshape(x.shape[0], H, W, -1).permute(0, 3, 1, 2).contiguous()
+
+    def _forward_head(self, x, H, W):
+        B, N, C = x.shape
+        x = self._fc(x.permute(0, 2, 1).reshape(B, C, H, W))
+        x = self._avg_pooling(self._swish(self._bn(x))).flatten(start_dim=1)
+        return self.head(self.pre_logits(self._drop(x)))
+
+    def forward_exits(self, x):
+        """完整前向，返回 [exit_b 的 logits, exit_c 的 logits, 最终 logits]，训练时用于联合损失"""
+        assert self.num_exits > 1, "model was built without early_exits"
+        x = self._forward_stem(x)
+        x, (H, W) = self._forward_stage(x, 'a')
+        x, (H, W) = self._forward_stage(self._to_map(x, H, W), 'b')
+        logits_b = self.exit_b(x)
+        x, (H, W) = self._forward_stage(self._to_map(x, H, W), 'c', end=self.exit_c_block + 1)
+        logits_c = self.exit_c(x)
+        x, (H, W) = self._forward_stage(x, 'c', H, W, start=self.exit_c_block + 1)
+        x, (H, W) = self._forward_stage(self._to_map(x, H, W), 'd')
+        return [logits_b, logits_c, self._forward_head(x, H, W)]
+
+    def forward_early_exit(self, x, thresholds=None):
+        """
+        推理时的早退前向（需要 eval 模式）：样本在第一个 softmax 最大概率 >= 阈值的出口处输出，
+        并从 batch 中移除，后面的阶段只计算剩下的样本。
+        Returns:
+            logits: [B, num_classes]
+            exit_ids: [B]，0: exit_b, 1: exit_c, 2: 最终的 head
+        """
+        assert self.num_exits > 1, "model was built without early_exits"
+        thresholds = self.exit_thresholds if thresholds is None else thresholds
+        B = x.shape[0]
+        index = torch.arange(B, device=x.device)
+        logits = exit_ids = None
+
+        def take(k, out, x, index):
+            nonlocal logits, exit_ids
+            if logits is None:
+                logits = out.new_zeros(B, out.shape[-1])
+                exit_ids = torch.full((B,), self.num_exits - 1, dtype=torch.long, device=x.device)
+            if k == self.num_exits - 1:
+                logits[index] = out
+                return x, index
+            done = F.softmax(out.float(), dim=-1).max(dim=-1)[0] >= thresholds[k]
+            logits[index[done]] = out[done]
+            exit_ids[index[done]] = k
+            return x[~done], index[~done]
+
+        x = self._forward_stem(x)
+        x, (H, W) = self._forward_stage(x, 'a')
+        x, (H, W) = self._forward_stage(self._to_map(x, H, W), 'b')
+        x, index = take(0, self.exit_b(x), x, index)
+        if index.numel() > 0:
+            x, (H, W) = self._forward_stage(self._to_map(x, H, W), 'c', end=self.exit_c_block + 1)
+            x, index = take(1, self.exit_c(x), x, index)
+        if index.numel() > 0:
+            x, (H, W) = self._forward_stage(x, 'c', H, W, start=self.exit_c_block + 1)
+            x, (H, W) = self._forward_stage(self._to_map(x, H, W), 'd')
+            take(2, self._forward_head(x, H, W), x, index)
+        if self._profiler is not None:
+            # 提前结束的阶段不会执行到最后一个 Block 的 hook
+            self._profiler.close_open_spans(self.training)
+        return logits, exit_ids
+
+    def exit_flops(self, img_size=224):
+        """每个出口处输出一个样本所需的前向 FLOPs，用于估计早退后的平均计算量；需要 torch.utils.flop_counter"""
+        from torch.utils.flop_counter import FlopCounterMode
+        training = self.training
+        self.eval()
+        x = torch.zeros(1, 3, img_size, img_size, device=self.head.weight.device)
+        flops = []
+        for k in range(self.num_exits):
+            # 阈值 0 一定在该出口退出，大于 1 一定不退出
+            thresholds = [2.] * k + [0.] * (self.num_exits - 1 - k)
+            counter = FlopCounterMode(display=False)
+            with torch.no_grad(), counter:
+                self.forward_early_exit(x, thresholds)
+            flops.append(counter.get_total_flops())
+        self.train(training)
+        return flops
+
 
 def resize_pos_embed(posemb, posemb_new):
     # Rescale the grid of position embeddings when loading from state_dict. Adapted from
@@ -754,6 +1024,7 @@ def checkpoint_filter_fn(state_dict, model):
     if 'model' in state_dict:
         # For deit models
         state_dict = state_dict['model']
+    model_state = model.state_dict()
     for k, v in state_dict.items():
         if 'patch_embed.proj.weight' in k and len(v.shape) < 4:
             # For old models that I trained prior to conv based patchification
@@ -762,17 +1033,95 @@ def checkpoint_filter_fn(state_dict, model):
         elif k == 'pos_embed' and v.shape != model.pos_embed.shape:
             # To resize pos embedding when using model at different size from pretrained weights
             v = resize_pos_embed(v, model.pos_embed)
+        elif k.startswith('relative_pos_') and isinstance(getattr(model, k, None), LowRankRelativePos):
+            # 'sr' 模型的 relative_pos 转换为 'linear' 阶段的低秩近似
+            for name, factor in getattr(model, k).factorize(v).items():
+                out_dict[k + '.' + name] = factor
+            continue
+        elif k.startswith('relative_pos_') and k.endswith(('.pos_q', '.pos_k')) \
+                and k in model_state and v.shape != model_state[k].shape:
+            # 低秩位置图与输入分辨率无关，模型以新的 img_size 构建时双线性插值（如 224 训练的权重用于 448 的模型）
+            v = F.interpolate(v.float(), size=model_state[k].shape[-2:], mode='bilinear',
+                              align_corners=False).to(v.dtype)
         out_dict[k] = v
     return out_dict
 
 
+def load_state_dict_assign_supported():
+    """load_state_dict(..., assign=True) 需要 PyTorch 2.1"""
+    return 'assign' in inspect.signature(nn.Module.load_state_dict).parameters
+
+
+def meta_init_supported():
+    """init='meta' 需要 torch.device 作为上下文管理器（2.0）以及 load_state_dict 的 assign 参数（2.1）"""
+    return hasattr(torch.device, '__enter__') and load_state_dict_assign_supported()
+
+
+def skip_init_supported():
+    """init='skip' 需要 torch.device 作为上下文管理器（2.0），在 meta device 上构建后 to_empty"""
+    return hasattr(torch.device, '__enter__')
+
+
+@contextmanager
+def init_context(init='normal'):
+    """
+    'skip' / 'meta': 在 meta device 上构建，nn.init 和 randn 作用在 meta tensor 上，不计算也不分配内存。
+    'meta' 的参数随后由 load_state_dict(assign=True) 直接绑定到 checkpoint 的 tensor；
+    'skip' 由 _create_model 在构建后 to_empty 分配（未初始化的）内存，再拷贝 checkpoint。
+    torch.device 上下文只作用于当前线程，不替换 torch.nn.init 等全局函数，其他线程同时构建模型不受影响。
+    """
+    if init == 'normal':
+        yield
+        return
+    if init == 'meta':
+        assert meta_init_supported(), "init='meta' requires PyTorch 2.1, use init='skip'"
+    else:
+        assert skip_init_supported(), "init='skip' requires PyTorch 2.0, use init='normal'"
+    with torch.device('meta'):
+        yield
+
+
+def load_checkpoint(model, checkpoint, strict=True):
+    """
+    checkpoint: state_dict、torch.save 保存的 .pth 或 tensorfile.py 的 tensor 文件。
+    先经过 checkpoint_filter_fn: 'sr' 权重加载到 'linear' 阶段时转换 relative_pos，img_size 不同时插值低秩位置图。
+    支持 assign 的版本（2.1+）参数直接绑定到 checkpoint 中的 tensor（assign=True），不再拷贝到已分配的参数中。
+    """
+    if isinstance(checkpoint, str):
+        from tensorfile import is_tensorfile, load_tensorfile
+        if is_tensorfile(checkpoint):
+            state_dict, _ = load_tensorfile(checkpoint)
+        else:
+            try:
+                state_dict = torch.load(checkpoint, map_location='cpu', mmap=True)
+            except (TypeError, RuntimeError):
+                # 旧版本 PyTorch 或旧的非 zip 格式不支持 mmap
+                state_dict = torch.load(checkpoint, map_location='cpu')
+    else:
+        state_dict = checkpoint
+    state_dict = checkpoint_filter_fn(state_dict, model)
+    if load_state_dict_assign_supported():
+        msg = model.load_state_dict(state_dict, strict=strict, assign=True)
+    else:
+        msg = model.load_state_dict(state_dict, strict=strict)
+    meta = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    assert len(meta) == 0, "parameters not found in checkpoint: {}".format(meta)
+    return msg
+
+
+# 决定参数形状或推理行为的构造参数，与权重一起保存（model.model_config），加载时按它重建结构
+ARCH_KEYS = ('num_classes', 'img_size', 'embed_dims', 'stem_channel', 'num_heads', 'depths', 'mlp_ratios',
+             'qkv_bias', 'qk_ratio', 'sr_ratios', 'window_size', 'global_attn', 'bra_n_win', 'bra_topk',
+             'linear_rank', 'early_exits', 'exit_c_block', 'exit_thresholds')
+
+
 def _create_model(pretrained=False, distilled=False, **kwargs):
     default_cfg = _cfg()
     default_num_classes = default_cfg['num_classes']
     default_img_size = default_cfg['input_size'][-1]
 
     num_classes = kwargs.pop('num_classes', default_num_classes)
-    print("num_classes:", num_classes)
+    _logger.info("num_classes: %d", num_classes)
     img_size = kwargs.pop('img_size', default_img_size)
     repr_size = kwargs.pop('representation_size', None)
     if repr_size is not None and num_classes != default_num_classes:
@@ -781,26 +1130,58 @@ def _create_model(pretrained=False, distilled=False, **kwargs):
         _logger.warning("Removing representation layer for fine-tuning.")
         repr_size = None
 
-    model = CoorLGNet(img_size=img_size, num_classes=num_classes, representation_size=repr_size, **kwargs)
+    # init='skip'/'meta' 时不做随机初始化，直接从 checkpoint 得到参数，启动时间和峰值内存约等于 checkpoint 大小
+    init = kwargs.pop('init', 'normal')
+    checkpoint = kwargs.pop('checkpoint', None)
+    assert init == 'normal' or checkpoint is not None, "init='{}' requires a checkpoint".format(init)
+
+    with init_context(init):
+        model = CoorLGNet(img_size=img_size, num_classes=num_classes, representation_size=repr_size, init=init,
+                          **kwargs)
+    if init == 'skip':
+        model.to_empty(device='cpu')
     model.default_cfg = default_cfg
+    model.model_config = dict((k, v) for k, v in dict(kwargs, num_classes=num_classes, img_size=img_size).items()
+                              if k in ARCH_KEYS)
+    if checkpoint is not None:
+        load_checkpoint(model, checkpoint)
 
     if pretrained:
+        from timm.models.helpers import load_pretrained
         load_pretrained(
             model, num_classes=num_classes, in_chans=kwargs.get('in_chans', 3),
             filter_fn=partial(checkpoint_filter_fn, model=model))
     return model
 
+_model_entrypoints = []
+
+
+def register_model(fn):
+    """记录模型入口；只有 timm 已经被导入时才注册到 timm 的 registry，避免为此导入整个 timm"""
+    _model_entrypoints.append(fn)
+    if 'timm' in sys.modules:
+        from timm.models.registry import register_model as timm_register_model
+        timm_register_model(fn)
+    return fn
 
 
+def register_timm_models():
+    """在导入本模块之后才导入 timm 的情况下，手动把模型注册到 timm（timm.create_model('coorlgnet')）"""
+    from timm.models.registry import register_model as timm_register_model, is_model
+    for fn in _model_entrypoints:
+        if not is_model(fn.__name__):
+            timm_register_model(fn)
 
 
 @register_model
 def coorlgnet(pretrained=False, **kwargs):
 
-    print("Constructing CoorLGNet......")
+    _logger.info("Constructing CoorLGNet......")
     model_kwargs = dict(
         qkv_bias=True, embed_dims=[64, 128, 256, 512], stem_channel=32, num_heads=[1, 2, 4, 8],
-        depths=[3, 3, 16, 3], mlp_ratios=[4, 4, 4, 4], qk_ratio=1, sr_ratios=[8, 4, 2, 1], **kwargs)
+        depths=[3, 3, 16, 3], mlp_ratios=[4, 4, 4, 4], qk_ratio=1, sr_ratios=[8, 4, 2, 1])
+    # 保存的 model_config 中的结构参数（如 nas.py 搜索出的结构）覆盖默认值
+    model_kwargs.update(kwargs)
     model = _create_model(pretrained=pretrained, **model_kwargs)
     return model
 
@@ -0,0 +1,121 @@
+"""
+后台验证：epoch 结束时把权重复制到 CPU 交给单独的验证进程，训练线程马上开始下一个 epoch，
+验证结果在之后的 epoch 边界（poll）或训练结束时（drain）取回。
+
+    evaluator = BackgroundEvaluator(evaluate, model_fn, val_dataset, batch_size=8)
+    evaluator.submit(epoch, model, subset=False)
+    for epoch, subset, val_loss, val_acc, state in evaluator.poll():
+        ...
+    evaluator.close()
+
+验证进程用 model_fn() 构建一次模型（model_fn 需要可以 pickle，如 functools.partial(coorlgnet, ...)），
+之后每次只 load_state_dict；用 spawn 启动，CPU tensor 通过共享内存传递，不做序列化。
+同时在等待的验证最多 max_pending 个，验证比训练慢时 submit 会等待，避免快照在内存中堆积。
+eval_every / subset: 每 eval_every 个 epoch（以及最后一个 epoch）做一次完整验证，其余 epoch 在固定的随机子集上验证
+（subset_fraction 为 0 时跳过）；只有完整验证的结果用于选择最优模型。
+"""
+import queue
+import traceback
+import multiprocessing as mp
+
+import torch
+
+
+def eval_mode(epoch, epochs, eval_every=1, subset_fraction=0.):
+    """返回 'full'、'subset' 或 None（这个 epoch 不验证）"""
+    if (epoch + 1) % max(eval_every, 1) == 0 or epoch == epochs - 1:
+        return "full"
+    return "subset" if subset_fraction > 0 else None
+
+
+def subset_indices(num_samples, fraction, seed=0):
+    """固定种子的随机子集，各 epoch 的子集验证结果可以互相比较"""
+    generator = torch.Generator().manual_seed(seed)
+    n = max(1, int(round(num_samples * fraction)))
+    return torch.randperm(num_samples, generator=generator)[:n].sort()[0].tolist()
+
+
+def _worker(eval_fn, model_fn, dataset, indices, batch_size, device, threads, eval_kwargs, tasks, results):
+    torch.set_num_threads(threads)
+    device = torch.device(device)
+    model = model_fn().to(device)
+    loaders = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        epoch, subset, state_dict = task
+        try:
+            if subset not in loaders:
+                data = torch.utils.data.Subset(dataset, indices) if subset else dataset
+                loaders[subset] = torch.utils.data.DataLoader(
+                    data, batch_size=batch_size, shuffle=False, num_workers=0, collate_fn=dataset.collate_fn)
+            model.load_state_dict(state_dict)
+            val_loss, val_acc = eval_fn(model, loaders[subset], device, epoch, progress=False, **eval_kwargs)
+            results.put((epoch, subset, val_loss, val_acc, None))
+        except Exception:
+            results.put((epoch, subset, None, None, traceback.format_exc()))
+
+
+class BackgroundEvaluator:
+    def __init__(self, eval_fn, model_fn, dataset, batch_size, device="cpu", threads=1, subset_fraction=0.,
+                 max_pending=1, **eval_kwargs):
+        """
+        eval_fn: train.evaluate，调用方式为 eval_fn(model, data_loader, device, epoch, progress=False, **eval_kwargs)
+        dataset: 验证集（MyDataSet），需要可以 pickle
+        """
+        ctx = mp.get_context("spawn")
+        self.max_pending = max_pending
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._pending = {}        # (epoch, subset) -> 提交的权重快照
+        self._ready = []
+        indices = subset_indices(len(dataset), subset_fraction) if subset_fraction > 0 else None
+        self._process = ctx.Process(
+            target=_worker, name="evaluator", daemon=True,
+            args=(eval_fn, model_fn, dataset, indices, batch_size, device, threads, eval_kwargs,
+                  self._tasks, self._results))
+        self._process.start()
+
+    def submit(self, epoch, model, subset=False):
+        while len(self._pending) >= self.max_pending:
+            self._ready.append(self._get(block=True))
+        state_dict = {k: v.detach().to("cpu", copy=True) for k, v in model.state_dict().items()}
+        self._pending[(epoch, subset)] = state_dict
+        self._tasks.put((epoch, subset, state_dict))
+
+    def _get(self, block):
+        while True:
+            try:
+                epoch, subset, val_loss, val_acc, error = self._results.get(timeout=5 if block else 0.)
+                break
+            except queue.Empty:
+                if not block:
+                    raise
+                if not self._process.is_alive():
+                    raise RuntimeError("evaluation process exited with code {}".format(self._process.exitcode))
+        state_dict = self._pending.pop((epoch, subset))
+        if error is not None:
+            raise RuntimeError("evaluation of epoch {} failed:\n{}".format(epoch, error))
+        return epoch, subset, val_loss, val_acc, state_dict
+
+    def poll(self):
+        """已经完成的验证结果 [(epoch, subset, val_loss, val_acc, state_dict)]，不等待"""
+        ready, self._ready = self._ready, []
+        while self._pending:
+            try:
+                ready.append(self._get(block=False))
+            except queue.Empty:
+                break
+        return ready
+
+    def drain(self):
+        """等待所有已提交的验证完成"""
+        ready, self._ready = self._ready, []
+        while self._pending:
+            ready.append(self._get(block=True))
+        return ready
+
+    def close(self):
+        self._tasks.put(None)
+        self._process.join()
@@ -0,0 +1,177 @@
+import io
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image
+
+from inference import build_transform, read_class_indices, load_model
+from tta import TTA
+
+
+class AsyncCoorLGNetPredictor:
+    """
+    在 asyncio 服务中直接嵌入模型的预测器。
+
+    predict() 把请求放入有界队列（队列满时 await 等待，形成背压），后台批处理协程把并发请求合并成 batch，
+    前向计算在专用线程中执行，图片解码/预处理在线程池中执行，事件循环不会被阻塞。
+
+    Args:
+        model: 已加载权重的 CoorLGNet
+        class_names: 类别名称列表，顺序与模型输出一致
+        transform: 预处理，默认与 predict.py 相同（Resize(256) + CenterCrop(224)）
+        max_batch_size: 每个 batch 最多的请求数
+        max_wait_ms: 收到第一个请求后，最多等待多久再执行前向
+        max_queue: 等待中的最大请求数
+        preprocess_workers: 解码/预处理线程数
+        batch_preprocess: 为 True 时不在每个请求上单独预处理，而是在执行前向前对整个 batch 一起预处理
+        tta: tta.TTA 实例或视图列表（如 ["hflip", "rot:10"]），整个 batch 的所有视图一次前向
+
+    例:
+        predictor = AsyncCoorLGNetPredictor.from_checkpoint("./weight/best.pth")
+        async with predictor:
+            result = await predictor.predict("mea1-H1.jpg", timeout=1.0)
+    """
+
+    def __init__(self, model, class_names, device="cpu", transform=None, max_batch_size=16, max_wait_ms=2.,
+                 max_queue=256, preprocess_workers=2, batch_preprocess=False, tta=None):
+        self.model = model
+        self.class_names = list(class_names)
+        self.device = torch.device(device)
+        self.transform = transform or build_transform()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.max_queue = max_queue
+        self.batch_preprocess = batch_preprocess
+        self.tta = TTA(tta) if isinstance(tta, (list, tuple)) else tta
+        self._preprocess_pool = ThreadPoolExecutor(max_workers=preprocess_workers,
+                                                   thread_name_prefix="coorlgnet-preprocess")
+        self._model_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coorlgnet-model")
+        self._queue = None
+        self._loop_task = None
+        self._inflight = None
+        self._batch_tasks = set()
+
+    @classmethod
+    def from_checkpoint(cls, weights_path, class_indices="./class_indices.json", device="cpu", **kwargs):
+        class_indict = read_class_indices(class_indices)
+        class_names = [class_indict[str(i)] for i in range(len(class_indict))]
+        model = load_model(weights_path, num_classes=len(class_names), device=device)
+        return cls(model, class_names, device=device, **kwargs)
+
+    async def start(self):
+        if self._loop_task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            # 最多一个 batch 在执行、一个 batch 在等待执行，其余请求留在队列中
+            self._inflight = asyncio.Semaphore(2)
+            self._loop_task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+            if self._batch_tasks:
+                await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.cancel()
+        self._preprocess_pool.shutdown(wait=False)
+        self._model_pool.shutdown(wait=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _load(self, image):
+        """image: 文件路径、图片字节、PIL.Image 或已预处理的 [C, H, W] tensor"""
+        if isinstance(image, torch.Tensor):
+            return image
+        if isinstance(image, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(image))
+        elif not isinstance(image, Image.Image):
+            image = Image.open(image)
+        return image.convert("RGB")
+
+    def _preprocess(self, image):
+        image = self._load(image)
+        return image if isinstance(image, torch.Tensor) else self.transform(image)
+
+    def _forward(self, inputs):
+        if self.batch_preprocess:
+            inputs = [self._preprocess(x) for x in inputs]
+        with torch.no_grad():
+            x = torch.stack(inputs, dim=0).to(self.device)
+            output = self.model(x) if self.tta is None else self.tta(self.model, x)
+            return torch.softmax(output.float(), dim=1).cpu().tolist()
+
+    async def predict(self, image, timeout=None):
+        """
+        返回 {"class", "prob", "probs"}；超时抛出 asyncio.TimeoutError，任务被取消时请求不会再被计算
+        """
+        if self._loop_task is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        if self.batch_preprocess:
+            item = image if isinstance(image, (Image.Image, torch.Tensor)) else \
+                await asyncio.wait_for(loop.run_in_executor(self._preprocess_pool, self._load, image), timeout)
+        else:
+            item = await asyncio.wait_for(loop.run_in_executor(self._preprocess_pool, self._preprocess, image),
+                                          timeout)
+
+        future = loop.create_future()
+        remaining = None if deadline is None else max(deadline - loop.time(), 0.)
+        await asyncio.wait_for(self._queue.put((item, future)), remaining)
+        remaining = None if deadline is None else max(deadline - loop.time(), 0.)
+        # wait_for 超时或外部取消时会取消 future，批处理协程会跳过已取消的请求
+        probs = await asyncio.wait_for(future, remaining)
+        idx = max(range(len(probs)), key=lambda i: probs[i])
+        return {"class": self.class_names[idx], "prob": probs[idx], "probs": dict(zip(self.class_names, probs))}
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            end = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = end - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._inflight.acquire()
+            # 等待期间超时/取消的请求不再计算
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if len(batch) == 0:
+                self._inflight.release()
+                continue
+            task = loop.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            probs = await loop.run_in_executor(self._model_pool, self._forward, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), p in zip(batch, probs):
+                if not future.done():
+                    future.set_result(p)
+        finally:
+            self._inflight.release()
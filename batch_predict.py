@@ -1,75 +1,143 @@
 import os
+import csv
+import sys
 import json
-import torch.nn as nn
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
-from PIL import Image
-from torchvision import transforms
-
-from eca_resnet import eca_resnet50
-
-
-def main():
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-
-    data_transform = transforms.Compose(
-        [transforms.Resize(256),
-         transforms.CenterCrop(224),
-         transforms.ToTensor(),
-         transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])])
-
-    # load image
-    # 指向需要遍历预测的图像文件夹
-    imgs_root = r"D:\pyCharmdata\Vit_myself_bu\datasets\test\defective1"
-    assert os.path.exists(imgs_root), f"file: '{imgs_root}' dose not exist."
-    # 读取指定文件夹下所有jpg图像路径
-    img_path_list = [os.path.join(imgs_root, i) for i in os.listdir(imgs_root) if i.endswith(".jpg")]
-
-    # read class_indict
-    json_path = './class_indices.json'
-    assert os.path.exists(json_path), f"file: '{json_path}' dose not exist."
-
-    json_file = open(json_path, "r")
-    class_indict = json.load(json_file)
-
-    # create model
-    model = eca_resnet50()
-
-    # load model weights
-    weights_path = "./weight/ECA_ResNet50_Myself.pth"
-    # assert os.path.exists(weights_path), "file: '{}' dose not exist.".format(weights_path)
-
-    in_channel = model.fc.in_features
-    model.fc = nn.Linear(in_channel, 28)
-
-    assert os.path.exists(weights_path), "file {} does not exist.".format(weights_path)
-    model.load_state_dict(torch.load(weights_path), False)
-    model.to(device)
-
-    # prediction
-    model.eval()
-    batch_size = 8  # 每次预测时将多少张图片打包成一个batch
-    with torch.no_grad():
-        for ids in range(0, len(img_path_list) // batch_size):
-            img_list = []
-            for img_path in img_path_list[ids * batch_size: (ids + 1) * batch_size]:
-                assert os.path.exists(img_path), f"file: '{img_path}' dose not exist."
-                img = Image.open(img_path)
-                img = data_transform(img)
-                img_list.append(img)
-
-            # batch img
-            # 将img_list列表中的所有图像打包成一个batch
-            batch_img = torch.stack(img_list, dim=0)
-            # predict class
-            output = model(batch_img.to(device)).cpu()
-            predict = torch.softmax(output, dim=1)
-            probs, classes = torch.max(predict, dim=1)
-
-            for idx, (pro, cla) in enumerate(zip(probs, classes)):
-                print("image: {}  class: {}  prob: {:.3}".format(img_path_list[ids * batch_size + idx],
-                                                                 class_indict[str(cla.numpy())],
-                                                                 pro.numpy()))
+
+from inference import (build_transform, read_class_indices, load_model, load_image, iter_image_paths,
+                       add_early_exit_args, forward_fn)
+
+
+def _decode(path, transform):
+    t0 = time.perf_counter()
+    try:
+        img, error = load_image(path, transform), None
+    except Exception as e:
+        img, error = None, "{}: {}".format(type(e).__name__, e)
+    return path, img, error, time.perf_counter() - t0
+
+
+def iter_decoded(paths, transform, num_workers, prefetch):
+    """
+    在线程池中提前解码、预处理图片，按输入顺序返回 (path, img, error, decode_time)。
+    最多只有 prefetch 张图片处于解码中/已解码未消费状态，保证内存占用不随输入规模增长。
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(_decode, path, transform))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class ResultWriter:
+    """根据后缀名写出 .jsonl 或 .csv 结果，每一行包含所有类别的概率"""
+
+    def __init__(self, output_path, class_indict):
+        self.class_names = [class_indict[str(i)] for i in range(len(class_indict))]
+        self.is_csv = output_path.endswith(".csv")
+        self.file = sys.stdout if output_path == "-" else open(output_path, "w", newline="")
+        if self.is_csv:
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(["path", "class", "prob"] + ["prob_" + c for c in self.class_names] + ["error"])
+
+    def write(self, path, probs=None, error=None):
+        if probs is None:
+            cla, prob, class_probs = "", "", [""] * len(self.class_names)
+        else:
+            idx = max(range(len(probs)), key=lambda i: probs[i])
+            cla, prob, class_probs = self.class_names[idx], probs[idx], probs
+        if self.is_csv:
+            self.writer.writerow([path, cla, prob] + list(class_probs) + [error or ""])
+        else:
+            record = {"path": path, "class": cla, "prob": prob,
+                      "probs": dict(zip(self.class_names, class_probs)) if probs is not None else None}
+            if error is not None:
+                record["error"] = error
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def main(args):
+    device = torch.device(args.device if args.device else ("cuda:0" if torch.cuda.is_available() else "cpu"))
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    class_indict = read_class_indices(args.class_indices)
+    model = load_model(args.weights, num_classes=len(class_indict), device=device)
+    forward = forward_fn(model, args.early_exit)
+    transform = build_transform(args.img_size)
+    writer = ResultWriter(args.output, class_indict)
+
+    num_images = num_failed = 0
+    decode_time = model_time = 0.
+    batch_paths, batch_imgs = [], []
+
+    def run_batch():
+        nonlocal model_time
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            output = forward(torch.stack(batch_imgs, dim=0).to(device))
+            predict = torch.softmax(output.float(), dim=1).cpu().tolist()
+        model_time += time.perf_counter() - t0
+        for path, probs in zip(batch_paths, predict):
+            writer.write(path, probs)
+        batch_paths.clear()
+        batch_imgs.clear()
+
+    start = time.perf_counter()
+    for path, img, error, t in iter_decoded(iter_image_paths(args.input), transform,
+                                            num_workers=args.workers,
+                                            prefetch=max(args.prefetch, args.batch_size)):
+        decode_time += t
+        if error is not None:
+            num_failed += 1
+            writer.write(path, error=error)
+            continue
+        num_images += 1
+        batch_paths.append(path)
+        batch_imgs.append(img)
+        if len(batch_imgs) == args.batch_size:
+            run_batch()
+    if len(batch_imgs) > 0:  # 最后一个不足 batch_size 的 batch
+        run_batch()
+    total_time = time.perf_counter() - start
+    writer.close()
+
+    print("{} images predicted, {} failed, {:.1f}s, {:.2f} images/sec".format(
+        num_images, num_failed, total_time, num_images / max(total_time, 1e-9)), file=sys.stderr)
+    print("decode: {:.1f}s total in {} threads, model: {:.1f}s ({:.1f}% of wall time)".format(
+        decode_time, args.workers, model_time, 100. * model_time / max(total_time, 1e-9)), file=sys.stderr)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    # 图片文件夹（递归遍历）或每行一个路径的列表文件
+    parser.add_argument('--input', type=str, required=True)
+    parser.add_argument('--weights', type=str, default='./weight/best.pth')
+    parser.add_argument('--class-indices', type=str, default='./class_indices.json')
+    # 结果文件，.jsonl 或 .csv，'-' 表示输出到 stdout（jsonl）
+    parser.add_argument('--output', type=str, default='predictions.jsonl')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1),
+                        help='number of decode threads')
+    parser.add_argument('--prefetch', type=int, default=256,
+                        help='max number of images decoded ahead of the model')
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads, 0 keeps the default')
+    parser.add_argument('--device', type=str, default='')
+    add_early_exit_args(parser)
+
+    opt = parser.parse_args()
+
+    main(opt)
@@ -0,0 +1,166 @@
+"""
+全局注意力分支对比：空间缩减注意力（'sr'）、双层路由注意力（'bra'）与线性注意力（'linear'）在不同输入分辨率下的
+参数量、FLOPs、batch 1 延迟（整个模型以及所有 Block 的全局注意力分支）、吞吐、训练时的激活内存，
+以及（给出 --data-path 时）短时间训练后的验证准确率。
+
+    python benchmarks/attn_compare.py --img-sizes 224 384 512 --variants sr bra sr,bra,bra,sr --threads 4
+    python benchmarks/attn_compare.py --img-sizes 224 320 448 640 --variants sr linear --plot attn_resolution.png
+    python benchmarks/attn_compare.py --img-sizes 224 --variants sr bra --data-path ./dataset --train-steps 300
+
+variant 为一个值（所有阶段相同）或逗号分隔的四个值（每个阶段）。
+'sr' 的 relative_pos 为 [heads, N, N / sr^2]，参数量和计算量随 token 数平方增长；'bra' 和 'linear' 的计算量随 token 数线性增长。
+--plot 把延迟和激活内存随分辨率的变化画成图。
+"""
+import os
+import sys
+import json
+import argparse
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from CoorLGNet import coorlgnet  # noqa: E402
+from bench_model import time_fn, summarize_ms, count_flops, activation_bytes  # noqa: E402
+
+
+def parse_variant(variant):
+    parts = variant.split(",")
+    assert len(parts) in (1, 4) and all(p in ("sr", "bra", "linear") for p in parts), "bad variant {}".format(variant)
+    return parts[0] if len(parts) == 1 else parts
+
+
+def build_loaders(data_path, img_size, batch_size):
+    from torchvision import transforms
+    from my_dataset import MyDataSet
+    from utils import read_split_data
+    train_images_path, train_images_label, val_images_path, val_images_label = read_split_data(data_path)
+    normalize = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    train_dataset = MyDataSet(train_images_path, train_images_label, transforms.Compose([
+        transforms.RandomResizedCrop(img_size), transforms.RandomHorizontalFlip(), transforms.ToTensor(), normalize]))
+    val_dataset = MyDataSet(val_images_path, val_images_label, transforms.Compose([
+        transforms.Resize(int(img_size * 256 / 224)), transforms.CenterCrop(img_size), transforms.ToTensor(),
+        normalize]))
+    return (torch.utils.data.DataLoader(train_dataset, batch_size=batch_size, shuffle=True,
+                                        collate_fn=train_dataset.collate_fn),
+            torch.utils.data.DataLoader(val_dataset, batch_size=batch_size, shuffle=False,
+                                        collate_fn=val_dataset.collate_fn))
+
+
+def run(args, img_size, variant):
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    model = coorlgnet(num_classes=args.num_classes, img_size=img_size, global_attn=parse_variant(variant))
+    model = model.to(device).eval()
+    result = {"img_size": img_size, "variant": variant,
+              "params_m": sum(p.numel() for p in model.parameters()) / 1e6}
+    flops = count_flops(model, torch.randn(1, 3, img_size, img_size, device=device))
+    result["gflops"] = flops["total"] / 1e9 if flops else None
+
+    x = torch.randn(1, 3, img_size, img_size, device=device)
+    with torch.no_grad():
+        result["latency_bs1_ms"] = summarize_ms(time_fn(lambda: model(x), device, args.warmup, args.iters))["median"]
+    # 全局注意力分支（所有 Block 的 attn）每次前向的耗时
+    profiler = model.enable_profiling(level='branch', sync=True)
+    with torch.no_grad():
+        for _ in range(args.iters):
+            model(x)
+    model.disable_profiling()
+    attn_row = [r for r in profiler.summary() if r["name"] == "all.attn" and r["mode"] == "eval"]
+    result["attn_ms"] = attn_row[0]["total_ms"] / args.iters if attn_row else None
+
+    x = torch.randn(args.batch_size, 3, img_size, img_size, device=device)
+    with torch.no_grad():
+        times = time_fn(lambda: model(x), device, 1, max(2, args.iters // 2))
+    result["images_per_s"] = args.batch_size * len(times) / sum(times)
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        with torch.no_grad():
+            model(x)
+        result["inference_peak_mb"] = torch.cuda.max_memory_allocated(device) / 2 ** 20
+    result["activation_mb"] = activation_bytes(model, x[:1], device, "fp32") / 2 ** 20
+
+    if args.data_path:
+        from nas import train_steps
+        from distill import accuracy
+        train_loader, val_loader = build_loaders(args.data_path, img_size, args.train_batch_size)
+        train_steps(model, train_loader, device, args.train_steps, args.lr, args.weight_decay)
+        result["val_acc"] = accuracy(model, val_loader, device)
+    return result
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    results = []
+    for img_size in args.img_sizes:
+        for variant in args.variants:
+            try:
+                r = run(args, img_size, variant)
+            except RuntimeError as e:  # 内存不足
+                r = {"img_size": img_size, "variant": variant, "error": str(e).splitlines()[0]}
+            results.append(r)
+            print(json.dumps(r), file=sys.stderr)
+
+    print("{:>8} {:16} {:>9} {:>8} {:>10} {:>9} {:>9} {:>10} {:>8}".format(
+        "img_size", "variant", "params M", "GFLOPs", "bs1 ms", "attn ms", "images/s", "act MB", "val acc"))
+    for r in results:
+        if "error" in r:
+            print("{:>8} {:16} {}".format(r["img_size"], r["variant"], r["error"]))
+            continue
+        print("{:>8} {:16} {:>9.1f} {:>8.2f} {:>10.1f} {:>9.1f} {:>9.2f} {:>10.1f} {:>8}".format(
+            r["img_size"], r["variant"], r["params_m"], r["gflops"] or float("nan"), r["latency_bs1_ms"],
+            r["attn_ms"] or float("nan"), r["images_per_s"], r["activation_mb"],
+            "{:.4f}".format(r["val_acc"]) if "val_acc" in r else "-"))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.plot:
+        plot(results, args.plot)
+
+
+def plot(results, path):
+    # 只有需要画图时才导入 matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    keys = (("latency_bs1_ms", "model latency, batch 1 (ms)"), ("attn_ms", "global attention branch (ms)"),
+            ("activation_mb", "training activations, batch 1 (MB)"))
+    fig, axes = plt.subplots(1, len(keys), figsize=(5 * len(keys), 4))
+    for ax, (key, title) in zip(axes, keys):
+        for variant in dict.fromkeys(r["variant"] for r in results):
+            rows = [r for r in results if r["variant"] == variant and r.get(key) is not None]
+            ax.plot([r["img_size"] for r in rows], [r[key] for r in rows], marker="o", label=variant)
+        ax.set_title(title)
+        ax.set_xlabel("input resolution")
+        ax.grid(True)
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(path)
+    print("plot saved to {}".format(path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img-sizes', type=int, nargs='+', default=[224, 384, 512])
+    parser.add_argument('--variants', type=str, nargs='+', default=['sr', 'bra'],
+                        help="'sr', 'bra', 'linear' or four comma separated values, e.g. sr,bra,bra,sr")
+    parser.add_argument('--num_classes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=5)
+    # 准确率：每个配置在该分辨率下短时间训练后在验证集上评估
+    parser.add_argument('--data-path', type=str, default='')
+    parser.add_argument('--train-steps', type=int, default=200)
+    parser.add_argument('--train-batch-size', type=int, default=8)
+    parser.add_argument('--lr', type=float, default=0.0005)
+    parser.add_argument('--weight_decay', type=float, default=1E-3)
+    parser.add_argument('--output', type=str, default='')
+    parser.add_argument('--plot', type=str, default='', help='save latency / memory vs resolution plot to this file')
+
+    opt = parser.parse_args()
+
+    main(opt)
@@ -0,0 +1,263 @@
+"""
+CoorLGNet（以及 upconstruction.cmt_*）性能基准，结果输出为 JSON。
+
+    # 测量
+    python benchmarks/bench_model.py --model coorlgnet --threads 4 --output base.json
+    python benchmarks/bench_model.py --model coorlgnet --threads 4 --precision bf16 --output bf16.json
+    # 对比两次结果
+    python benchmarks/bench_model.py --compare base.json bf16.json
+
+测量内容:
+    params / flops      各阶段（stem, blocks_a..d, head）的参数量和 batch 1 前向 FLOPs
+    latency_bs1_ms      batch 1 前向延迟（中位数、p90、最小值）
+    throughput          各 batch size 的前向吞吐（images/sec）
+    train_step_ms       训练一步（前向 + 反向 + AdamW）的耗时
+    memory              进程峰值 RSS、训练前向保存给反向的激活大小（CUDA 上另有峰值显存）
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import statistics
+from contextlib import nullcontext
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 模型顶层子模块/参数名前缀 -> 阶段
+STAGES = [
+    ("stem", ("stem_",)),
+    ("blocks_a", ("patch_embed_a", "relative_pos_a", "blocks_a")),
+    ("blocks_b", ("patch_embed_b", "relative_pos_b", "blocks_b")),
+    ("blocks_c", ("patch_embed_c", "relative_pos_c", "blocks_c")),
+    ("blocks_d", ("patch_embed_d", "relative_pos_d", "blocks_d")),
+    ("head", ("_fc", "_bn", "_swish", "_avg_pooling", "_drop", "pre_logits", "head")),
+]
+
+
+def stage_of(name):
+    top = name.split(".")[0]
+    for stage, prefixes in STAGES:
+        if any(top.startswith(p) for p in prefixes):
+            return stage
+    return "other"
+
+
+def build_model(name, num_classes, img_size):
+    if name == "coorlgnet":
+        from CoorLGNet import coorlgnet
+        return coorlgnet(num_classes=num_classes, img_size=img_size)
+    import upconstruction
+    assert hasattr(upconstruction, name), "unknown model {}".format(name)
+    return getattr(upconstruction, name)(num_classes=num_classes, img_size=img_size)
+
+
+def autocast(device, precision):
+    if precision == "fp32":
+        return nullcontext()
+    dtype = {"bf16": torch.bfloat16, "fp16": torch.float16}[precision]
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+
+def sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, device, warmup, iters):
+    for _ in range(warmup):
+        fn()
+    sync(device)
+    times = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        fn()
+        sync(device)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def summarize_ms(times):
+    times = sorted(t * 1000. for t in times)
+    return {"median": statistics.median(times), "p90": times[min(len(times) - 1, int(0.9 * len(times)))],
+            "min": times[0], "iters": len(times)}
+
+
+def count_params(model):
+    params = dict((stage, 0) for stage, _ in STAGES)
+    for name, p in model.named_parameters():
+        stage = stage_of(name)
+        params[stage] = params.get(stage, 0) + p.numel()
+    params["total"] = sum(params.values())
+    return params
+
+
+def count_flops(model, x):
+    try:
+        from torch.utils.flop_counter import FlopCounterMode
+    except ImportError:
+        return None
+    counter = FlopCounterMode(display=False)
+    with torch.no_grad(), counter:
+        model(x)
+    flops = dict((stage, 0) for stage, _ in STAGES)
+    root = type(model).__name__
+    for module_name, counts in counter.get_flop_counts().items():
+        parts = module_name.split(".")
+        # 只统计模型的直接子模块（以及 ModuleList 中的每个 block），避免父子模块重复计数
+        if parts[0] != root or len(parts) < 2:
+            continue
+        if parts[1].startswith("blocks_") and len(parts) != 3 or not parts[1].startswith("blocks_") and len(parts) != 2:
+            continue
+        stage = stage_of(parts[1])
+        flops[stage] = flops.get(stage, 0) + sum(counts.values())
+    flops["total"] = counter.get_total_flops()
+    return flops
+
+
+def activation_bytes(model, x, device, precision):
+    """训练模式前向时保存给反向的 tensor 总大小"""
+    total = [0]
+
+    def pack(t):
+        total[0] += t.numel() * t.element_size()
+        return t
+
+    model.train()
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t), autocast(device, precision):
+        out = model(x)
+    del out
+    model.eval()
+    return total[0]
+
+
+def run(args):
+    device = torch.device(args.device)
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model = build_model(args.model, args.num_classes, args.img_size).to(device).eval()
+    if args.attn_mem_budget or args.attn_checkpoint:
+        model.set_attention_chunking(args.attn_mem_budget, args.attn_checkpoint)
+
+    def inputs(batch_size):
+        return torch.randn(batch_size, 3, args.img_size, args.img_size, device=device)
+
+    result = {"meta": {"model": args.model, "img_size": args.img_size, "threads": args.threads,
+                       "precision": args.precision, "device": str(device), "torch": torch.__version__,
+                       "python": platform.python_version(), "machine": platform.processor() or platform.machine(),
+                       "attn_mem_budget": args.attn_mem_budget, "attn_checkpoint": args.attn_checkpoint,
+                       "time": time.strftime("%Y-%m-%d %H:%M:%S")}}
+    result["params"] = count_params(model)
+    result["flops"] = count_flops(model, inputs(1))
+
+    # batch 1 延迟
+    x = inputs(1)
+    with torch.no_grad(), autocast(device, args.precision):
+        times = time_fn(lambda: model(x), device, args.warmup, args.iters)
+    result["latency_bs1_ms"] = summarize_ms(times)
+
+    # 吞吐
+    result["throughput"] = {}
+    for batch_size in args.batch_sizes:
+        x = inputs(batch_size)
+        try:
+            with torch.no_grad(), autocast(device, args.precision):
+                times = time_fn(lambda: model(x), device, max(1, args.warmup // 2), max(2, args.iters // 4))
+        except RuntimeError as e:  # 显存/内存不足
+            result["throughput"][str(batch_size)] = None
+            print("batch size {}: {}".format(batch_size, e), file=sys.stderr)
+            break
+        result["throughput"][str(batch_size)] = batch_size / statistics.median(times)
+
+    # 训练一步
+    x, y = inputs(args.train_batch_size), torch.zeros(args.train_batch_size, dtype=torch.long, device=device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    loss_function = torch.nn.CrossEntropyLoss()
+
+    def train_step():
+        with autocast(device, args.precision):
+            loss = loss_function(model(x), y)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    model.train()
+    times = time_fn(train_step, device, max(1, args.warmup // 2), max(2, args.iters // 4))
+    model.eval()
+    result["train_step_ms"] = dict(summarize_ms(times), batch_size=args.train_batch_size)
+
+    # 内存
+    memory = {"activation_mb": {}}
+    for batch_size in sorted({1, args.train_batch_size}):
+        memory["activation_mb"][str(batch_size)] = \
+            activation_bytes(model, inputs(batch_size), device, args.precision) / 2 ** 20
+    if device.type == "cuda":
+        memory["cuda_peak_mb"] = torch.cuda.max_memory_allocated(device) / 2 ** 20
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    memory["peak_rss_mb"] = maxrss / 2 ** 20 if sys.platform == "darwin" else maxrss / 2 ** 10
+    result["memory"] = memory
+    return result
+
+
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = prefix + str(k)
+        if isinstance(v, dict):
+            out.update(flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(path_a, path_b):
+    with open(path_a) as f:
+        a = json.load(f)
+    with open(path_b) as f:
+        b = json.load(f)
+    for key in ("model", "threads", "precision", "device", "img_size"):
+        if a["meta"].get(key) != b["meta"].get(key):
+            print("{}: {} -> {}".format(key, a["meta"].get(key), b["meta"].get(key)))
+    fa, fb = flatten(a), flatten(b)
+    keys = [k for k in fa if k in fb and not k.startswith("meta.")]
+    width = max(len(k) for k in keys)
+    print("{:{w}}  {:>14}  {:>14}  {:>8}".format("metric", path_a, path_b, "change", w=width))
+    for k in keys:
+        change = "" if fa[k] == 0 else "{:+.1f}%".format(100. * (fb[k] - fa[k]) / fa[k])
+        print("{:{w}}  {:>14.4g}  {:>14.4g}  {:>8}".format(k, fa[k], fb[k], change, w=width))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='coorlgnet', help='coorlgnet or upconstruction.cmt_*')
+    parser.add_argument('--num_classes', type=int, default=2)
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'])
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64, 128])
+    parser.add_argument('--train-batch-size', type=int, default=8)
+    parser.add_argument('--attn-mem-budget', type=float, default=0, help='coorlgnet only, see set_attention_chunking')
+    parser.add_argument('--attn-checkpoint', action='store_true')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--output', type=str, default='', help='result json, printed to stdout if empty')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BASE', 'NEW'))
+
+    opt = parser.parse_args()
+
+    if opt.compare:
+        compare(*opt.compare)
+    else:
+        res = run(opt)
+        text = json.dumps(res, indent=4)
+        if opt.output:
+            with open(opt.output, "w") as f:
+                f.write(text)
+        print(text)
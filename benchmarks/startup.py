@@ -0,0 +1,95 @@
+"""
+推理冷启动基准：在全新的子进程中分别测量
+    import_s            导入 inference 模块（torch + CoorLGNet）
+    build_s             构建模型并加载权重
+    first_predict_s     第一次预测（含图片解码、预处理）
+    total_s             进程启动到得到第一个预测结果
+并检查推理路径上没有导入 timm / matplotlib / torchvision。
+
+    python benchmarks/startup.py --weights ./weight/best.pth --img-path mea1-H1.jpg --max-total-s 10
+超过阈值或导入了多余模块时返回非零退出码，可以放进 CI 中防止启动时间退化。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = r'''
+import sys, time, json
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+import torch
+torch.set_num_threads({threads})
+import inference
+t1 = time.perf_counter()
+class_indict = inference.read_class_indices({class_indices!r})
+if {weights!r}:
+    model = inference.load_model({weights!r}, num_classes=len(class_indict), device="cpu")
+else:
+    model = inference.coorlgnet(num_classes=len(class_indict)).eval()
+t2 = time.perf_counter()
+if {img_path!r}:
+    img = inference.load_image({img_path!r}, inference.build_transform())
+else:
+    img = torch.zeros(3, 224, 224)
+with torch.no_grad():
+    model(img.unsqueeze(0))
+t3 = time.perf_counter()
+heavy = [m for m in ("timm", "matplotlib", "torchvision") if m in sys.modules]
+print(json.dumps({{"import_s": t1 - t0, "build_s": t2 - t1, "first_predict_s": t3 - t2,
+                  "heavy_modules": heavy}}))
+'''
+
+
+def measure(args):
+    code = _CHILD.format(root=ROOT, threads=args.threads, class_indices=args.class_indices,
+                         weights=args.weights, img_path=args.img_path)
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, cwd=ROOT)
+    result = json.loads(out.stdout.decode().strip().splitlines()[-1])
+    result["total_s"] = time.perf_counter() - start
+    return result
+
+
+def main(args):
+    runs = [measure(args) for _ in range(args.repeat)]
+    keys = ["import_s", "build_s", "first_predict_s", "total_s"]
+    # 取最小值，减少磁盘缓存、系统负载的影响
+    summary = dict((k, min(r[k] for r in runs)) for k in keys)
+    summary["heavy_modules"] = runs[0]["heavy_modules"]
+    summary["repeat"] = args.repeat
+    print(json.dumps(summary, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=4)
+
+    failed = []
+    if summary["heavy_modules"]:
+        failed.append("heavy modules imported: {}".format(summary["heavy_modules"]))
+    if args.max_import_s > 0 and summary["import_s"] > args.max_import_s:
+        failed.append("import_s {:.2f} > {:.2f}".format(summary["import_s"], args.max_import_s))
+    if args.max_total_s > 0 and summary["total_s"] > args.max_total_s:
+        failed.append("total_s {:.2f} > {:.2f}".format(summary["total_s"], args.max_total_s))
+    if failed:
+        print("FAILED: " + "; ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='', help='empty: random weights')
+    parser.add_argument('--class-indices', type=str, default=os.path.join(ROOT, 'class_indices.json'))
+    parser.add_argument('--img-path', type=str, default='', help='empty: zero input')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-import-s', type=float, default=0., help='fail above this import time, 0 disables')
+    parser.add_argument('--max-total-s', type=float, default=0., help='fail above this total time, 0 disables')
+    parser.add_argument('--output', type=str, default='')
+
+    opt = parser.parse_args()
+
+    main(opt)
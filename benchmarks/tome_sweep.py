@@ -0,0 +1,106 @@
+"""
+Token merging 的准确率 / 吞吐扫描：对 --stages 中的阶段依次使用 --ratios 中的合并比例，
+在验证集上测准确率、与不合并时预测一致的比例，以及前向吞吐。
+
+    python benchmarks/tome_sweep.py --weights ./weight/best.pth --data-path ./dataset --ratios 0 0.1 0.25 0.5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from inference import build_transform, read_class_indices, load_model, load_image, coorlgnet  # noqa: E402
+from utils import read_split_data  # noqa: E402
+
+
+def load_val_set(args):
+    _, _, val_images_path, val_images_label = read_split_data(args.data_path)
+    if args.max_images > 0:
+        val_images_path, val_images_label = val_images_path[:args.max_images], val_images_label[:args.max_images]
+    transform = build_transform(args.img_size)
+    images = torch.stack([load_image(path, transform) for path in val_images_path], dim=0)
+    return images, torch.as_tensor(val_images_label)
+
+
+@torch.no_grad()
+def predict(model, images, batch_size):
+    return torch.cat([model(x).argmax(dim=1) for x in torch.split(images, batch_size)], dim=0)
+
+
+@torch.no_grad()
+def throughput(model, batch_size, img_size, warmup, iters):
+    x = torch.randn(batch_size, 3, img_size, img_size)
+    for _ in range(warmup):
+        model(x)
+    times = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        model(x)
+        times.append(time.perf_counter() - t0)
+    return batch_size / statistics.median(times)
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    if args.weights:
+        class_indict = read_class_indices(args.class_indices)
+        model = load_model(args.weights, num_classes=len(class_indict), device="cpu")
+    else:
+        model = coorlgnet(num_classes=args.num_classes, img_size=args.img_size).eval()
+    images = labels = None
+    if args.data_path:
+        images, labels = load_val_set(args)
+
+    results, reference = [], None
+    for ratio in args.ratios:
+        ratios = [ratio if s in args.stages else 0. for s in ("a", "b", "c", "d")]
+        model.set_token_merging(ratios)
+        row = {"ratios": ratios,
+               "images_per_s": throughput(model, args.batch_size, args.img_size, args.warmup, args.iters)}
+        if images is not None:
+            pred = predict(model, images, args.batch_size)
+            reference = pred if reference is None else reference
+            row["acc"] = torch.eq(pred, labels).float().mean().item()
+            row["agreement"] = torch.eq(pred, reference).float().mean().item()
+        results.append(row)
+        print(json.dumps(row), file=sys.stderr)
+    model.set_token_merging([0.] * 4)
+
+    base = results[0]["images_per_s"]
+    print("{:24} {:>10} {:>8} {:>8} {:>10}".format("ratios (a, b, c, d)", "images/s", "speedup", "acc", "agreement"))
+    for r in results:
+        print("{:24} {:>10.2f} {:>7.2f}x {:>8} {:>10}".format(
+            str(r["ratios"]), r["images_per_s"], r["images_per_s"] / base,
+            "{:.4f}".format(r["acc"]) if "acc" in r else "-",
+            "{:.4f}".format(r["agreement"]) if "agreement" in r else "-"))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='', help='empty: random weights (throughput only)')
+    parser.add_argument('--class-indices', type=str, default=os.path.join(ROOT, 'class_indices.json'))
+    parser.add_argument('--num_classes', type=int, default=2)
+    parser.add_argument('--data-path', type=str, default='', help='dataset root, the validation split is used')
+    parser.add_argument('--max-images', type=int, default=0, help='only use the first N validation images')
+    parser.add_argument('--stages', type=str, nargs='+', default=['b', 'c'], choices=['a', 'b', 'c', 'd'])
+    parser.add_argument('--ratios', type=float, nargs='+', default=[0., 0.1, 0.25, 0.5])
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--output', type=str, default='')
+
+    opt = parser.parse_args()
+
+    main(opt)
@@ -0,0 +1,203 @@
+"""
+训练断点：模型、AdamW、CosineAnnealingLR、随机数状态和 epoch 一起保存，--resume 时从最近一个完整的断点继续训练。
+
+    manager = CheckpointManager("./weight/checkpoints", keep_top_k=3, best_path="./weight/best.pth")
+    manager.save(epoch, model, optimizer, scheduler, val_acc, best_acc=..., best_epoch=...)
+    ...
+    manager.close()
+
+save 只在训练线程上把状态复制到 CPU（GPU 上为一次 device -> host 拷贝），torch.save 在后台线程中完成；
+上一次写入还没结束时 save 会等待，内存中最多一份待写的快照。
+每个文件先写到 .tmp 再 rename，索引 checkpoints.json 在文件写完之后才更新，所以索引中的断点都是完整的。
+保留验证准确率最高的 keep_top_k 个和最新的一个，其余删除；best_path 为只含 state_dict 的最优模型（inference.load_model 可直接加载），
+给出 model_config 时结构参数同时写到同名的 .json 中（见 tensorfile.write_model_config）。
+验证在后台进行时（见 async_eval.py）先以 val_acc=None 保存，结果到达后用 record_score 补上；可能还在等待结果的断点不会被删除。
+"""
+import os
+import json
+import pickle
+import random
+import inspect
+import threading
+import traceback
+
+import numpy as np
+import torch
+
+from tensorfile import write_model_config
+
+INDEX_NAME = "checkpoints.json"
+
+
+def _to_cpu(obj):
+    """递归复制 state_dict 中的 tensor 到 CPU，之后训练线程继续更新参数不会影响快照"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def rng_state():
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def atomic_save(obj, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointManager:
+    def __init__(self, directory, keep_top_k=3, best_path="", resume=True, model_config=None):
+        """
+        resume=False 时忽略目录中已有的索引（新的训练），同名的旧断点会被覆盖
+        model_config: 模型的结构参数（CoorLGNet 的 model.model_config），与 best_path 一起保存
+        """
+        self.directory = directory
+        self.keep_top_k = keep_top_k
+        self.best_path = best_path
+        self.model_config = model_config
+        os.makedirs(directory, exist_ok=True)
+        if best_path:
+            os.makedirs(os.path.dirname(best_path) or ".", exist_ok=True)
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.entries = self._read_index() if resume else []     # [{"epoch", "val_acc", "path"}]
+        self._thread = None
+        self._error = None
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, "r") as f:
+            return json.load(f)
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    def _is_best(self, val_acc):
+        return val_acc is not None and all(val_acc > e["val_acc"] for e in self.entries if e["val_acc"] is not None)
+
+    def _submit(self, fn, *args):
+        self.wait()
+        self._thread = threading.Thread(target=self._run, args=(fn,) + args, name="checkpoint", daemon=True)
+        self._thread.start()
+
+    def _run(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            traceback.print_exc()
+            self._error = e
+
+    def save(self, epoch, model, optimizer, scheduler, val_acc=None, **extra):
+        """
+        epoch 训练结束（scheduler.step() 之后）时调用；extra 如 best_acc / best_epoch 一起保存，resume 时原样返回
+        """
+        self.wait()
+        snapshot = _to_cpu({"epoch": epoch, "val_acc": val_acc, "model": model.state_dict(),
+                            "optimizer": optimizer.state_dict(), "scheduler": scheduler.state_dict(),
+                            "extra": extra})
+        snapshot["rng"] = rng_state()
+        self._submit(self._write, snapshot, self._is_best(val_acc))
+
+    def record_score(self, epoch, val_acc, model_state=None):
+        """后台验证的结果: 更新 epoch 断点的分数，是目前最好的结果时把 model_state 写到 best_path"""
+        self._submit(self._score, epoch, val_acc, model_state)
+
+    def _write(self, snapshot, is_best):
+        name = "epoch_{:04d}.pth".format(snapshot["epoch"])
+        atomic_save(snapshot, os.path.join(self.directory, name))
+        if is_best and self.best_path:
+            self._save_best(snapshot["model"])
+        self.entries = [e for e in self.entries if e["path"] != name]
+        self.entries.append({"epoch": snapshot["epoch"], "val_acc": snapshot["val_acc"], "path": name})
+        self._prune()
+        self._write_index()
+
+    def _score(self, epoch, val_acc, model_state):
+        # 在后台线程上、前一次写入完成之后判断，entries 已包含之前所有的分数
+        if model_state is not None and self._is_best(val_acc) and self.best_path:
+            self._save_best(model_state)
+        for e in self.entries:
+            if e["epoch"] == epoch:
+                e["val_acc"] = val_acc
+        self._prune()
+        self._write_index()
+
+    def _save_best(self, state_dict):
+        atomic_save(state_dict, self.best_path)
+        write_model_config(self.best_path, self.model_config)
+
+    def _prune(self):
+        latest = max(self.entries, key=lambda e: e["epoch"])
+        scored = [e for e in self.entries if e["val_acc"] is not None]
+        top = sorted(scored, key=lambda e: (-e["val_acc"], -e["epoch"]))[:self.keep_top_k]
+        # 没有分数、但比最近一次有分数的断点更新的，验证结果可能还没到，先保留
+        last_scored = max((e["epoch"] for e in scored), default=-1)
+        keep = [e for e in self.entries
+                if e is latest or e in top or (e["val_acc"] is None and e["epoch"] > last_scored)]
+        for e in self.entries:
+            if e not in keep:
+                path = os.path.join(self.directory, e["path"])
+                if os.path.exists(path):
+                    os.remove(path)
+        self.entries = keep
+
+    def wait(self):
+        """等待后台写入完成；写入失败时在训练线程上抛出异常"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("failed to write checkpoint") from error
+
+    def close(self):
+        self.wait()
+
+    def latest(self):
+        """最近一个可以加载的断点内容，没有时返回 None"""
+        for e in sorted(self.entries, key=lambda e: -e["epoch"]):
+            path = os.path.join(self.directory, e["path"])
+            # 断点中有 python / numpy 的随机数状态，不能用 weights_only 加载；1.13 之前没有这个参数
+            kwargs = {"weights_only": False} if "weights_only" in inspect.signature(torch.load).parameters else {}
+            try:
+                return torch.load(path, map_location="cpu", **kwargs)
+            except (EOFError, pickle.UnpicklingError, RuntimeError) as error:
+                # 只跳过损坏 / 不完整的文件，其他错误（文件被删除、权限等）直接抛出
+                print("skipping unreadable checkpoint {}: {}".format(path, error))
+        return None
+
+    def resume(self, model, optimizer, scheduler):
+        """
+        从最近的断点恢复模型、优化器、学习率调度和随机数状态，返回 (下一个 epoch, extra)；没有断点时返回 (0, {})
+        """
+        checkpoint = self.latest()
+        if checkpoint is None:
+            return 0, {}
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        scheduler.load_state_dict(checkpoint["scheduler"])
+        set_rng_state(checkpoint["rng"])
+        print("resumed from epoch {} (val acc {})".format(checkpoint["epoch"], checkpoint["val_acc"]))
+        return checkpoint["epoch"] + 1, checkpoint["extra"]
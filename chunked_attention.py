@@ -0,0 +1,90 @@
+"""
+按 query 分块的注意力，用于限制 Attention / WindowAttention 中注意力分数的峰值内存。
+
+阶段 a 的 Attention 一次生成 [B, heads, 3136, 49] 的分数，WindowAttention 生成 [B*64, heads, 49, 49]，
+都随 batch 大小线性增长。这里把 (batch, query) 切成若干块，每块单独计算 q @ k^T、softmax 和 @ v，
+块的大小由内存预算（字节）和输入形状自动决定：
+    一个 query 行的开销 = heads * Nk * element_size * LIVE_SCORE_TENSORS
+    预算够放下 Nq 行时按 batch 分块（每块 budget // (Nq 行) 个样本），否则每块 1 个样本、按 query 分块。
+每一行的 softmax 仍在完整的 Nk 个 key 上计算（减去行最大值，数值稳定），结果与不分块相同。
+
+checkpoint=True 时每块用 torch.utils.checkpoint 包装：前向只保存该块的输入（q、k、v 和偏置的切片），
+反向时重新计算分数，训练时保存的激活不再包含 [B, heads, Nq, Nk] 的分数和 softmax 输出，
+单块前向/反向的峰值由预算决定，与 batch 大小无关。dropout 的随机状态在重算时会被恢复。
+"""
+import torch
+from torch.utils.checkpoint import checkpoint as _checkpoint
+
+# 一个 query 行同时存活的 [Nk] 大小张量个数的估计: 分数、加偏置后的分数、softmax 输出
+LIVE_SCORE_TENSORS = 3
+
+# use_reentrant=False 需要 PyTorch 1.11，更早的版本只有 reentrant 的实现（要求至少一个输入需要梯度）
+NON_REENTRANT_CHECKPOINT = tuple(int(v) for v in torch.__version__.split("+")[0].split(".")[:2]) >= (1, 11)
+
+
+def checkpoint(fn, *args):
+    """torch.utils.checkpoint.checkpoint，支持时使用非 reentrant 的实现"""
+    if NON_REENTRANT_CHECKPOINT:
+        return _checkpoint(fn, *args, use_reentrant=False)
+    return _checkpoint(fn, *args)
+
+
+def _attend(q, k, v, bias, dropout):
+    attn = q @ k.transpose(-2, -1)
+    if bias is not None:
+        attn = attn + bias
+    attn = attn.softmax(dim=-1)
+    if dropout is not None:
+        attn = dropout(attn)
+    return attn @ v
+
+
+def plan_chunks(B, heads, Nq, Nk, mem_budget, element_size=4):
+    """返回 (batch 块大小, query 块大小)，一块的注意力分数不超过 mem_budget 字节；mem_budget 为 None 时不分块"""
+    if not mem_budget:
+        return B, Nq
+    rows = max(1, int(mem_budget // (heads * Nk * element_size * LIVE_SCORE_TENSORS)))
+    if rows >= Nq:
+        return max(1, min(B, rows // Nq)), Nq
+    return 1, rows
+
+
+def _slice_bias(bias, b0, b1, s, e):
+    if bias is None:
+        return None
+    if bias.shape[0] > 1:
+        bias = bias[b0:b1]
+    if bias.shape[-2] > 1:
+        bias = bias[..., s:e, :]
+    return bias
+
+
+def chunked_attention(q, k, v, bias=None, mem_budget=None, checkpoint=False, dropout=None):
+    """
+    q: [B, heads, Nq, d]（已乘 scale），k: [B, heads, Nk, d]，v: [B, heads, Nk, dv]
+    bias: None 或可广播到 [B, heads, Nq, Nk] 的张量，如 [heads, Nq, Nk]、[1, heads, Nq, Nk]
+    mem_budget: 一块注意力分数的内存上限（字节），None 表示不分块
+    checkpoint: 训练时每块只保存输入，反向时重算
+    dropout: 作用在 softmax 输出上的 nn.Dropout
+    Return:
+        [B, heads, Nq, dv]
+    """
+    B, heads, Nq, _ = q.shape
+    Nk = k.shape[-2]
+    bc, qc = plan_chunks(B, heads, Nq, Nk, mem_budget, q.element_size())
+    use_checkpoint = checkpoint and torch.is_grad_enabled()
+    if bc >= B and qc >= Nq and not use_checkpoint:
+        return _attend(q, k, v, bias, dropout)
+    if bias is not None and bias.dim() < 4:
+        bias = bias.reshape((1,) * (4 - bias.dim()) + tuple(bias.shape))
+
+    outs = []
+    for b0 in range(0, B, bc):
+        b1 = min(b0 + bc, B)
+        row = []
+        for s in range(0, Nq, qc):
+            e = min(s + qc, Nq)
+            args = (q[b0:b1, :, s:e], k[b0:b1], v[b0:b1], _slice_bias(bias, b0, b1, s, e), dropout)
+            row.append(checkpoint(_attend, *args) if use_checkpoint else _attend(*args))
+        outs.append(row[0] if len(row) == 1 else torch.cat(row, dim=2))
+    return outs[0] if len(outs) == 1 else torch.cat(outs, dim=0)
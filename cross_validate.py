@@ -0,0 +1,180 @@
+"""
+分层 K 折交叉验证：所有图片（read_split_data 的训练集和验证集合在一起）按类别分层划分为 K 折，
+各折在 --workers 个进程中并行训练，每个进程 --threads 个 CPU 线程。
+
+    python cross_validate.py --data-path ./dataset --folds 5 --workers 5 --threads 2 --epochs 100
+
+划分: 每个类别内按路径 hash 排序后轮流分配到各折，与运行次数、文件系统顺序无关，各折的类别比例与整体一致。
+数据: 所有图片只解码一次，保存在 --cache 文件中（见 image_cache.py），各进程以 mmap 方式只读共享，与 sweep.py 共用格式。
+输出: cv_report.json 和打印的表格包含每折最后一个 epoch（--epochs 固定）的 acc / precision / recall / f1（macro），
+以及各指标的 mean ± std。在验证折上挑选最优 epoch 再用同一折评估会高估准确率，所以不用于报告；
+<output-dir>/fold_X/best.pth 为每折验证准确率最高的权重，只作为产物保存（best_epoch / best_acc 一并记录）。
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import statistics
+import multiprocessing as mp
+
+import torch
+import sklearn.metrics as sm
+
+from utils import read_split_data
+from image_cache import build_image_cache, load_image_cache, CachedImageDataset
+
+
+METRICS = ("acc", "precision", "recall", "f1")
+
+# 每个进程只加载一次缓存（_init_worker 中设置）
+_cache = {}
+
+
+def stratified_folds(images_path, labels, num_folds):
+    """返回每折验证集的下标列表"""
+    folds = [[] for _ in range(num_folds)]
+    offset = 0
+    for c in sorted(set(labels)):
+        members = sorted((i for i, label in enumerate(labels) if label == c),
+                         key=lambda i: hashlib.md5(images_path[i].encode("utf-8")).hexdigest())
+        for j, i in enumerate(members):
+            # 各类别从不同的折开始分配，样本数不能整除时各折的大小尽量相同
+            folds[(offset + j) % num_folds].append(i)
+        offset += len(members)
+    return [sorted(fold) for fold in folds]
+
+
+@torch.no_grad()
+def fold_metrics(model, data_loader, device):
+    model.eval()
+    y_true, y_pred = [], []
+    for images, labels in data_loader:
+        y_pred.extend(model(images.to(device)).argmax(dim=1).cpu().tolist())
+        y_true.extend(labels.tolist())
+    return {"acc": sm.accuracy_score(y_true, y_pred),
+            "precision": sm.precision_score(y_true, y_pred, average='macro', zero_division=0),
+            "recall": sm.recall_score(y_true, y_pred, average='macro', zero_division=0),
+            "f1": sm.f1_score(y_true, y_pred, average='macro', zero_division=0)}
+
+
+def _init_worker(cache_path, labels, threads, output_dir):
+    torch.set_num_threads(threads)
+    _cache["images"] = load_image_cache(cache_path)
+    _cache["labels"] = labels
+    # 进度和指标写到各进程的日志文件中
+    sys.stdout = open(os.path.join(output_dir, "worker_{}.log".format(os.getpid())), "a", buffering=1)
+
+
+def run_fold(task):
+    fold, train_indices, val_indices, args = task
+    from CoorLGNet import coorlgnet
+    from train import train_one_epoch, evaluate
+    from checkpoint import atomic_save
+
+    device = torch.device(args.device)
+    train_images, val_images = _cache["images"]
+    train_dataset = CachedImageDataset(train_images, _cache["labels"], train_indices, train=True)
+    val_dataset = CachedImageDataset(val_images, _cache["labels"], val_indices, train=False)
+    train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True,
+                                               collate_fn=train_dataset.collate_fn)
+    val_loader = torch.utils.data.DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False,
+                                             collate_fn=val_dataset.collate_fn)
+
+    print("fold {}: {} train / {} val images".format(fold, len(train_indices), len(val_indices)))
+    torch.manual_seed(args.seed)
+    model = coorlgnet(num_classes=args.num_classes).to(device)
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=args.lr,
+                                  weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer=optimizer, T_max=args.epochs)
+    checkpoint_path = os.path.join(args.output_dir, "fold_{}".format(fold), "best.pth")
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    best_acc, best_epoch = -1., -1
+    for epoch in range(args.epochs):
+        train_one_epoch(model, optimizer, train_loader, device, epoch, progress=False)
+        scheduler.step()
+        val_loss, val_acc = evaluate(model, val_loader, device, epoch, progress=False, csv_path=None)
+        if val_acc > best_acc:
+            best_acc, best_epoch = val_acc, epoch
+            atomic_save(model.state_dict(), checkpoint_path)
+
+    # 指标取最后一个 epoch 的模型，不用 best.pth（见模块说明）
+    result = {"fold": fold, "best_epoch": best_epoch, "best_acc": best_acc, "checkpoint": checkpoint_path,
+              "num_train": len(train_indices), "num_val": len(val_indices)}
+    result.update(fold_metrics(model, val_loader, device))
+    return result
+
+
+def summarize(results):
+    summary = {}
+    for name in METRICS:
+        values = [r[name] for r in results]
+        summary[name] = {"mean": statistics.mean(values),
+                         "std": statistics.stdev(values) if len(values) > 1 else 0.}
+    return summary
+
+
+def main(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    train_images_path, train_images_label, val_images_path, val_images_label = read_split_data(args.data_path)
+    images_path = train_images_path + val_images_path
+    labels = train_images_label + val_images_label
+    build_image_cache(args.cache, images_path, num_workers=args.decode_workers)
+
+    folds = stratified_folds(images_path, labels, args.folds)
+    tasks = []
+    for k, val_indices in enumerate(folds):
+        val_set = set(val_indices)
+        tasks.append((k, [i for i in range(len(labels)) if i not in val_set], val_indices, args))
+    print("{} images, {} folds, {} workers x {} threads".format(
+        len(labels), args.folds, args.workers, args.threads), file=sys.stderr)
+
+    ctx = mp.get_context("spawn")
+    results = []
+    with ctx.Pool(args.workers, initializer=_init_worker,
+                  initargs=(args.cache, labels, args.threads, args.output_dir)) as pool:
+        for result in pool.imap_unordered(run_fold, tasks):
+            print("fold {} done: acc {:.4f}, f1 {:.4f} (best.pth: epoch {}, acc {:.4f})".format(
+                result["fold"], result["acc"], result["f1"], result["best_epoch"], result["best_acc"]),
+                file=sys.stderr)
+            results.append(result)
+    results.sort(key=lambda r: r["fold"])
+    summary = summarize(results)
+    with open(os.path.join(args.output_dir, "cv_report.json"), "w") as f:
+        json.dump({"folds": results, "summary": summary, "config": {
+            "folds": args.folds, "epochs": args.epochs, "batch_size": args.batch_size, "lr": args.lr,
+            "weight_decay": args.weight_decay, "seed": args.seed}}, f, indent=2)
+
+    print("metrics after the last epoch ({})".format(args.epochs))
+    print("{:>5} {:>8} {:>10} {:>8} {:>8}  {:>10} {:>8}  {}".format(
+        "fold", "acc", "precision", "recall", "f1", "best epoch", "best acc", "checkpoint"))
+    for r in results:
+        print("{:>5} {:>8.4f} {:>10.4f} {:>8.4f} {:>8.4f}  {:>10} {:>8.4f}  {}".format(
+            r["fold"], r["acc"], r["precision"], r["recall"], r["f1"], r["best_epoch"], r["best_acc"],
+            r["checkpoint"]))
+    print("  ".join("{}: {:.4f} ± {:.4f}".format(name, summary[name]["mean"], summary[name]["std"])
+                    for name in METRICS))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', type=str, default="./datasetold")
+    parser.add_argument('--num_classes', type=int, default=2)
+    parser.add_argument('--output-dir', type=str, default='./cv')
+    parser.add_argument('--cache', type=str, default='./image_cache.tensors', help='decoded image cache')
+    parser.add_argument('--decode-workers', type=int, default=8)
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--lr', type=float, default=0.0001)
+    parser.add_argument('--weight_decay', type=float, default=1E-3)
+    parser.add_argument('--workers', type=int, default=0, help='folds trained in parallel, default: all folds')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads per fold, default: cpus / workers')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--seed', type=int, default=0)
+
+    opt = parser.parse_args()
+    opt.workers = opt.workers or opt.folds
+    opt.threads = opt.threads or max(1, (os.cpu_count() or 1) // opt.workers)
+
+    main(opt)
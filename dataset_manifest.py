@@ -0,0 +1,165 @@
+import os
+import json
+import random
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+MANIFEST_VERSION = 1
+SUPPORTED = (".jpg", ".JPG", ".png", ".PNG")  # 支持的文件后缀类型
+
+
+def _split_key(rel_path: str):
+    # 用路径的hash决定验证集的抽样顺序，与文件系统遍历顺序、运行次数无关
+    return hashlib.md5(rel_path.encode("utf-8")).hexdigest()
+
+
+def _probe_image(path: str):
+    """只读取图片头部信息（PIL是惰性解码的），返回 (mode, width, height)，无法打开时 mode 为 None"""
+    try:
+        with Image.open(path) as img:
+            return img.mode, img.size[0], img.size[1]
+    except Exception:
+        return None, 0, 0
+
+
+def _atomic_write(path: str, text: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(manifest_path: str):
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def update_manifest(root: str, manifest_path: str = None, val_rate: float = 0.3, num_workers: int = 8):
+    """
+    建立或增量更新数据集清单。
+
+    清单记录每张图片的 size、mtime、mode、宽高、类别以及固定的 train/val 划分。
+    每次都列出各类别文件夹并比较每个文件的 size、mtime（原地修改的文件不会改变文件夹的 mtime），
+    只有新增或被修改的文件才在线程池中读取图片头进行校验；
+    已有文件的划分不会改变，新文件按路径hash补足各类别 int(n * val_rate) 的验证集数量。
+    新建清单（或 val_rate 改变）时，划分与原来的 read_split_data 相同（random.seed(0)，各类别依次对排序后的
+    文件 random.sample），之前的实验结果可以复现；之后新增的文件才按路径hash分配。
+
+    Args:
+        root: 数据集根目录，每个子文件夹对应一个类别
+        manifest_path: 清单文件路径，默认为 root/.manifest.json
+        val_rate: 验证集比例，改变时会重新划分全部样本
+        num_workers: 校验新文件的线程数
+
+    Returns:
+        manifest (dict)
+    """
+    assert os.path.exists(root), "dataset root: {} does not exist.".format(root)
+    manifest_path = manifest_path or os.path.join(root, ".manifest.json")
+
+    manifest = load_manifest(manifest_path)
+    if manifest is None or manifest.get("val_rate") != val_rate:
+        old_images = manifest["images"] if manifest is not None else {}
+        manifest = {"version": MANIFEST_VERSION, "val_rate": val_rate, "dirs": {}, "images": {}}
+        # 仅保留已校验的图片信息，划分重新计算
+        for rel_path, info in old_images.items():
+            manifest["images"][rel_path] = dict(info, split=None)
+        force_rescan = True
+    else:
+        force_rescan = False
+
+    # 遍历文件夹，一个文件夹对应一个类别（类别数量很少，每次都重新列出）
+    classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    images = manifest["images"]
+    dirs = manifest["dirs"]
+
+    # 删除已经不存在的类别
+    dirty = force_rescan or manifest.get("classes") != classes
+    class_set = set(classes)
+    for cla in list(dirs):
+        if cla not in class_set:
+            del dirs[cla]
+    for rel_path in [p for p, info in images.items() if info["class"] not in class_set]:
+        del images[rel_path]
+
+    to_probe = []
+    changed_classes = []
+    for cla in classes:
+        cla_path = os.path.join(root, cla)
+        dir_mtime = os.stat(cla_path).st_mtime_ns
+        changed = force_rescan or dirs.get(cla) != dir_mtime
+        dirs[cla] = dir_mtime
+
+        seen = set()
+        with os.scandir(cla_path) as it:
+            for entry in it:
+                if os.path.splitext(entry.name)[-1] not in SUPPORTED or not entry.is_file():
+                    continue
+                rel_path = cla + "/" + entry.name
+                seen.add(rel_path)
+                st = entry.stat()
+                info = images.get(rel_path)
+                if info is not None and info["size"] == st.st_size and info["mtime_ns"] == st.st_mtime_ns:
+                    continue
+                images[rel_path] = {"class": cla, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                    "split": info.get("split") if info is not None else None}
+                to_probe.append(rel_path)
+                changed = True
+        for rel_path in [p for p, info in images.items() if info["class"] == cla and p not in seen]:
+            del images[rel_path]
+            changed = True
+        if changed:
+            changed_classes.append(cla)
+
+    # 新增/修改的文件在线程池中读取图片头
+    if len(to_probe) > 0:
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+            results = pool.map(_probe_image, [os.path.join(root, p) for p in to_probe])
+            for rel_path, (mode, width, height) in zip(to_probe, results):
+                images[rel_path].update(mode=mode, width=width, height=height)
+
+    if force_rescan:
+        # 与原来的 read_split_data 相同的随机划分：所有类别共用一个 seed 为 0 的随机数序列，按类别顺序采样
+        rng = random.Random(0)
+        for cla in classes:
+            cla_images = sorted(p for p, info in images.items() if info["class"] == cla)
+            val_set = set(rng.sample(cla_images, k=int(len(cla_images) * val_rate)))
+            for rel_path in cla_images:
+                images[rel_path]["split"] = "val" if rel_path in val_set else "train"
+
+    # 为没有划分的文件分配 train/val，已有的划分保持不变
+    for cla in changed_classes:
+        cla_images = [p for p, info in images.items() if info["class"] == cla]
+        num_val = sum(1 for p in cla_images if images[p]["split"] == "val")
+        need_val = int(len(cla_images) * val_rate) - num_val
+        unassigned = sorted((p for p in cla_images if images[p]["split"] is None), key=_split_key)
+        for i, rel_path in enumerate(unassigned):
+            images[rel_path]["split"] = "val" if i < need_val else "train"
+
+    manifest["classes"] = classes
+    if dirty or len(changed_classes) > 0:
+        _atomic_write(manifest_path, json.dumps(manifest))
+    print("manifest: {} classes changed, {} files validated.".format(len(changed_classes), len(to_probe)))
+    return manifest
+
+
+def write_class_indices(classes: list, json_path: str = "class_indices.json"):
+    """仅在内容变化时重写 class_indices.json"""
+    json_str = json.dumps(dict((i, cla) for i, cla in enumerate(classes)), indent=4)
+    if os.path.exists(json_path):
+        with open(json_path, "r") as f:
+            if f.read() == json_str:
+                return
+    with open(json_path, "w") as json_file:
+        json_file.write(json_str)
@@ -0,0 +1,151 @@
+"""
+知识蒸馏：冻结的 CoorLGNet 教师模型 -> upconstruction 中较小的 CMT 学生模型（cmt_ti / cmt_xs）。
+
+损失: alpha * T^2 * KL(student / T || teacher / T) + (1 - alpha) * CE(student, label)
+
+教师 logits 的缓存:
+    训练集的随机增强改为由种子决定（SeededAugDataset）：每张图片有 aug_seeds 个固定的增强种子，
+    每个 epoch 轮流使用其中一个。教师 logits 按 (图片路径, 种子序号) 缓存，
+    第 aug_seeds 个 epoch 之后教师不再做前向。缓存可以保存到文件，下次训练直接复用。
+"""
+import os
+import time
+import hashlib
+import statistics
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+
+
+STUDENTS = ("cmt_ti", "cmt_xs", "cmt_s", "cmt_b")
+
+
+def build_student(name, num_classes, img_size=224):
+    assert name in STUDENTS, "unknown student {}, expected one of {}".format(name, STUDENTS)
+    # upconstruction 依赖 timm，只在蒸馏时导入
+    import upconstruction
+    return getattr(upconstruction, name)(num_classes=num_classes, img_size=img_size)
+
+
+class SeededAugDataset(Dataset):
+    """
+    包装 MyDataSet：第 epoch 轮第 i 张图片使用第 (epoch + i) % aug_seeds 个增强种子，
+    在独立的随机数状态下执行 transform，同一 (图片, 种子) 得到完全相同的增强结果。
+    __getitem__ 额外返回缓存键 "路径|种子序号"。
+    """
+
+    def __init__(self, dataset, aug_seeds=4, base_seed=0):
+        self.dataset = dataset
+        self.aug_seeds = aug_seeds
+        self.base_seed = base_seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, item):
+        path = self.dataset.images_path[item]
+        slot = (self.epoch + item) % self.aug_seeds
+        seed = int(hashlib.md5("{}|{}|{}".format(self.base_seed, path, slot).encode()).hexdigest()[:8], 16)
+        # torchvision 的随机变换使用 torch 的全局随机数，fork_rng 避免影响其他地方的随机性
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(seed)
+            img, label = self.dataset[item]
+        return img, label, "{}|{}".format(path, slot)
+
+    @staticmethod
+    def collate_fn(batch):
+        images, labels, keys = tuple(zip(*batch))
+        return torch.stack(images, dim=0), torch.as_tensor(labels), list(keys)
+
+
+class TeacherCache:
+    """按缓存键保存教师 logits（CPU 上的 float16），缺失的样本才用教师模型前向"""
+
+    def __init__(self, teacher, device, cache_path="", teacher_id=""):
+        self.teacher = teacher
+        self.device = device
+        self.cache_path = cache_path
+        self.teacher_id = teacher_id
+        self.logits = {}
+        self.hits = 0
+        self.misses = 0
+        if cache_path and os.path.exists(cache_path):
+            saved = torch.load(cache_path, map_location="cpu")
+            # 教师权重变了（路径、大小、修改时间）缓存就作废
+            if saved.get("teacher_id") == teacher_id:
+                self.logits = saved["logits"]
+                print("teacher cache: {} logits loaded from {}".format(len(self.logits), cache_path))
+
+    @torch.no_grad()
+    def get(self, images, keys):
+        missing = [i for i, k in enumerate(keys) if k not in self.logits]
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        if missing:
+            out = self.teacher(images[missing].to(self.device)).float().cpu().half()
+            for i, logits in zip(missing, out):
+                self.logits[keys[i]] = logits
+        return torch.stack([self.logits[k] for k in keys], dim=0).float()
+
+    def save(self):
+        if self.cache_path:
+            tmp_path = self.cache_path + ".tmp"
+            torch.save({"teacher_id": self.teacher_id, "logits": self.logits}, tmp_path)
+            os.replace(tmp_path, self.cache_path)
+
+    def reset_stats(self):
+        self.hits = self.misses = 0
+
+
+def teacher_id_of(weights_path):
+    st = os.stat(weights_path)
+    return "{}|{}|{}".format(os.path.abspath(weights_path), st.st_size, st.st_mtime_ns)
+
+
+class Distiller:
+    def __init__(self, cache, alpha=0.5, temperature=4.):
+        self.cache = cache
+        self.alpha = alpha
+        self.temperature = temperature
+
+    def loss(self, student_logits, labels, images, keys):
+        teacher_logits = self.cache.get(images, keys).to(student_logits.device)
+        T = self.temperature
+        soft = F.kl_div(F.log_softmax(student_logits / T, dim=1), F.softmax(teacher_logits / T, dim=1),
+                        reduction="batchmean") * T * T
+        hard = F.cross_entropy(student_logits, labels)
+        return self.alpha * soft + (1. - self.alpha) * hard
+
+
+@torch.no_grad()
+def accuracy(model, data_loader, device):
+    model.eval()
+    correct = total = 0
+    for images, labels in data_loader:
+        pred = model(images.to(device)).argmax(dim=1)
+        correct += torch.eq(pred, labels.to(device)).sum().item()
+        total += labels.shape[0]
+    return correct / max(total, 1)
+
+
+@torch.no_grad()
+def measure_latency(model, device, img_size=224, batch_size=1, warmup=3, iters=10):
+    """batch_size 张图片一次前向的中位数耗时（毫秒）"""
+    model.eval()
+    x = torch.randn(batch_size, 3, img_size, img_size, device=device)
+    times = []
+    for i in range(warmup + iters):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        t0 = time.perf_counter()
+        model(x)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        if i >= warmup:
+            times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000.
@@ -0,0 +1,112 @@
+"""
+解码后的图片缓存：超参数扫描（sweep.py）和交叉验证（cross_validate.py）的多个训练进程共用，
+图片只读取、解码、缩放一次。
+
+缓存为一个 tensor 文件（见 tensorfile.py），每张图片保存两种 uint8 形式:
+    train   [N, 3, train_size, train_size]  短边缩放到 train_size 后中心裁剪，训练时在其上做 RandomResizedCrop
+    val     [N, 3, 224, 224]                与 train.py 的 "val" 预处理相同: Resize(256) + CenterCrop(224)
+各进程以 mmap 方式只读加载，共享页缓存中的同一份物理内存。
+文件头中记录图片路径、大小、修改时间和缩放参数的 hash，数据集变化后自动重建。
+
+与逐张解码原图相比，训练增强只能看到中心的正方形区域（原图长边两端被裁掉的部分不参与 RandomResizedCrop）。
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision import transforms
+
+from tensorfile import is_tensorfile, read_header, save_tensorfile, load_tensorfile
+
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def _resize_center_crop(img, resize, crop):
+    """短边缩放到 resize 后中心裁剪 crop 见方，与 transforms.Resize(resize) + CenterCrop(crop) 相同"""
+    w, h = img.size
+    if w <= h:
+        new_w, new_h = resize, int(resize * h / w)
+    else:
+        new_w, new_h = int(resize * w / h), resize
+    img = img.resize((new_w, new_h), Image.BILINEAR)
+    top = int(round((new_h - crop) / 2.))
+    left = int(round((new_w - crop) / 2.))
+    img = img.crop((left, top, left + crop, top + crop))
+    return np.asarray(img, dtype=np.uint8).transpose(2, 0, 1)
+
+
+def cache_key(images_path, train_size, val_size):
+    sha1 = hashlib.sha1(json.dumps([train_size, val_size]).encode())
+    for path in images_path:
+        stat = os.stat(path)
+        sha1.update("{}|{}|{}\n".format(path, stat.st_size, int(stat.st_mtime)).encode("utf-8"))
+    return sha1.hexdigest()
+
+
+def build_image_cache(cache_path, images_path, train_size=256, val_size=224, num_workers=8):
+    """
+    缓存不存在或与 images_path 不一致时重新生成；返回 (train, val) 两个 mmap 的 uint8 tensor，
+    第 i 行对应 images_path[i]
+    """
+    key = cache_key(images_path, train_size, val_size)
+    if not (os.path.exists(cache_path) and is_tensorfile(cache_path)
+            and read_header(cache_path)["config"].get("key") == key):
+        train = np.empty((len(images_path), 3, train_size, train_size), dtype=np.uint8)
+        val = np.empty((len(images_path), 3, val_size, val_size), dtype=np.uint8)
+
+        def decode(i):
+            with Image.open(images_path[i]) as img:
+                img = img.convert("RGB")
+                train[i] = _resize_center_crop(img, train_size, train_size)
+                val[i] = _resize_center_crop(img, int(val_size * 256 / 224), val_size)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            list(pool.map(decode, range(len(images_path))))
+        save_tensorfile(cache_path, {"train": torch.from_numpy(train), "val": torch.from_numpy(val)},
+                        config={"key": key, "num_images": len(images_path)})
+        print("decoded {} images into {}".format(len(images_path), cache_path))
+    return load_image_cache(cache_path)
+
+
+def load_image_cache(cache_path):
+    tensors, _ = load_tensorfile(cache_path)
+    return tensors["train"], tensors["val"]
+
+
+class CachedImageDataset(Dataset):
+    """
+    从缓存中取 indices 对应的图片: train=True 时做 RandomResizedCrop(224) + RandomHorizontalFlip，
+    否则直接使用预处理好的验证图片；之后 ToTensor + Normalize
+    """
+
+    def __init__(self, images, labels, indices, train, img_size=224):
+        self.images = images
+        self.labels = labels
+        self.indices = list(indices)
+        self.augment = transforms.Compose([transforms.RandomResizedCrop(img_size),
+                                           transforms.RandomHorizontalFlip()]) if train else None
+        self.normalize = transforms.Normalize(MEAN, STD)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        i = self.indices[item]
+        img = self.images[i].float().div_(255.)
+        if self.augment is not None:
+            img = self.augment(img)
+        return self.normalize(img), self.labels[i]
+
+    @staticmethod
+    def collate_fn(batch):
+        images, labels = tuple(zip(*batch))
+        images = torch.stack(images, dim=0)
+        labels = torch.as_tensor(labels)
+        return images, labels
@@ -0,0 +1,129 @@
+"""
+推理公用函数。只导入前向需要的模块：不导入 timm、matplotlib，预处理也不依赖 torchvision
+（导入 torchvision.transforms 的耗时和导入 torch 本身相当）。
+"""
+import os
+import json
+
+import numpy as np
+import torch
+from PIL import Image
+
+from CoorLGNet import ARCH_KEYS, coorlgnet, meta_init_supported, skip_init_supported
+from tensorfile import read_model_config
+
+
+IMG_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class ValTransform:
+    """
+    与 train.py 中 "val" 预处理等价的实现：
+    Resize(256) + CenterCrop(224) + ToTensor() + Normalize(mean, std)
+    """
+
+    def __init__(self, img_size=224, resize_size=None, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        self.img_size = img_size
+        self.resize_size = resize_size or int(img_size * 256 / 224)
+        self.mean = torch.tensor(mean).view(-1, 1, 1)
+        self.std = torch.tensor(std).view(-1, 1, 1)
+
+    def __call__(self, img):
+        # Resize: 短边缩放到 resize_size，长边按比例（与 torchvision 的取整方式一致）
+        w, h = img.size
+        short, long = (w, h) if w <= h else (h, w)
+        new_short, new_long = self.resize_size, int(self.resize_size * long / short)
+        new_w, new_h = (new_short, new_long) if w <= h else (new_long, new_short)
+        if (new_w, new_h) != (w, h):
+            img = img.resize((new_w, new_h), Image.BILINEAR)
+        # CenterCrop
+        top = int(round((new_h - self.img_size) / 2.))
+        left = int(round((new_w - self.img_size) / 2.))
+        img = img.crop((left, top, left + self.img_size, top + self.img_size))
+        # ToTensor + Normalize
+        # np.asarray 得到只读的 [H, W, C] uint8 数组，复制一次后交给 torch（torch.frombuffer 需要 1.10）
+        x = torch.from_numpy(np.asarray(img, dtype=np.uint8).copy())
+        x = x.view(self.img_size, self.img_size, len(img.getbands())).permute(2, 0, 1).float().div_(255.)
+        return x.sub_(self.mean).div_(self.std)
+
+
+def build_transform(img_size: int = 224):
+    # 与 train.py 中的 "val" 预处理保持一致
+    return ValTransform(img_size)
+
+
+def read_class_indices(json_path: str = "./class_indices.json"):
+    assert os.path.exists(json_path), "file: '{}' dose not exist.".format(json_path)
+    with open(json_path, "r") as f:
+        class_indict = json.load(f)
+    return class_indict
+
+
+def load_model(weights_path: str, num_classes: int, device):
+    """
+    weights_path 可以是 torch.save 保存的 state_dict（.pth），也可以是 tensorfile.py 的 tensor 文件；
+    后者以 mmap 方式零拷贝加载，多个进程共享同一份内存。
+    结构参数（早退出口、全局注意力类型、NAS 结构等）取自 tensor 文件的 config 或 .pth 同名的 .json，没有时为默认结构。
+    模型在 meta device 上构建，不做随机初始化，参数直接绑定到 checkpoint 的 tensor 上（旧版本 PyTorch 见 init_context）。
+    """
+    assert os.path.exists(weights_path), "file {} does not exist.".format(weights_path)
+    config = read_model_config(weights_path)
+    assert config.get("num_classes", num_classes) == num_classes, \
+        "{} was saved with {} classes, expected {}.".format(weights_path, config["num_classes"], num_classes)
+    kwargs = dict((k, v) for k, v in config.items() if k in ARCH_KEYS)
+    kwargs["num_classes"] = num_classes
+    # meta 需要 PyTorch 2.1；2.0 分配内存但跳过随机初始化；更早的版本正常初始化后再加载
+    init = "meta" if meta_init_supported() else ("skip" if skip_init_supported() else "normal")
+    model = coorlgnet(init=init, checkpoint=weights_path, **kwargs)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def add_early_exit_args(parser):
+    # 早退：用 --early-exits 训练的权重，置信度足够的样本在 exit_b / exit_c 处提前输出（见 CoorLGNet.forward_early_exit）
+    parser.add_argument('--early-exit', type=float, nargs='*', default=None, metavar='THRESHOLD',
+                        help='exit early when confident; thresholds of exit_b and exit_c, default: saved with weights')
+
+
+def forward_fn(model, early_exit=None):
+    """
+    返回 x -> logits 的前向函数
+    early_exit: --early-exit 的值，None 时为普通前向；空列表时使用训练时保存的阈值
+    """
+    if early_exit is None:
+        return model
+    assert getattr(model, "num_exits", 1) > 1, "--early-exit requires weights trained with --early-exits"
+    assert len(early_exit) in (0, model.num_exits - 1), \
+        "--early-exit expects {} thresholds, got {}".format(model.num_exits - 1, len(early_exit))
+    thresholds = tuple(early_exit) or None
+    return lambda x: model.forward_early_exit(x, thresholds)[0]
+
+
+def load_image(path: str, transform=None):
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+    if transform is not None:
+        img = transform(img)
+    return img
+
+
+def iter_image_paths(source: str):
+    """
+    依次产生需要预测的图片路径
+    Args:
+        source: 图片文件夹（递归遍历）或每行一个路径的列表文件
+    """
+    assert os.path.exists(source), "file: '{}' dose not exist.".format(source)
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if os.path.splitext(name)[-1].lower() in IMG_EXTENSIONS:
+                    yield os.path.join(dirpath, name)
+    else:
+        with open(source, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
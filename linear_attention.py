@@ -0,0 +1,150 @@
+"""
+线性复杂度的全局注意力（CoorLGNet 中 global_attn='linear' 的阶段）。
+
+softmax 注意力中 relative_pos[h, i, j] 加在 logits 上，等价于把注意力权重乘以 exp(relative_pos[h, i, j])。
+这里把两部分都换成可分解的核函数:
+    exp(q_i·k_j)              ≈ φ(q_i)·φ(k_j),             φ(x) = elu(x) + 1
+    exp(relative_pos[h, i, j]) ≈ Σ_r P[h, r, i] · K[h, r, j],  P、K 非负（低秩近似，LowRankRelativePos）
+于是 sim(i, j) = (φ(q_i) ⊗ P_i)·(φ(k_j) ⊗ K_j)，先对 key 求和 Σ_j (φ(k_j) ⊗ K_j) v_j^T，
+计算量为 O(N · d · rank · d_v)，随 token 数线性增长，不再有 [N, N / sr^2] 的分数矩阵。
+
+P、K 保存为 query / key 特征图上的 [heads, rank, H, W] 位置图。PatchEmbed 要求输入与构建时的 img_size 相同，
+换分辨率时以新的 img_size 构建模型，加载权重时由 CoorLGNet.checkpoint_filter_fn 对位置图双线性插值，
+因此同一组权重可以直接用于更高分辨率的输入。
+"""
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class LowRankRelativePos(nn.Module):
+    """relative_pos 的非负低秩近似: exp(relative_pos[h]) ≈ softplus(pos_q[h])^T softplus(pos_k[h])"""
+
+    def __init__(self, num_heads, q_size, k_size, rank=4):
+        """
+        q_size / k_size: query 和 key（空间缩减后）特征图的 (H, W)
+        """
+        super().__init__()
+        self.num_heads = num_heads
+        self.rank = rank
+        self.q_size = tuple(q_size)
+        self.k_size = tuple(k_size)
+        # 全 0 初始化: 所有位置的权重相同，相当于没有位置偏置
+        self.pos_q = nn.Parameter(torch.zeros(num_heads, rank, *self.q_size))
+        self.pos_k = nn.Parameter(torch.zeros(num_heads, rank, *self.k_size))
+
+    @staticmethod
+    def _features(pos, size):
+        assert tuple(pos.shape[-2:]) == tuple(size), \
+            "position map {} does not match feature map {}".format(tuple(pos.shape[-2:]), tuple(size))
+        return F.softplus(pos).flatten(2).transpose(1, 2)   # [heads, H*W, rank]
+
+    def forward(self, q_size, k_size):
+        """返回非负的 [heads, Nq, rank] 和 [heads, Nk, rank] 位置特征"""
+        return self._features(self.pos_q, q_size), self._features(self.pos_k, k_size)
+
+    @torch.no_grad()
+    def factorize(self, relative_pos, iters=200):
+        """
+        由 'sr' 注意力训练得到的 relative_pos [heads, Nq, Nk] 计算 pos_q、pos_k（非负矩阵分解），
+        返回 {'pos_q': ..., 'pos_k': ...}，供 checkpoint_filter_fn 转换权重。
+        每一行减去最大值不影响 softmax，可以让 exp 的数值范围稳定。
+        relative_pos 来自其他分辨率（方形特征图）时，在原分辨率上分解后把位置图插值到 q_size / k_size。
+        """
+        Nq, Nk = relative_pos.shape[1:]
+        q_size, k_size = self.q_size, self.k_size
+        if (Nq, Nk) != (q_size[0] * q_size[1], k_size[0] * k_size[1]):
+            q_size, k_size = (math.isqrt(Nq),) * 2, (math.isqrt(Nk),) * 2
+            assert q_size[0] ** 2 == Nq and k_size[0] ** 2 == Nk, \
+                "relative_pos {} does not match {} x {}".format(tuple(relative_pos.shape), self.q_size, self.k_size)
+        target = (relative_pos.float() - relative_pos.float().amax(dim=-1, keepdim=True)).exp()   # [h, Nq, Nk]
+        generator = torch.Generator().manual_seed(0)
+        p = torch.rand(self.num_heads, Nq, self.rank, generator=generator) + 0.1
+        k = torch.rand(self.num_heads, self.rank, Nk, generator=generator) + 0.1
+        for _ in range(iters):
+            # Lee & Seung 乘性更新，保持非负
+            k *= (p.transpose(1, 2) @ target) / (p.transpose(1, 2) @ p @ k).clamp_min(1e-12)
+            p *= (target @ k.transpose(1, 2)) / (p @ k @ k.transpose(1, 2)).clamp_min(1e-12)
+        # softplus 的反函数，x 很小时 log(expm1(x)) 会下溢
+        inv_softplus = lambda x: x.clamp_min(1e-6).expm1().log()
+        factors = {"pos_q": inv_softplus(p.transpose(1, 2)).reshape(self.num_heads, self.rank, *q_size),
+                   "pos_k": inv_softplus(k).reshape(self.num_heads, self.rank, *k_size)}
+        for name, size in (("pos_q", self.q_size), ("pos_k", self.k_size)):
+            if tuple(factors[name].shape[-2:]) != size:
+                factors[name] = F.interpolate(factors[name], size=size, mode='bilinear', align_corners=False)
+        return factors
+
+
+class LinearAttention(nn.Module):
+    """
+    q / k / v / sr / proj 的结构与 CoorLGNet.Attention 相同，'sr' 模型的权重可以加载，
+    但 elu + 1 核函数没有 softmax，计算的是不同的函数，加载后需要微调。
+    relative_pos 为 LowRankRelativePos。
+    qk_scale: 在 φ 之前乘到 q 上，None 时不缩放（核函数不需要 softmax 的温度）；
+    没有显式的注意力矩阵，不支持 attn_drop。
+    """
+
+    def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None,
+                 attn_drop=0., proj_drop=0.2, qk_ratio=1, sr_ratio=1, eps=1e-6):
+        super().__init__()
+        assert attn_drop == 0., "LinearAttention does not support attn_drop"
+        self.num_heads = num_heads
+        self.qk_dim = dim // qk_ratio
+        self.scale = qk_scale
+        self.eps = eps
+
+        self.q = nn.Linear(dim, self.qk_dim, bias=qkv_bias)
+        self.k = nn.Linear(dim, self.qk_dim, bias=qkv_bias)
+        self.v = nn.Linear(dim, dim, bias=qkv_bias)
+        self.proj = nn.Linear(dim, dim)
+        self.proj_drop = nn.Dropout(proj_drop)
+
+        self.sr_ratio = sr_ratio
+        if self.sr_ratio > 1:
+            self.sr = nn.Sequential(
+                nn.Conv2d(dim, dim, kernel_size=sr_ratio, stride=sr_ratio, groups=dim, bias=True),
+                nn.BatchNorm2d(dim, eps=1e-5),
+            )
+
+    def forward(self, x, H, W, relative_pos, tome=None):
+        """
+        x: [B, H*W, C], relative_pos: LowRankRelativePos
+        tome: TokenMerge，给出时 query 为合并后的 token，输出再 unmerge 回 N 个 token
+        """
+        B, N, C = x.shape
+        Hk, Wk = H, W
+        if self.sr_ratio > 1:
+            x_ = self.sr(x.permute(0, 2, 1).reshape(B, C, H, W))
+            Hk, Wk = x_.shape[-2:]
+            kv = x_.reshape(B, C, -1).permute(0, 2, 1)
+        else:
+            kv = x
+        pos_q, pos_k = relative_pos((H, W), (Hk, Wk))       # [h, N, r], [h, M, r]
+        if tome is not None:
+            nH, _, r = pos_q.shape
+            pos_q = tome.merge_rows(pos_q.permute(1, 0, 2).reshape(N, nH * r))
+            pos_q = pos_q.reshape(B, -1, nH, r).permute(0, 2, 1, 3)
+            x = tome.merge(x)
+        Nq = x.shape[1]
+
+        q = self.q(x).reshape(B, Nq, self.num_heads, -1).permute(0, 2, 1, 3)
+        if self.scale is not None:
+            q = q * self.scale
+        k = self.k(kv).reshape(B, -1, self.num_heads, self.qk_dim // self.num_heads).permute(0, 2, 1, 3)
+        v = self.v(kv).reshape(B, -1, self.num_heads, C // self.num_heads).permute(0, 2, 1, 3)
+
+        # φ(q) ⊗ P: [B, h, Nq, d * r]，φ(k) ⊗ K: [B, h, M, d * r]
+        q = ((F.elu(q) + 1).unsqueeze(-1) * pos_q.unsqueeze(-2)).flatten(-2)
+        k = ((F.elu(k) + 1).unsqueeze(-1) * pos_k.unsqueeze(-2)).flatten(-2)
+        kv = k.transpose(-2, -1) @ v                                      # [B, h, d * r, d_v]
+        z = q @ k.sum(dim=-2).unsqueeze(-1)                               # [B, h, Nq, 1] 归一化项
+        x = (q @ kv) / (z + self.eps)
+
+        x = x.transpose(1, 2).reshape(B, Nq, C)
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        if tome is not None:
+            x = tome.unmerge(x)
+        return x
@@ -0,0 +1,339 @@
+"""
+延迟约束下的 CoorLGNet 结构搜索。
+
+    python nas.py --data-path ./dataset --max-latency-ms 150 --threads 4 --num-samples 20 --train-steps 200
+
+流程:
+    1. 从搜索空间（每个阶段的 embed_dim、depth、mlp_ratio、sr_ratio、window_size）中随机采样结构；
+    2. 用延迟查找表预测延迟：stem、patch embedding、各形状的 Block、head 分别在本机 CPU 上实测，
+       结果按 (torch 版本, 线程数, CPU) 缓存在 --lut 文件中，之后的搜索直接复用；超出 --max-latency-ms 的结构丢弃；
+    3. 每个候选短时间训练（--train-steps）后在验证集上测准确率；
+       --supernet-steps > 0 时先训练搜索空间中最大的结构，候选从它截取（每个维度取前面的部分）权重作为初始化；
+    4. 输出准确率-延迟的 Pareto 前沿：results.json，以及可以直接使用的模型构造函数（--output-module）。
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+
+import torch
+import torch.nn as nn
+from torchvision import transforms
+
+from CoorLGNet import Block, PatchEmbed, MemoryEfficientSwish, _create_model
+from my_dataset import MyDataSet
+from utils import read_split_data
+from distill import accuracy, measure_latency
+
+
+NUM_HEADS = [1, 2, 4, 8]
+STEM_CHANNEL = 32
+FC_DIM = 1280
+
+DEFAULT_SPACE = {
+    "embed_dims": [[32, 48, 64], [64, 96, 128], [128, 192, 256], [256, 384, 512]],
+    "depths": [[1, 2, 3], [1, 2, 3], [4, 8, 12, 16], [1, 2, 3]],
+    "mlp_ratios": [[2, 3, 4]] * 4,
+    "sr_ratios": [[4, 8], [2, 4], [1, 2], [1]],
+    "window_size": [[4, 7]] * 4,
+}
+KEYS = list(DEFAULT_SPACE)
+
+
+def sample_config(space, rng):
+    return dict((key, [rng.choice(choices) for choices in space[key]]) for key in KEYS)
+
+
+def largest_config(space):
+    # sr_ratio 越小 relative_pos 越大，取最小值
+    config = dict((key, [max(choices) for choices in space[key]]) for key in KEYS)
+    config["sr_ratios"] = [min(choices) for choices in space["sr_ratios"]]
+    return config
+
+
+def config_key(config):
+    return json.dumps([config[key] for key in KEYS])
+
+
+def build_model(config, num_classes, img_size=224):
+    return _create_model(num_classes=num_classes, img_size=img_size, qkv_bias=True, stem_channel=STEM_CHANNEL,
+                         num_heads=NUM_HEADS, qk_ratio=1, **config)
+
+
+class LatencyLUT:
+    """按模块类型和形状缓存的 batch 1 前向延迟（毫秒）"""
+
+    def __init__(self, path, threads, img_size=224, warmup=3, iters=10):
+        self.path = path
+        self.img_size = img_size
+        self.warmup = warmup
+        self.iters = iters
+        self.signature = "torch={}|threads={}|cpu={}".format(
+            torch.__version__, threads, platform.processor() or platform.machine())
+        self.tables = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.tables = json.load(f)
+        self.table = self.tables.setdefault(self.signature, {})
+        self.measured = 0
+
+    def save(self):
+        if self.path:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.tables, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    @torch.no_grad()
+    def _time(self, fn):
+        for _ in range(self.warmup):
+            fn()
+        times = []
+        for _ in range(self.iters):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        return statistics.median(times) * 1000.
+
+    def _lookup(self, key, measure):
+        if key not in self.table:
+            self.table[key] = measure()
+            self.measured += 1
+        return self.table[key]
+
+    def stem(self):
+        def measure():
+            layers = []
+            for i in range(3):
+                layers += [nn.Conv2d(3 if i == 0 else STEM_CHANNEL, STEM_CHANNEL, 3, 2 if i == 0 else 1, 1),
+                           nn.GELU(), nn.BatchNorm2d(STEM_CHANNEL, eps=1e-5)]
+            module = nn.Sequential(*layers).eval()
+            x = torch.randn(1, 3, self.img_size, self.img_size)
+            return self._time(lambda: module(x))
+        return self._lookup("stem|c={}|hw={}".format(STEM_CHANNEL, self.img_size), measure)
+
+    def patch_embed(self, in_chans, embed_dim, hw):
+        def measure():
+            module = PatchEmbed(img_size=hw, patch_size=2, in_chans=in_chans, embed_dim=embed_dim).eval()
+            x = torch.randn(1, in_chans, hw, hw)
+            return self._time(lambda: module(x))
+        return self._lookup("patch_embed|in={}|dim={}|hw={}".format(in_chans, embed_dim, hw), measure)
+
+    def block(self, dim, heads, mlp_ratio, sr_ratio, window_size, hw):
+        def measure():
+            module = Block(dim=dim, num_heads=heads, mlp_ratio=mlp_ratio, qkv_bias=True, qk_ratio=1,
+                           sr_ratio=sr_ratio, window_size=window_size).eval()
+            N = hw * hw
+            x = torch.randn(1, N, dim)
+            relative_pos = torch.randn(heads, N, N // sr_ratio // sr_ratio)
+            return self._time(lambda: module(x, hw, hw, relative_pos))
+        return self._lookup("block|dim={}|heads={}|mlp={}|sr={}|win={}|hw={}".format(
+            dim, heads, mlp_ratio, sr_ratio, window_size, hw), measure)
+
+    def head(self, dim, hw, num_classes):
+        def measure():
+            module = nn.Sequential(nn.Conv2d(dim, FC_DIM, 1), nn.BatchNorm2d(FC_DIM, eps=1e-5), MemoryEfficientSwish(),
+                                   nn.AdaptiveAvgPool2d(1), nn.Flatten(1), nn.Linear(FC_DIM, num_classes)).eval()
+            x = torch.randn(1, dim, hw, hw)
+            return self._time(lambda: module(x))
+        return self._lookup("head|dim={}|hw={}|classes={}".format(dim, hw, num_classes), measure)
+
+    def predict(self, config, num_classes):
+        total = self.stem()
+        in_chans, hw = STEM_CHANNEL, self.img_size // 2
+        for s in range(4):
+            dim = config["embed_dims"][s]
+            total += self.patch_embed(in_chans, dim, hw)
+            hw //= 2
+            total += config["depths"][s] * self.block(dim, NUM_HEADS[s], config["mlp_ratios"][s],
+                                                      config["sr_ratios"][s], config["window_size"][s], hw)
+            in_chans = dim
+        return total + self.head(in_chans, hw, num_classes)
+
+
+def inherit_weights(model, super_state):
+    """
+    从超网的 state_dict 中截取与候选结构形状相同的前缀部分；形状无法截取的参数保持随机初始化。
+    相对位置编码/索引的含义随窗口大小、sr_ratio 变化，只在形状完全相同时继承。
+    """
+    state = model.state_dict()
+    inherited = 0
+    for name, tensor in state.items():
+        source = super_state.get(name)
+        if source is None or not tensor.is_floating_point() or source.dim() != tensor.dim() \
+                or any(s < t for s, t in zip(source.shape, tensor.shape)):
+            continue
+        if "relative_pos" in name and source.shape != tensor.shape:
+            continue
+        state[name] = source[tuple(slice(0, n) for n in tensor.shape)].clone()
+        inherited += 1
+    model.load_state_dict(state)
+    return inherited / max(len(state), 1)
+
+
+def train_steps(model, loader, device, steps, lr, weight_decay):
+    model.train()
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=lr,
+                                  weight_decay=weight_decay)
+    loss_function = torch.nn.CrossEntropyLoss()
+    step = 0
+    while step < steps:
+        for images, labels in loader:
+            loss = loss_function(model(images.to(device)), labels.to(device))
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            step += 1
+            if step >= steps:
+                break
+
+
+def pareto_front(results):
+    """延迟从小到大，只保留准确率严格高于所有更快结构的候选"""
+    front, best = [], -1.
+    for r in sorted(results, key=lambda r: (r["latency_ms"], -r["val_acc"])):
+        if r["val_acc"] > best:
+            front.append(r)
+            best = r["val_acc"]
+    return front
+
+
+def write_constructors(path, front, args):
+    lines = ['"""',
+             "由 nas.py 生成的 CoorLGNet 结构（准确率-延迟 Pareto 前沿），延迟为 batch 1、{} 线程。".format(args.threads),
+             "",
+             "    from {} import {}".format(os.path.splitext(os.path.basename(path))[0],
+                                           front[0]["name"] if front else "..."),
+             '"""',
+             "from CoorLGNet import _create_model, register_model",
+             ""]
+    for r in front:
+        c = r["config"]
+        lines += ["",
+                  "@register_model",
+                  "def {}(pretrained=False, **kwargs):".format(r["name"]),
+                  '    """val acc {:.4f}, latency {:.1f} ms (predicted {:.1f} ms)"""'.format(
+                      r["val_acc"], r.get("measured_ms", r["latency_ms"]), r["latency_ms"]),
+                  "    model_kwargs = dict(",
+                  "        qkv_bias=True, embed_dims={}, stem_channel={}, num_heads={},".format(
+                      c["embed_dims"], STEM_CHANNEL, NUM_HEADS),
+                  "        depths={}, mlp_ratios={}, qk_ratio=1, sr_ratios={}, window_size={}, **kwargs)".format(
+                      c["depths"], c["mlp_ratios"], c["sr_ratios"], c["window_size"]),
+                  "    model = _create_model(pretrained=pretrained, **model_kwargs)",
+                  "    return model",
+                  ""]
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    rng = random.Random(args.seed)
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = dict(DEFAULT_SPACE, **json.load(f))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # 1. 采样 + 延迟预测
+    lut = LatencyLUT(args.lut, args.threads)
+    candidates, seen = [], set()
+    attempts = 0
+    while len(candidates) < args.num_samples and attempts < args.num_samples * 50:
+        attempts += 1
+        config = sample_config(space, rng)
+        if config_key(config) in seen:
+            continue
+        seen.add(config_key(config))
+        latency = lut.predict(config, args.num_classes)
+        if args.max_latency_ms <= 0 or latency <= args.max_latency_ms:
+            candidates.append({"config": config, "latency_ms": latency})
+    lut.save()
+    print("{} candidates within the latency budget ({} configs tried, {} new latency measurements)".format(
+        len(candidates), attempts, lut.measured), file=sys.stderr)
+
+    # 2. 数据
+    train_images_path, train_images_label, val_images_path, val_images_label = read_split_data(args.data_path)
+    normalize = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    train_dataset = MyDataSet(train_images_path, train_images_label, transforms.Compose([
+        transforms.RandomResizedCrop(224), transforms.RandomHorizontalFlip(), transforms.ToTensor(), normalize]))
+    val_dataset = MyDataSet(val_images_path, val_images_label, transforms.Compose([
+        transforms.Resize(256), transforms.CenterCrop(224), transforms.ToTensor(), normalize]))
+    train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True,
+                                               num_workers=args.workers, collate_fn=train_dataset.collate_fn)
+    val_loader = torch.utils.data.DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False,
+                                             num_workers=args.workers, collate_fn=val_dataset.collate_fn)
+
+    # 3. 可选的超网
+    super_state = None
+    if args.supernet_steps > 0:
+        t0 = time.perf_counter()
+        supernet = build_model(largest_config(space), args.num_classes).to(device)
+        train_steps(supernet, train_loader, device, args.supernet_steps, args.lr, args.weight_decay)
+        super_state = dict((k, v.detach().cpu()) for k, v in supernet.state_dict().items())
+        del supernet
+        print("supernet trained in {:.1f}s".format(time.perf_counter() - t0), file=sys.stderr)
+
+    # 4. 训练、评估候选
+    for i, cand in enumerate(candidates):
+        t0 = time.perf_counter()
+        torch.manual_seed(args.seed)
+        model = build_model(cand["config"], args.num_classes)
+        if super_state is not None:
+            cand["inherited"] = inherit_weights(model, super_state)
+        model.to(device)
+        train_steps(model, train_loader, device, args.train_steps, args.lr, args.weight_decay)
+        cand["val_acc"] = accuracy(model, val_loader, device)
+        cand["params_m"] = sum(p.numel() for p in model.parameters()) / 1e6
+        print("[{}/{}] acc {:.4f}  latency {:.1f} ms  params {:.1f}M  ({:.0f}s)  {}".format(
+            i + 1, len(candidates), cand["val_acc"], cand["latency_ms"], cand["params_m"],
+            time.perf_counter() - t0, config_key(cand["config"])), file=sys.stderr)
+        del model
+
+    # 5. Pareto 前沿，实测完整模型的延迟以核对查找表的预测
+    front = pareto_front(candidates)
+    for i, r in enumerate(front):
+        r["name"] = "{}{}".format(args.name_prefix, i)
+        model = build_model(r["config"], args.num_classes).eval()
+        r["measured_ms"] = measure_latency(model, torch.device("cpu"))
+    with open(os.path.join(args.output_dir, "results.json"), "w") as f:
+        json.dump({"signature": lut.signature, "max_latency_ms": args.max_latency_ms,
+                   "candidates": candidates, "pareto": [r["name"] for r in front]}, f, indent=2)
+    write_constructors(args.output_module, front, args)
+
+    print("{:16} {:>8} {:>12} {:>12} {:>9}".format("pareto", "val acc", "predicted ms", "measured ms", "params M"))
+    for r in front:
+        print("{:16} {:>8.4f} {:>12.1f} {:>12.1f} {:>9.1f}".format(
+            r["name"], r["val_acc"], r["latency_ms"], r["measured_ms"], r["params_m"]))
+    print("constructors written to {}".format(args.output_module))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', type=str, default="./datasetold")
+    parser.add_argument('--num_classes', type=int, default=2)
+    parser.add_argument('--max-latency-ms', type=float, default=0., help='latency budget, 0: no limit')
+    parser.add_argument('--num-samples', type=int, default=20, help='candidates to train')
+    parser.add_argument('--space', type=str, default='', help='json overriding parts of the search space')
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads(), help='threads of the target CPU')
+    parser.add_argument('--lut', type=str, default='./latency_lut.json', help='latency lookup table cache')
+    parser.add_argument('--train-steps', type=int, default=200)
+    parser.add_argument('--supernet-steps', type=int, default=0, help='>0: inherit weights from a trained supernet')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--lr', type=float, default=0.0005)
+    parser.add_argument('--weight_decay', type=float, default=1E-3)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', type=str, default='./nas')
+    parser.add_argument('--output-module', type=str, default='./nas_models.py')
+    parser.add_argument('--name-prefix', type=str, default='coorlgnet_nas')
+
+    opt = parser.parse_args()
+
+    main(opt)
@@ -1,71 +1,99 @@
-import os
-import json
-import torch.nn as nn
+import argparse
+
 import torch
-from PIL import Image
-from torchvision import transforms
-import matplotlib.pyplot as plt
-from CoorLGNet import coorlgnet
 
-def main():
+from inference import build_transform, read_class_indices, load_model, load_image, add_early_exit_args, forward_fn
+from tta import add_tta_args, tta_from_args
+from tiling import add_tiling_args, tiling_from_args
+
+
+def main(args):
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
-    data_transform = transforms.Compose(
-        [transforms.Resize(256),
-         transforms.CenterCrop(224),
-         transforms.ToTensor(),
-         transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])])
+    data_transform = build_transform(args.img_size)
+    tiler = tiling_from_args(args)
 
     # load image
-    img_path = r"D:\pyCharmdata\Vit_myself_bu\datasets\test\defective1\19.jpg"
-    assert os.path.exists(img_path), "file: '{}' dose not exist.".format(img_path)
-    img = Image.open(img_path)
-    plt.imshow(img)
-    # [N, C, H, W]
-    img = data_transform(img)
-    # expand batch dimension
-    img = torch.unsqueeze(img, dim=0)
+    img = load_image(args.img_path)
+    if not args.headless:
+        # 只有需要显示图片时才导入 matplotlib
+        import matplotlib.pyplot as plt
+        plt.imshow(img)
+    if tiler is not None:
+        # 分块推理直接使用原图；profile 预热用一个 tile 大小的输入
+        scan, img = img, torch.zeros(1, 3, args.img_size, args.img_size)
+    else:
+        # [N, C, H, W]
+        img = data_transform(img)
+        # expand batch dimension
+        img = torch.unsqueeze(img, dim=0)
 
     # read class_indict
-    json_path = './class_indices.json'
-    assert os.path.exists(json_path), "file: '{}' dose not exist.".format(json_path)
-
-    with open(json_path, "r") as f:
-        class_indict = json.load(f)
-
-    # create model
-    model = coorlgnet()
+    class_indict = read_class_indices(args.class_indices)
 
-    # load model weights
-    weights_path = "./weight/best.pth"
-    #assert os.path.exists(weights_path), "file: '{}' dose not exist.".format(weights_path)
+    # create model and load model weights
+    model = load_model(args.weights, num_classes=len(class_indict), device=device)
+    if args.profile:
+        # 第一次前向含内存分配等一次性开销，先预热再计时
+        with torch.no_grad():
+            for _ in range(args.profile_warmup):
+                model(img.to(device))
+        profiler = model.enable_profiling(level=args.profile, trace=bool(args.profile_trace))
 
-    in_channel = model.fc.in_features
-    model.fc = nn.Linear(in_channel, 28)
-
-    assert os.path.exists(weights_path), "file {} does not exist.".format(weights_path)
-    model.load_state_dict(torch.load(weights_path), False)
-
-    model.to(device)
     # prediction
-    model.eval()
+    tta = tta_from_args(args)
+    assert args.early_exit is None or (tta is None and tiler is None), \
+        "--early-exit cannot be combined with --tta or --tiled"
+    forward = forward_fn(model, args.early_exit)
     with torch.no_grad():
         # predict class
-        output = torch.squeeze(model(img.to(device))).cpu()
+        if tiler is not None:
+            output = tiler(model, scan, tta=tta)
+        else:
+            output = forward(img.to(device)) if tta is None else tta(model, img.to(device))
+        output = torch.squeeze(output).cpu()
         predict = torch.softmax(output, dim=0)
         predict_cla = torch.argmax(predict).numpy()
 
+    if args.profile:
+        model.disable_profiling()
+        print(profiler.report())
+        if args.profile_trace:
+            profiler.export_chrome_trace(args.profile_trace)
+
+    if tiler is not None:
+        print("tiles: {} of {} kept ({} reduction)".format(tiler.num_kept, tiler.num_tiles, tiler.reduce))
     print_res = "class: {}   prob: {:.3}".format(class_indict[str(predict_cla)],
                                                  predict[predict_cla].numpy())
-    plt.title(print_res)
-    print("class: {}   prob: {:.3}".format(class_indict[str(predict_cla)],
-                                                 predict[predict_cla].numpy()))
-    '''
-    for i in range(len(predict)):
-        print("class: {:10}   prob: {:.3}".format(class_indict[str(i)],
-                                                  predict[i].numpy()))'''
-    plt.show()
+    print(print_res)
+    if args.all_classes:
+        for i in range(len(predict)):
+            print("class: {:10}   prob: {:.3}".format(class_indict[str(i)],
+                                                      predict[i].numpy()))
+    if not args.headless:
+        plt.title(print_res)
+        plt.show()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img-path', type=str, required=True)
+    parser.add_argument('--weights', type=str, default='./weight/best.pth')
+    parser.add_argument('--class-indices', type=str, default='./class_indices.json')
+    parser.add_argument('--img-size', type=int, default=224)
+    # 不显示图片，不导入 matplotlib（服务器、批处理任务中使用）
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--all-classes', action='store_true', help='print the probability of every class')
+    # 测试时增强，所有视图在一个 batch 中前向（见 tta.py）
+    add_tta_args(parser)
+    # 全分辨率重叠分块推理，跳过空白块（见 tiling.py）
+    add_tiling_args(parser)
+    add_early_exit_args(parser)
+    # 各阶段 / Block / 分支的前向耗时（见 profiling.py）
+    parser.add_argument('--profile', type=str, default='', choices=['', 'stage', 'block', 'branch'])
+    parser.add_argument('--profile-warmup', type=int, default=1)
+    parser.add_argument('--profile-trace', type=str, default='', help='write a chrome trace json to this path')
+
+    opt = parser.parse_args()
+
+    main(opt)
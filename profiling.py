@@ -0,0 +1,205 @@
+"""
+CoorLGNet 前向热点分析：在各阶段 / 各 Block / Block 内各分支上注册 forward hook，累计耗时和输出内存。
+
+    profiler = model.enable_profiling(level="branch")
+    ...  # 正常前向 / 训练
+    print(profiler.report())
+    profiler.export_chrome_trace("trace.json")   # chrome://tracing 或 https://ui.perfetto.dev 打开
+    model.disable_profiling()
+
+level:
+    "stage"     stem, blocks_a..d（含 patch_embed）, head
+    "block"     另加每个 Block
+    "branch"    另加 Block 内的 proj, ca_att, win_attn, ffn, attn, mlp
+关闭后 hook 全部移除，模型前向与未开启时完全相同，没有额外开销。
+只统计前向；训练时反向的耗时不在其中。CUDA 上默认在每个计时点同步，时间准确但会拖慢整体速度。
+"""
+import json
+import time
+from collections import OrderedDict
+
+import torch
+
+
+LEVELS = ("stage", "block", "branch")
+BRANCHES = ("proj", "ca_att", "win_attn", "ffn", "attn", "mlp")
+STAGES = ("a", "b", "c", "d")
+
+
+def _tensors(x):
+    if isinstance(x, torch.Tensor):
+        yield x
+    elif isinstance(x, (tuple, list)):
+        for item in x:
+            for t in _tensors(item):
+                yield t
+
+
+def _nbytes(x):
+    return sum(t.numel() * t.element_size() for t in _tensors(x))
+
+
+def _is_cuda(x):
+    return any(t.is_cuda for t in _tensors(x))
+
+
+class _Stat:
+    __slots__ = ("calls", "total", "min", "max", "out_bytes", "alloc_bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.
+        self.min = float("inf")
+        self.max = 0.
+        self.out_bytes = 0
+        self.alloc_bytes = 0
+
+    def add(self, dur, out_bytes, alloc_bytes):
+        self.calls += 1
+        self.total += dur
+        self.min = min(self.min, dur)
+        self.max = max(self.max, dur)
+        self.out_bytes += out_bytes
+        self.alloc_bytes += alloc_bytes
+
+
+class ModelProfiler:
+    def __init__(self, model, level="branch", trace=False, sync=True, max_trace_events=200000):
+        assert level in LEVELS, "unknown profiling level {}, expected one of {}".format(level, LEVELS)
+        self.level = level
+        self.trace = trace
+        self.sync = sync
+        self.max_trace_events = max_trace_events
+        self._handles = []
+        self._open = {}
+        self._origin = time.perf_counter()
+        self.stats = OrderedDict()
+        self.events = []
+
+        self._span("stem", 0, model.stem_conv1, model.stem_norm3)
+        for s in STAGES:
+            blocks = getattr(model, "blocks_" + s)
+            self._span("blocks_" + s, 0, getattr(model, "patch_embed_" + s), blocks[-1])
+            if level == "stage":
+                continue
+            for i, blk in enumerate(blocks):
+                name = "blocks_{}.{}".format(s, i)
+                self._span(name, 1, blk, blk)
+                if level == "branch":
+                    for branch in BRANCHES:
+                        module = getattr(blk, branch)
+                        self._span(name + "." + branch, 2, module, module)
+        self._span("head", 0, model._fc, model.head)
+
+    def _span(self, name, depth, start, end):
+        """从 start 模块的 forward 开始计时，到 end 模块的 forward 结束"""
+        def pre_hook(module, inputs):
+            cuda = self.sync and _is_cuda(inputs)
+            if cuda:
+                torch.cuda.synchronize()
+            alloc = torch.cuda.memory_allocated() if cuda else 0
+            self._open.setdefault(name, []).append((time.perf_counter(), cuda, alloc, depth))
+
+        def post_hook(module, inputs, output):
+            stack = self._open.get(name)
+            if not stack:  # 例如前一次前向中途抛出异常
+                return
+            self._close(name, stack.pop(), module.training, output)
+
+        self._handles.append(start.register_forward_pre_hook(pre_hook))
+        self._handles.append(end.register_forward_hook(post_hook))
+
+    def _close(self, name, entry, training, output):
+        t0, cuda, alloc, depth = entry
+        if cuda:
+            torch.cuda.synchronize()
+            alloc = torch.cuda.memory_allocated() - alloc
+        t1 = time.perf_counter()
+        mode = "train" if training else "eval"
+        key = (name, mode)
+        stat = self.stats.get(key)
+        if stat is None:
+            stat = self.stats[key] = _Stat()
+        stat.add(t1 - t0, _nbytes(output), alloc)
+        if self.trace and len(self.events) < self.max_trace_events:
+            self.events.append({"name": name, "cat": mode, "ph": "X", "pid": 0, "tid": depth,
+                                "ts": (t0 - self._origin) * 1e6, "dur": (t1 - t0) * 1e6,
+                                "args": {"out_mb": _nbytes(output) / 2 ** 20}})
+
+    def close_open_spans(self, training):
+        """
+        前向在阶段中途结束时（forward_early_exit 在 exit_b / exit_c 处所有样本都已退出）结束计时，
+        该阶段记录到此刻为止的耗时（输出内存记为 0），未结束的计时不会在之后的前向中累积
+        """
+        for name, stack in self._open.items():
+            while stack:
+                self._close(name, stack.pop(), training, None)
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._open = {}
+
+    def reset(self):
+        self.stats.clear()
+        self.events = []
+        self._open = {}
+        self._origin = time.perf_counter()
+
+    def summary(self):
+        """每个 (名称, train/eval) 一行；branch 级别另按分支类型汇总所有 Block"""
+        rows = []
+        stage_total = {}
+        for (name, mode), stat in self.stats.items():
+            if "." not in name:
+                stage_total[mode] = stage_total.get(mode, 0.) + stat.total
+        grouped = OrderedDict()
+        for (name, mode), stat in self.stats.items():
+            rows.append(self._row(name, mode, stat, stage_total))
+            parts = name.split(".")
+            if len(parts) == 3:
+                key = ("all." + parts[2], mode)
+                if key not in grouped:
+                    grouped[key] = _Stat()
+                g = grouped[key]
+                g.calls += stat.calls
+                g.total += stat.total
+                g.min = min(g.min, stat.min)
+                g.max = max(g.max, stat.max)
+                g.out_bytes += stat.out_bytes
+                g.alloc_bytes += stat.alloc_bytes
+        for (name, mode), stat in grouped.items():
+            rows.append(self._row(name, mode, stat, stage_total))
+        return rows
+
+    @staticmethod
+    def _row(name, mode, stat, stage_total):
+        return {"name": name, "mode": mode, "calls": stat.calls,
+                "total_ms": stat.total * 1000., "mean_ms": stat.total * 1000. / stat.calls,
+                "min_ms": stat.min * 1000., "max_ms": stat.max * 1000.,
+                "pct": 100. * stat.total / stage_total[mode] if stage_total.get(mode) else 0.,
+                "out_mb": stat.out_bytes / stat.calls / 2 ** 20,
+                "alloc_mb": stat.alloc_bytes / stat.calls / 2 ** 20}
+
+    def report(self, sort="total_ms", top=0):
+        rows = sorted(self.summary(), key=lambda r: r[sort], reverse=True)
+        if top > 0:
+            rows = rows[:top]
+        if not rows:
+            return "no profiling data"
+        width = max(len(r["name"]) for r in rows)
+        lines = ["{:{w}}  {:5}  {:>6}  {:>10}  {:>9}  {:>9}  {:>6}  {:>8}  {:>9}".format(
+            "name", "mode", "calls", "total ms", "mean ms", "max ms", "%", "out MB", "alloc MB", w=width)]
+        for r in rows:
+            lines.append("{:{w}}  {:5}  {:>6}  {:>10.2f}  {:>9.3f}  {:>9.3f}  {:>6.1f}  {:>8.2f}  {:>9.2f}".format(
+                r["name"], r["mode"], r["calls"], r["total_ms"], r["mean_ms"], r["max_ms"], r["pct"],
+                r["out_mb"], r["alloc_mb"], w=width))
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        """需要 enable_profiling(trace=True)；tid 0/1/2 分别对应 stage/block/branch"""
+        names = [{"name": "thread_name", "ph": "M", "pid": 0, "tid": i, "args": {"name": level}}
+                 for i, level in enumerate(LEVELS)]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": names + self.events, "displayTimeUnit": "ms"}, f)
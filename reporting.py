@@ -0,0 +1,159 @@
+"""
+训练过程的报告（TensorBoard 标量、loss.png / acc.png 曲线、xls 表格）放在后台线程中完成，训练循环只把每个 epoch 的指标放进队列，
+不会在绘图、写文件上阻塞。
+
+    reporter = Reporter(log_dir=None, plot_dir=".", xls_path="Train_data.xls", min_interval=30.)
+    reporter.log_epoch(epoch, train_loss=..., train_acc=..., val_loss=..., val_acc=..., lr=...)
+    reporter.close(best_acc=best_acc)    # 处理完队列中的所有指标，最后再完整地画一次图、保存一次表格
+
+TensorBoard 标量每个 epoch 都写；曲线和表格重新生成的开销随 epoch 数增长，两次之间至少间隔 min_interval 秒，
+close 时总会生成最终版本。matplotlib、tensorboard、xlwt 都在后台线程中导入。
+"""
+import os
+import queue
+import threading
+import time
+import traceback
+
+
+_STOP = object()
+
+XLS_COLUMNS = ("epoch", "Train_Loss", "Train_Acc", "Val_Loss", "Val_Acc", "lr", "Best val Acc")
+
+
+class Reporter:
+    def __init__(self, log_dir=None, plot_dir=".", xls_path="", min_interval=30., tensorboard=True):
+        """
+        log_dir: SummaryWriter 的目录，None 时使用 SummaryWriter 的默认目录（runs/...）
+        plot_dir: loss.png / acc.png 的目录，为空时不画图
+        xls_path: 表格文件，为空时不保存
+        """
+        self.log_dir = log_dir
+        self.plot_dir = plot_dir
+        self.xls_path = xls_path
+        self.min_interval = min_interval
+        self.tensorboard = tensorboard
+        self.history = {}           # epoch -> 指标 dict
+        self.best_acc = None
+        self._writer = None
+        self._last_render = 0.
+        self._dirty = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="reporter", daemon=True)
+        self._thread.start()
+
+    # ---- 训练线程调用 ----
+    def log_epoch(self, epoch, **metrics):
+        """metrics: train_loss / train_acc / val_loss / val_acc / lr 等；同一 epoch 可以分多次给出（如异步验证）"""
+        self._queue.put(("epoch", epoch, dict(metrics)))
+
+    def add_graph(self, model, example_input):
+        """在 TensorBoard 中记录模型结构。trace 整个模型，只在训练开始前调用，会等待完成"""
+        done = threading.Event()
+        self._queue.put(("graph", (model, example_input), done))
+        done.wait()
+
+    def close(self, best_acc=None):
+        self._queue.put(("close", best_acc, None))
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    # ---- 后台线程 ----
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            try:
+                self._handle(*item)
+                # 把已经到达的指标全部处理完再决定是否重新画图
+                if self._queue.empty() and self._dirty and time.time() - self._last_render >= self.min_interval:
+                    self._render()
+            except Exception:
+                # 报告出错不影响训练
+                traceback.print_exc()
+
+    def _tb_writer(self):
+        if self._writer is None and self.tensorboard:
+            from torch.utils.tensorboard import SummaryWriter
+            self._writer = SummaryWriter(log_dir=self.log_dir)
+        return self._writer
+
+    def _handle(self, kind, key, value):
+        if kind == "epoch":
+            self.history.setdefault(key, {}).update(value)
+            writer = self._tb_writer()
+            if writer is not None:
+                tags = {"train_loss": "train_loss", "train_acc": "train_acc", "val_loss": "val_loss",
+                        "val_acc": "val_acc", "lr": "learning_rate"}
+                for name, v in value.items():
+                    writer.add_scalar(tags.get(name, name), v, key)
+            self._dirty = True
+        elif kind == "graph":
+            try:
+                writer = self._tb_writer()
+                if writer is not None:
+                    writer.add_graph(key[0], key[1], verbose=False)
+            finally:
+                value.set()
+        elif kind == "close":
+            self.best_acc = key
+            self._render()
+            if self._writer is not None:
+                self._writer.close()
+
+    def _render(self):
+        self._last_render = time.time()
+        self._dirty = False
+        if self.plot_dir:
+            self._plot()
+        if self.xls_path:
+            self._save_xls()
+
+    def _series(self, name):
+        epochs = [e for e in sorted(self.history) if name in self.history[e]]
+        return epochs, [self.history[e][name] for e in epochs]
+
+    def _plot(self):
+        # 不经过 pyplot，Figure 对象可以在非主线程中使用
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        for metric, title, loc in (("loss", "Model Loss ", "upper right"), ("acc", "Model Acc", "lower right")):
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot(1, 1, 1)
+            ax.plot(*self._series("train_" + metric), 'r-', label="Train " + metric.capitalize())
+            ax.plot(*self._series("val_" + metric), 'b-', label="Val " + metric.capitalize())
+            ax.legend(loc=loc)
+            ax.set_xlabel("epoch")
+            ax.set_ylabel(metric)
+            ax.set_title(title)
+            fig.savefig(os.path.join(self.plot_dir, metric + ".png"))
+
+    def _save_xls(self):
+        import xlwt
+        book = xlwt.Workbook(encoding='utf-8')
+        sheet = book.add_sheet(u'Train_data', cell_overwrite_ok=True)
+        for col, name in enumerate(XLS_COLUMNS):
+            sheet.write(0, col, name)
+        for row, epoch in enumerate(sorted(self.history), start=1):
+            m = self.history[epoch]
+            sheet.write(row, 0, epoch + 1)
+            for col, name in enumerate(("train_loss", "train_acc", "val_loss", "val_acc", "lr"), start=1):
+                if name in m:
+                    sheet.write(row, col, str(m[name]))
+        if self.best_acc is not None:
+            sheet.write(1, 6, str(self.best_acc))
+        # 先写临时文件再替换，中断时不会留下损坏的表格
+        tmp = self.xls_path + ".tmp"
+        book.save(tmp)
+        os.replace(tmp, self.xls_path)
+
+
+def add_reporting_args(parser):
+    parser.add_argument('--report-interval', type=float, default=30.,
+                        help='minimum seconds between redraws of loss.png / acc.png and the xls file')
+    parser.add_argument('--report-xls', type=str, default='', help='save per-epoch metrics to this xls file')
+    parser.add_argument('--report-plot-dir', type=str, default='.', help="directory of loss.png / acc.png, '' to disable")
+    # 在 TensorBoard 中记录模型结构需要 trace 整个模型，默认关闭
+    parser.add_argument('--tb-graph', action='store_true')
@@ -0,0 +1,266 @@
+"""
+多进程、分片、可断点续跑的离线打分任务。
+
+输入图片按路径hash固定划分到 num_shards 个分片，每个进程加载一次模型，依次处理分配到的分片：
+    <output-dir>/shard-00000.jsonl    分片结果（追加写）
+    <output-dir>/shard-00000.journal  进度日志（追加写），结果落盘后才记录对应路径
+任务中断后用相同参数重新运行，已经记录在日志中的图片会被跳过。全部分片完成后合并为按路径排序的
+<output-dir>/results.jsonl。
+
+--only-changed 模式会读取上一次的 results.jsonl，只对内容hash或模型权重hash发生变化的图片重新打分。
+"""
+import io
+import os
+import glob
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing as mp
+
+from PIL import Image
+
+
+def file_sha1(path: str, chunk_size: int = 1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def shard_of(path: str, num_shards: int):
+    return int(hashlib.md5(path.encode("utf-8")).hexdigest()[:8], 16) % num_shards
+
+
+def _shard_paths(output_dir, shard_id):
+    prefix = os.path.join(output_dir, "shard-{:05d}".format(shard_id))
+    return prefix + ".jsonl", prefix + ".journal"
+
+
+def _read_lines(path):
+    """读取追加写的文件，忽略崩溃时可能残留的不完整的最后一行"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.endswith("\n"):
+                yield line[:-1]
+
+
+def _read_records(path):
+    for line in _read_lines(path):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def _append(f, lines):
+    f.write("".join(line + "\n" for line in lines))
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _score_shard(shard_id, paths, args, model, transform, class_names, previous, device):
+    import torch
+
+    results_path, journal_path = _shard_paths(args.output_dir, shard_id)
+    done = set(_read_lines(journal_path))
+    todo = [p for p in paths if p not in done]
+    if len(todo) == 0:
+        return 0, 0
+
+    num_scored = num_reused = 0
+    with open(results_path, "a", encoding="utf-8") as results_file, \
+            open(journal_path, "a", encoding="utf-8") as journal_file:
+        batch, records = [], []
+
+        def flush():
+            nonlocal num_scored
+            if len(batch) > 0:
+                with torch.no_grad():
+                    output = model(torch.stack([img for _, img in batch], dim=0).to(device))
+                    probs = torch.softmax(output.float(), dim=1).cpu().tolist()
+                for (record, _), p in zip(batch, probs):
+                    idx = max(range(len(p)), key=lambda i: p[i])
+                    record.update({"class": class_names[idx], "prob": p[idx], "probs": dict(zip(class_names, p))})
+                    records.append(record)
+                num_scored += len(batch)
+            # 先写结果，再写日志，保证日志中的路径一定有结果
+            _append(results_file, [json.dumps(r, ensure_ascii=False) for r in records])
+            _append(journal_file, [r["path"] for r in records])
+            batch.clear()
+            records.clear()
+
+        for path in todo:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                records.append({"path": path, "sha1": None, "model_sha1": args.model_sha1,
+                                "error": "{}: {}".format(type(e).__name__, e)})
+                continue
+            sha1 = hashlib.sha1(data).hexdigest()
+            old = previous.get(path)
+            if old is not None and old.get("sha1") == sha1 and old.get("model_sha1") == args.model_sha1 \
+                    and "error" not in old:
+                records.append(old)
+                num_reused += 1
+                continue
+            record = {"path": path, "sha1": sha1, "model_sha1": args.model_sha1}
+            try:
+                with Image.open(io.BytesIO(data)) as img:
+                    img = img.convert("RGB")
+                batch.append((record, transform(img)))
+            except Exception as e:
+                record["error"] = "{}: {}".format(type(e).__name__, e)
+                records.append(record)
+            if len(batch) >= args.batch_size:
+                flush()
+        flush()
+    return num_scored, num_reused
+
+
+def worker(worker_id, shard_ids, args):
+    import torch
+    from inference import build_transform, read_class_indices, load_model
+
+    # 每个进程固定线程数，避免 N 个进程互相抢占 CPU
+    torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    class_indict = read_class_indices(args.class_indices)
+    class_names = [class_indict[str(i)] for i in range(len(class_indict))]
+    model = load_model(args.weights, num_classes=len(class_names), device=device)
+    transform = build_transform(args.img_size)
+
+    # 一次遍历输入清单和上一次的结果，按分片分组
+    shard_set = set(shard_ids)
+    shard_paths = dict((shard_id, []) for shard_id in shard_ids)
+    for path in _read_lines(args.path_list):
+        shard_id = shard_of(path, args.num_shards)
+        if shard_id in shard_set:
+            shard_paths[shard_id].append(path)
+    shard_previous = dict((shard_id, {}) for shard_id in shard_ids)
+    if args.only_changed and args.previous and os.path.exists(args.previous):
+        for record in _read_records(args.previous):
+            shard_id = shard_of(record["path"], args.num_shards)
+            if shard_id in shard_set:
+                shard_previous[shard_id][record["path"]] = record
+
+    for shard_id in shard_ids:
+        paths, previous = shard_paths.pop(shard_id), shard_previous.pop(shard_id)
+        t0 = time.perf_counter()
+        num_scored, num_reused = _score_shard(shard_id, paths, args, model, transform, class_names,
+                                              previous, device)
+        print("[worker {}] shard {}: {} images, {} scored, {} unchanged, {:.1f}s".format(
+            worker_id, shard_id, len(paths), num_scored, num_reused, time.perf_counter() - t0), file=sys.stderr)
+
+
+def merge(output_dir, num_shards, output_path, keep_shards=False):
+    """合并所有分片，只保留日志中已完成的记录，同一路径以最后一次结果为准，按路径排序输出"""
+    rows = {}
+    for shard_id in range(num_shards):
+        results_path, journal_path = _shard_paths(output_dir, shard_id)
+        done = set(_read_lines(journal_path))
+        for line in _read_lines(results_path):
+            try:
+                path = json.loads(line)["path"]
+            except (ValueError, KeyError):
+                continue
+            if path in done:
+                rows[path] = line
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for path in sorted(rows):
+            f.write(rows[path] + "\n")
+    os.replace(tmp_path, output_path)
+    if not keep_shards:
+        for shard_id in range(num_shards):
+            for path in _shard_paths(output_dir, shard_id):
+                if os.path.exists(path):
+                    os.remove(path)
+    return len(rows)
+
+
+def main(args):
+    from inference import iter_image_paths
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, "results.jsonl")
+    if args.only_changed and not args.previous:
+        args.previous = output_path
+    args.model_sha1 = file_sha1(args.weights)
+
+    # 分片数必须和中断前的任务一致，否则路径会被分到不同的分片；
+    # 分片划分与进程数无关，续跑时没有给出 --num-shards 就沿用 job.json 中的分片数
+    job_path = os.path.join(args.output_dir, "job.json")
+    old_job = None
+    if os.path.exists(job_path) and len(glob.glob(os.path.join(args.output_dir, "shard-*.journal"))) > 0:
+        with open(job_path, "r") as f:
+            old_job = json.load(f)
+    args.num_shards = args.num_shards or (old_job or {}).get("num_shards") or args.workers * 4
+    job = {"num_shards": args.num_shards, "model_sha1": args.model_sha1, "input": args.input}
+    if old_job is not None:
+        assert old_job == job, "unfinished job in {} was started with {}, remove the shard files to restart " \
+                               "from scratch.".format(args.output_dir, old_job)
+    with open(job_path, "w") as f:
+        json.dump(job, f, indent=4)
+
+    # 输入清单只枚举一次，写入任务目录供各进程读取
+    args.path_list = os.path.join(args.output_dir, "inputs.txt")
+    num_inputs = 0
+    with open(args.path_list + ".tmp", "w", encoding="utf-8") as f:
+        for path in iter_image_paths(args.input):
+            f.write(path + "\n")
+            num_inputs += 1
+    os.replace(args.path_list + ".tmp", args.path_list)
+    print("{} images, {} shards, {} workers x {} threads".format(
+        num_inputs, args.num_shards, args.workers, args.threads), file=sys.stderr)
+
+    t0 = time.perf_counter()
+    ctx = mp.get_context("spawn")
+    procs = []
+    for worker_id in range(args.workers):
+        shard_ids = list(range(worker_id, args.num_shards, args.workers))
+        p = ctx.Process(target=worker, args=(worker_id, shard_ids, args))
+        p.start()
+        procs.append(p)
+    for p in procs:
+        p.join()
+    failed = [i for i, p in enumerate(procs) if p.exitcode != 0]
+    if failed:
+        print("workers {} failed, rerun the same command to resume.".format(failed), file=sys.stderr)
+        sys.exit(1)
+
+    num_rows = merge(args.output_dir, args.num_shards, output_path, keep_shards=args.keep_shards)
+    os.remove(args.path_list)
+    print("{} results written to {} in {:.1f}s".format(num_rows, output_path, time.perf_counter() - t0),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    # 图片文件夹（递归遍历）或每行一个路径的列表文件
+    parser.add_argument('--input', type=str, required=True)
+    parser.add_argument('--output-dir', type=str, required=True)
+    parser.add_argument('--weights', type=str, default='./weight/best.pth')
+    parser.add_argument('--class-indices', type=str, default='./class_indices.json')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument('--threads', type=int, default=4, help='torch threads per worker process')
+    parser.add_argument('--num-shards', type=int, default=0,
+                        help="default: 4 shards per worker, or the unfinished job's value when resuming")
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--device', type=str, default='cpu')
+    # 只对内容或模型发生变化的图片重新打分
+    parser.add_argument('--only-changed', action='store_true')
+    parser.add_argument('--previous', type=str, default='',
+                        help='previous results.jsonl, defaults to <output-dir>/results.jsonl')
+    parser.add_argument('--keep-shards', action='store_true',
+                        help='keep shard files after merging (a rerun in the same directory then resumes them)')
+
+    opt = parser.parse_args()
+
+    main(opt)
@@ -0,0 +1,238 @@
+"""
+本地 HTTP 推理服务：模型只加载、预热一次，并把并发请求动态合并成 batch。
+
+    POST /predict   请求体为图片文件的原始字节，返回各类别概率
+    GET  /metrics   延迟 p50/p95/p99、队列深度、batch 大小分布
+    GET  /healthz
+
+例：curl --data-binary @mea1-H1.jpg http://127.0.0.1:8080/predict
+"""
+import io
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from PIL import Image
+
+from inference import build_transform, read_class_indices, load_model, add_early_exit_args, forward_fn
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100. * (len(values) - 1))))]
+
+
+class ServerMetrics:
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latency_ms = deque(maxlen=window)  # 最近 window 个请求的端到端延迟
+        self.batch_sizes = Counter()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_rejected = 0
+
+    def add_latency(self, ms):
+        with self.lock:
+            self.latency_ms.append(ms)
+            self.num_requests += 1
+
+    def add_error(self, rejected=False):
+        with self.lock:
+            if rejected:
+                self.num_rejected += 1
+            else:
+                self.num_errors += 1
+
+    def add_batch(self, size):
+        with self.lock:
+            self.batch_sizes[size] += 1
+
+    def snapshot(self, queue_depth):
+        with self.lock:
+            latency = list(self.latency_ms)
+            return {
+                "requests": self.num_requests,
+                "errors": self.num_errors,
+                "rejected": self.num_rejected,
+                "queue_depth": queue_depth,
+                "latency_ms": {"p50": percentile(latency, 50), "p95": percentile(latency, 95),
+                               "p99": percentile(latency, 99), "window": len(latency)},
+                "batch_size_histogram": dict((str(k), v) for k, v in sorted(self.batch_sizes.items())),
+            }
+
+
+class DynamicBatcher:
+    """
+    后台线程从队列中取请求：拿到第一个请求后最多再等待 max_wait_ms，或凑满 max_batch_size 后执行一次前向
+    """
+
+    def __init__(self, model, device, max_batch_size=16, max_wait_ms=5., max_queue=256, metrics=None):
+        """model: 模型或 x -> logits 的前向函数（如 inference.forward_fn 的早退前向）"""
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.metrics = metrics
+        self.thread = threading.Thread(target=self._loop, name="batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, img):
+        """img: 预处理后的 [C, H, W] tensor，返回 Future，结果为各类别概率 list；队列已满时抛出 queue.Full"""
+        future = Future()
+        self.queue.put_nowait((img, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            # 已经超时被取消的请求不再计算；其余的标记为运行中，之后无法再取消
+            batch = [(img, future) for img, future in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                self._run(batch)
+
+    def _run(self, batch):
+        try:
+            with torch.no_grad():
+                output = self.model(torch.stack([img for img, _ in batch], dim=0).to(self.device))
+                probs = torch.softmax(output.float(), dim=1).cpu().tolist()
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        if self.metrics is not None:
+            self.metrics.add_batch(len(batch))
+        for (_, future), p in zip(batch, probs):
+            future.set_result(p)
+
+
+def make_handler(batcher, transform, class_names, metrics, request_timeout):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, code, obj):
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._send_json(200, metrics.snapshot(batcher.queue.qsize()))
+            elif self.path == "/healthz":
+                self._send_json(200, {"status": "ok"})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send_json(404, {"error": "not found"})
+                return
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                with Image.open(io.BytesIO(self.rfile.read(length))) as img:
+                    img = transform(img.convert("RGB"))
+            except Exception as e:
+                metrics.add_error()
+                self._send_json(400, {"error": "invalid image: {}".format(e)})
+                return
+            try:
+                future = batcher.submit(img)
+            except queue.Full:
+                metrics.add_error(rejected=True)
+                self._send_json(503, {"error": "server busy"})
+                return
+            try:
+                probs = future.result(timeout=request_timeout)
+            except FutureTimeout:
+                # 还在队列中的请求取消后不会再进入前向
+                future.cancel()
+                metrics.add_error()
+                self._send_json(504, {"error": "timed out after {}s".format(request_timeout)})
+                return
+            except Exception as e:
+                metrics.add_error()
+                self._send_json(500, {"error": str(e)})
+                return
+            idx = max(range(len(probs)), key=lambda i: probs[i])
+            metrics.add_latency((time.perf_counter() - start) * 1000.)
+            self._send_json(200, {"class": class_names[idx], "prob": probs[idx],
+                                  "probs": dict(zip(class_names, probs))})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(args):
+    device = torch.device(args.device if args.device else ("cuda:0" if torch.cuda.is_available() else "cpu"))
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    class_indict = read_class_indices(args.class_indices)
+    class_names = [class_indict[str(i)] for i in range(len(class_indict))]
+    model = load_model(args.weights, num_classes=len(class_names), device=device)
+    forward = forward_fn(model, args.early_exit)
+    transform = build_transform(args.img_size)
+
+    # 预热：第一次前向会分配内存、选择算子实现
+    with torch.no_grad():
+        for batch_size in sorted({1, args.max_batch_size}):
+            forward(torch.zeros(batch_size, 3, args.img_size, args.img_size, device=device))
+
+    metrics = ServerMetrics()
+    batcher = DynamicBatcher(forward, device, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                             max_queue=args.max_queue, metrics=metrics)
+    server = ThreadingHTTPServer((args.host, args.port),
+                                 make_handler(batcher, transform, class_names, metrics, args.request_timeout))
+    print("serving on http://{}:{} (max batch {}, max wait {}ms)".format(
+        args.host, args.port, args.max_batch_size, args.max_wait_ms), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default='./weight/best.pth')
+    parser.add_argument('--class-indices', type=str, default='./class_indices.json')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=5.)
+    parser.add_argument('--max-queue', type=int, default=256)
+    parser.add_argument('--request-timeout', type=float, default=30.)
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads, 0 keeps the default')
+    parser.add_argument('--device', type=str, default='')
+    add_early_exit_args(parser)
+
+    opt = parser.parse_args()
+
+    main(opt)
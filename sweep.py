@@ -0,0 +1,206 @@
+"""
+并行超参数扫描：同时运行 --workers 个试验，每个进程 --threads 个 CPU 线程，搜索 lr、weight_decay、batch_size、
+drop_rate、drop_path_rate。
+
+    python sweep.py --data-path ./dataset --trials 16 --workers 4 --epochs 27 \
+        --lr 1e-4 3e-4 1e-3 --weight-decay 1e-3 5e-2 --batch-size 8 16 --drop-rate 0.1 0.2 --drop-path-rate 0 0.1
+
+数据: 所有图片只解码一次，保存在 --cache 文件中（见 image_cache.py），各进程以 mmap 方式只读共享。
+早停: 异步的逐次减半（ASHA）。第 min_epochs * eta^k 个 epoch 为检查点，试验在检查点的验证准确率
+（train.evaluate）不在该检查点已有结果的前 1 / eta 时停止。
+输出: <output-dir>/trial_XXX/best.pth 为每个试验验证准确率最高的权重，leaderboard.json 和打印的排行榜按最高准确率排序，
+各进程的训练输出在 <output-dir>/worker_X.log 中。
+"""
+import os
+import sys
+import json
+import math
+import queue
+import random
+import argparse
+import itertools
+import multiprocessing as mp
+
+import torch
+
+from utils import read_split_data
+from image_cache import build_image_cache, load_image_cache, CachedImageDataset
+
+
+SEARCH_KEYS = ("lr", "weight_decay", "batch_size", "drop_rate", "drop_path_rate")
+
+
+def sample_trials(space, num_trials, rng):
+    """搜索空间的组合数不超过 num_trials 时使用全部组合，否则不重复地随机采样"""
+    grid = [dict(zip(SEARCH_KEYS, values)) for values in itertools.product(*(space[k] for k in SEARCH_KEYS))]
+    rng.shuffle(grid)
+    return grid[:num_trials]
+
+
+def rung_epochs(min_epochs, eta, epochs):
+    rungs, r = [], min_epochs
+    while r < epochs:
+        rungs.append(r)
+        r *= eta
+    return rungs
+
+
+class SuccessiveHalving:
+    """异步逐次减半: 每个检查点只和已经到达该检查点的试验比较，不等待其他试验"""
+
+    def __init__(self, rungs, eta):
+        self.eta = eta
+        self.records = dict((r, []) for r in rungs)
+
+    def keep_going(self, epochs_done, val_acc):
+        if epochs_done not in self.records:
+            return True
+        records = self.records[epochs_done]
+        records.append(val_acc)
+        rank = sum(1 for acc in records if acc > val_acc)
+        return rank < math.ceil(len(records) / self.eta)
+
+
+def worker(worker_id, args, cache_path, train_indices, val_indices, labels, tasks, events, replies):
+    torch.set_num_threads(args.threads)
+    # 进度和指标写到各进程的日志文件中
+    sys.stdout = open(os.path.join(args.output_dir, "worker_{}.log".format(worker_id)), "a", buffering=1)
+    from CoorLGNet import coorlgnet
+    from train import train_one_epoch, evaluate
+    from checkpoint import atomic_save
+
+    device = torch.device(args.device)
+    train_images, val_images = load_image_cache(cache_path)
+    train_dataset = CachedImageDataset(train_images, labels, train_indices, train=True)
+    val_dataset = CachedImageDataset(val_images, labels, val_indices, train=False)
+    val_loader = torch.utils.data.DataLoader(val_dataset, batch_size=32, shuffle=False,
+                                             collate_fn=val_dataset.collate_fn)
+    while True:
+        trial = tasks.get()
+        if trial is None:
+            return
+        params = trial["params"]
+        print("trial {}: {}".format(trial["id"], params))
+        torch.manual_seed(args.seed + trial["id"])
+        model = coorlgnet(num_classes=args.num_classes, drop_rate=params["drop_rate"],
+                          drop_path_rate=params["drop_path_rate"]).to(device)
+        optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=params["lr"],
+                                      weight_decay=params["weight_decay"])
+        scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer=optimizer, T_max=args.epochs)
+        train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=params["batch_size"], shuffle=True,
+                                                   collate_fn=train_dataset.collate_fn)
+        checkpoint_path = os.path.join(args.output_dir, "trial_{:03d}".format(trial["id"]), "best.pth")
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+        best_acc = -1.
+        for epoch in range(args.epochs):
+            train_loss, train_acc = train_one_epoch(model, optimizer, train_loader, device, epoch, progress=False)
+            scheduler.step()
+            val_loss, val_acc = evaluate(model, val_loader, device, epoch, progress=False, csv_path=None)
+            if val_acc > best_acc:
+                best_acc = val_acc
+                atomic_save(model.state_dict(), checkpoint_path)
+            events.put((worker_id, trial["id"], epoch, train_loss, train_acc, val_loss, val_acc, checkpoint_path))
+            if not replies.get():
+                break
+
+
+def print_leaderboard(trials):
+    print("{:>5} {:>9} {:>9} {:>6} {:>6} {:>6} {:>9} {:>6}  {}".format(
+        "trial", "lr", "wd", "bs", "drop", "dpath", "best acc", "epoch", "status"))
+    for t in trials:
+        p = t["params"]
+        print("{:>5} {:>9.2e} {:>9.2e} {:>6} {:>6} {:>6} {:>9.4f} {:>6}  {}".format(
+            t["id"], p["lr"], p["weight_decay"], p["batch_size"], p["drop_rate"], p["drop_path_rate"],
+            t["best_val_acc"], t["best_epoch"], t["status"]))
+
+
+def main(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    rng = random.Random(args.seed)
+    space = {"lr": args.lr, "weight_decay": args.weight_decay, "batch_size": args.batch_size,
+             "drop_rate": args.drop_rate, "drop_path_rate": args.drop_path_rate}
+    trials = [{"id": i, "params": params, "history": [], "best_val_acc": -1., "best_epoch": -1,
+               "status": "pending"} for i, params in enumerate(sample_trials(space, args.trials, rng))]
+
+    train_images_path, train_images_label, val_images_path, val_images_label = read_split_data(args.data_path)
+    labels = train_images_label + val_images_label
+    build_image_cache(args.cache, train_images_path + val_images_path, num_workers=args.decode_workers)
+    train_indices = list(range(len(train_images_path)))
+    val_indices = list(range(len(train_images_path), len(labels)))
+
+    rungs = rung_epochs(args.min_epochs, args.eta, args.epochs)
+    halving = SuccessiveHalving(rungs, args.eta)
+    print("{} trials, {} workers x {} threads, rungs at epochs {}".format(
+        len(trials), args.workers, args.threads, rungs), file=sys.stderr)
+
+    ctx = mp.get_context("spawn")
+    tasks, events = ctx.Queue(), ctx.Queue()
+    replies = [ctx.Queue() for _ in range(args.workers)]
+    for trial in trials:
+        tasks.put({"id": trial["id"], "params": trial["params"]})
+    for _ in range(args.workers):
+        tasks.put(None)
+    procs = [ctx.Process(target=worker, args=(i, args, args.cache, train_indices, val_indices, labels,
+                                              tasks, events, replies[i]))
+             for i in range(args.workers)]
+    for p in procs:
+        p.start()
+
+    running = len(trials)
+    while running > 0:
+        try:
+            worker_id, trial_id, epoch, train_loss, train_acc, val_loss, val_acc, path = events.get(timeout=10)
+        except queue.Empty:
+            if not any(p.is_alive() for p in procs):
+                print("all workers exited with {} trials unfinished".format(running), file=sys.stderr)
+                break
+            continue
+        trial = trials[trial_id]
+        trial["history"].append({"epoch": epoch, "train_loss": train_loss, "train_acc": train_acc,
+                                 "val_loss": val_loss, "val_acc": val_acc})
+        if val_acc > trial["best_val_acc"]:
+            trial["best_val_acc"], trial["best_epoch"], trial["checkpoint"] = val_acc, epoch, path
+        keep_going = halving.keep_going(epoch + 1, val_acc) and epoch + 1 < args.epochs
+        trial["status"] = "running" if keep_going else (
+            "completed" if epoch + 1 == args.epochs else "stopped at epoch {}".format(epoch + 1))
+        replies[worker_id].put(keep_going)
+        print("trial {:3d} epoch {:3d}: val acc {:.4f}  {}".format(trial_id, epoch, val_acc, trial["status"]),
+              file=sys.stderr)
+        if not keep_going:
+            running -= 1
+    for p in procs:
+        p.join()
+
+    trials.sort(key=lambda t: -t["best_val_acc"])
+    with open(os.path.join(args.output_dir, "leaderboard.json"), "w") as f:
+        json.dump(trials, f, indent=2)
+    print_leaderboard(trials)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', type=str, default="./datasetold")
+    parser.add_argument('--num_classes', type=int, default=2)
+    parser.add_argument('--output-dir', type=str, default='./sweep')
+    parser.add_argument('--cache', type=str, default='./image_cache.tensors', help='decoded image cache')
+    parser.add_argument('--decode-workers', type=int, default=8)
+    # 搜索空间，每个参数一个或多个取值
+    parser.add_argument('--lr', type=float, nargs='+', default=[1e-4, 3e-4, 1e-3])
+    parser.add_argument('--weight-decay', type=float, nargs='+', default=[1e-3, 1e-2, 5e-2])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[8, 16])
+    parser.add_argument('--drop-rate', type=float, nargs='+', default=[0.2])
+    parser.add_argument('--drop-path-rate', type=float, nargs='+', default=[0., 0.1])
+    parser.add_argument('--trials', type=int, default=16)
+    parser.add_argument('--epochs', type=int, default=27, help='maximum epochs per trial')
+    # 逐次减半: 检查点为 min-epochs * eta^k
+    parser.add_argument('--min-epochs', type=int, default=1)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=4, help='concurrent trials')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads per trial, default: cpus / workers')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--seed', type=int, default=0)
+
+    opt = parser.parse_args()
+    opt.threads = opt.threads or max(1, (os.cpu_count() or 1) // opt.workers)
+
+    main(opt)
@@ -0,0 +1,183 @@
+"""
+可内存映射、零拷贝加载的扁平权重格式（与 safetensors 类似）。
+
+文件结构:
+    8 字节  MAGIC
+    8 字节  JSON 头的长度（小端 uint64）
+    JSON 头 {"config": 模型参数, "class_indices": 类别索引, "tensors": {name: {dtype, shape, offset, nbytes}}}
+            用空格补齐，使数据区从 ALIGN 字节对齐的位置开始
+    数据区  每个 tensor 的原始字节，偏移量均按 ALIGN 字节对齐
+
+加载时整个文件以 copy-on-write 方式 mmap，tensor 直接指向映射的页面，不做反序列化也不做拷贝；
+再通过 CoorLGNet.load_checkpoint 用 load_state_dict(..., assign=True) 把参数绑定到这些 tensor 上。同一台机器上的多个推理进程
+共享页缓存中的同一份物理内存，只有被写入的页面才会在进程内复制。
+
+旧的 pickle 格式 best.pth 可以转换:
+    python tensorfile.py --pth ./weight/best.pth --output ./weight/best.tensors
+
+模型结构参数（CoorLGNet.ARCH_KEYS）: tensor 文件保存在 JSON 头的 config 中；.pth 保存在同名的 .json 文件中
+（./weight/best.pth -> ./weight/best.json，由 train.py 在保存最优权重时写出），转换时合并到 config。
+"""
+import os
+import json
+import struct
+import argparse
+
+import numpy as np
+import torch
+
+
+MAGIC = b"CLGNTF01"
+ALIGN = 64
+
+_DTYPES = dict((str(dtype).replace("torch.", ""), dtype) for dtype in [
+    torch.float64, torch.float32, torch.float16, torch.bfloat16,
+    torch.int64, torch.int32, torch.int16, torch.int8, torch.uint8, torch.bool])
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def is_tensorfile(path: str):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_tensorfile(path: str, state_dict, config=None, class_indices=None):
+    """按 ALIGN 字节对齐写出所有 tensor，先写临时文件再 rename，保证文件完整"""
+    tensors = {}
+    offset = 0
+    arrays = []
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu().contiguous()
+        dtype = str(tensor.dtype).replace("torch.", "")
+        assert dtype in _DTYPES, "unsupported dtype {} of {}".format(tensor.dtype, name)
+        nbytes = tensor.numel() * tensor.element_size()
+        tensors[name] = {"dtype": dtype, "shape": list(tensor.shape), "offset": offset, "nbytes": nbytes}
+        arrays.append((offset, tensor.reshape(-1).view(torch.uint8).numpy()))
+        offset = _align(offset + nbytes)
+    data_size = offset
+
+    header = json.dumps({"config": config or {}, "class_indices": class_indices or {}, "tensors": tensors},
+                        ensure_ascii=False).encode("utf-8")
+    header += b" " * (_align(16 + len(header)) - 16 - len(header))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        data_start = f.tell()
+        for offset, array in arrays:
+            f.seek(data_start + offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + data_size)
+    os.replace(tmp_path, path)
+
+
+def config_path(weights_path: str):
+    """.pth 权重对应的结构参数文件"""
+    return os.path.splitext(weights_path)[0] + ".json"
+
+
+def write_model_config(weights_path: str, config):
+    """写出 weights_path 的结构参数；config 为 None 时删除旧文件，避免与新权重不匹配"""
+    path = config_path(weights_path)
+    if config is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(config, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def read_model_config(weights_path: str):
+    """tensor 文件 JSON 头中的 config，或 .pth 同名 .json 中的结构参数；都没有时返回 {}（按默认结构加载）"""
+    if is_tensorfile(weights_path):
+        return read_header(weights_path)["config"]
+    path = config_path(weights_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def read_header(path: str):
+    with open(path, "rb") as f:
+        assert f.read(len(MAGIC)) == MAGIC, "{} is not a tensor file.".format(path)
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    header["data_start"] = 16 + header_len
+    return header
+
+
+def load_tensorfile(path: str):
+    """
+    Returns:
+        state_dict: name -> tensor，tensor 直接引用 mmap 的页面（copy-on-write）
+        header: JSON 头（config, class_indices）
+    """
+    header = read_header(path)
+    data_start = header["data_start"]
+    buffer = np.memmap(path, dtype=np.uint8, mode="c")
+    storage = torch.from_numpy(buffer)
+    state_dict = {}
+    for name, info in header["tensors"].items():
+        start = data_start + info["offset"]
+        raw = storage[start:start + info["nbytes"]]
+        state_dict[name] = raw.view(_DTYPES[info["dtype"]]).reshape(info["shape"])
+    return state_dict, header
+
+
+def convert_pth(pth_path: str, output_path: str, config=None, class_indices=None, filter_fn=None):
+    """
+    把 torch.save 的 pickle 格式 state_dict 转为 tensor 文件
+    filter_fn: 保存前对 state_dict 的转换，如 CoorLGNet.checkpoint_filter_fn（换分辨率 / 'sr' 转 'linear'）
+    """
+    state_dict = torch.load(pth_path, map_location="cpu")
+    if "model" in state_dict and isinstance(state_dict["model"], dict):
+        state_dict = state_dict["model"]
+    if filter_fn is not None:
+        state_dict = filter_fn(state_dict)
+    save_tensorfile(output_path, state_dict, config=config, class_indices=class_indices)
+    return len(state_dict)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pth', type=str, required=True, help='pickled state_dict, e.g. ./weight/best.pth')
+    parser.add_argument('--output', type=str, default='', help='default: same name with .tensors suffix')
+    parser.add_argument('--class-indices', type=str, default='./class_indices.json')
+    parser.add_argument('--img-size', type=int, default=0, help='default: from the .json next to --pth, or 224')
+    # 与训练时不同的结构: 新的输入分辨率或全局注意力类型，权重在转换时插值 / 分解（见 CoorLGNet.checkpoint_filter_fn）
+    parser.add_argument('--global-attn', type=str, nargs='+', default=None, choices=['sr', 'bra', 'linear'])
+    parser.add_argument('--linear-rank', type=int, default=0)
+
+    opt = parser.parse_args()
+
+    class_indict = {}
+    if os.path.exists(opt.class_indices):
+        with open(opt.class_indices, "r") as f:
+            class_indict = json.load(f)
+    config = dict({"arch": "coorlgnet", "img_size": 224}, **read_model_config(opt.pth))
+    if opt.img_size:
+        config["img_size"] = opt.img_size
+    if opt.global_attn:
+        config["global_attn"] = opt.global_attn[0] if len(opt.global_attn) == 1 else opt.global_attn
+    if opt.linear_rank:
+        config["linear_rank"] = opt.linear_rank
+    if class_indict:
+        config["num_classes"] = len(class_indict)
+    filter_fn = None
+    if opt.img_size or opt.global_attn or opt.linear_rank:
+        # 按新结构构建模型，把权重转换成它的形状
+        from functools import partial
+        from CoorLGNet import ARCH_KEYS, coorlgnet, checkpoint_filter_fn
+        model = coorlgnet(**dict((k, v) for k, v in config.items() if k in ARCH_KEYS))
+        filter_fn = partial(checkpoint_filter_fn, model=model)
+    output = opt.output or os.path.splitext(opt.pth)[0] + ".tensors"
+    num_tensors = convert_pth(opt.pth, output, config=config, class_indices=class_indict, filter_fn=filter_fn)
+    print("{} tensors written to {}".format(num_tensors, output))
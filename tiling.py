@@ -0,0 +1,161 @@
+"""
+全分辨率分块推理：不再把整张扫描图 Resize(256) + CenterCrop(224)，而是切成互相重叠的 tile_size 见方的块，
+跳过空白纸张的块，其余块拼成 batch 前向，再把各块的 logits / 特征聚合成整张图的预测。
+
+    tiler = TiledInference(tile_size=224, overlap=0.25, reduce="mean", max_batch_size=32)
+    logits = tiler(model, img)           # img: PIL.Image（RGB），返回 [K]
+
+切块:
+    步长为 tile_size * (1 - overlap)，最后一行 / 列的块贴着图像边缘，保证覆盖整张图；
+    图像比 tile_size 小时四周补白（纸张颜色）。scale != 1 时先把整张图缩放 scale 倍。
+空白块:
+    灰度低于 ink_threshold（0~1）的像素视为笔迹，笔迹比例低于 min_ink 的块跳过；
+    所有块都是空白时保留笔迹最多的一块。
+聚合方式:
+    mean                各块 softmax 概率取平均
+    max                 各块每个类别取最大概率
+    logit_mean          各块 logits 取平均
+    ink_mean            各块 softmax 概率按笔迹比例加权平均
+    feature_mean        各块 forward_features 的输出取平均后再过分类头
+mean / max / ink_mean 返回概率的对数，与 tta.py 一致，可以直接用于 softmax / argmax。
+
+显存 / 内存: 每次只把 max_batch_size 个块从整张图中切出来前向，峰值与块数无关。
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+
+REDUCTIONS = ("mean", "max", "logit_mean", "ink_mean", "feature_mean")
+
+
+def tile_starts(length, tile_size, stride):
+    """一维上各块的起点，最后一块贴着边缘"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] != length - tile_size:
+        starts.append(length - tile_size)
+    return starts
+
+
+class TiledInference:
+    def __init__(self, tile_size=224, overlap=0.25, scale=1., ink_threshold=0.6, min_ink=0.002,
+                 reduce="mean", max_batch_size=32, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        assert reduce in REDUCTIONS, "unknown reduction {}, expected one of {}".format(reduce, REDUCTIONS)
+        assert 0 <= overlap < 1, "overlap must be in [0, 1)"
+        self.tile_size = tile_size
+        self.stride = max(1, int(round(tile_size * (1 - overlap))))
+        self.scale = scale
+        self.ink_threshold = ink_threshold
+        self.min_ink = min_ink
+        self.reduce = reduce
+        self.max_batch_size = max_batch_size
+        self.mean = torch.tensor(mean).view(-1, 1, 1)
+        self.std = torch.tensor(std).view(-1, 1, 1)
+        self.reset_stats()
+
+    def to_tensor(self, img):
+        """PIL.Image -> 未 Normalize 的 [3, H, W]（0~1），边长不足 tile_size 时补白"""
+        img = img.convert("RGB")
+        if self.scale != 1:
+            w, h = img.size
+            img = img.resize((max(1, int(round(w * self.scale))), max(1, int(round(h * self.scale)))),
+                             Image.BILINEAR)
+        w, h = img.size
+        x = torch.from_numpy(np.asarray(img, dtype=np.uint8).copy())
+        x = x.permute(2, 0, 1).float().div_(255.)
+        pad_h, pad_w = max(0, self.tile_size - h), max(0, self.tile_size - w)
+        if pad_h or pad_w:
+            x = F.pad(x, (pad_w // 2, pad_w - pad_w // 2, pad_h // 2, pad_h - pad_h // 2), value=1.)
+        return x
+
+    def select_tiles(self, x):
+        """
+        x: [3, H, W]（0~1）
+        返回非空白块的 [(top, left), ...] 和对应的笔迹比例 [T]
+        """
+        t = self.tile_size
+        ink = (x.mean(dim=0) < self.ink_threshold).float()
+        # 积分图，每块的笔迹像素数 O(1) 求得；大图的累加和超过 2^24，float32 会丢失精度，用 float64
+        integral = F.pad(ink.double().cumsum(0).cumsum(1), (1, 0, 1, 0))
+        boxes = [(top, left) for top in tile_starts(x.shape[1], t, self.stride)
+                 for left in tile_starts(x.shape[2], t, self.stride)]
+        tops = torch.tensor([b[0] for b in boxes])
+        lefts = torch.tensor([b[1] for b in boxes])
+        counts = (integral[tops + t, lefts + t] - integral[tops, lefts + t]
+                  - integral[tops + t, lefts] + integral[tops, lefts])
+        fractions = (counts / (t * t)).float()
+        keep = fractions >= self.min_ink
+        if not keep.any():
+            keep[fractions.argmax()] = True
+        self.num_tiles += len(boxes)
+        self.num_kept += int(keep.sum())
+        return [b for b, k in zip(boxes, keep.tolist()) if k], fractions[keep]
+
+    def _chunks(self, x, boxes, device):
+        t = self.tile_size
+        step = self.max_batch_size if self.max_batch_size > 0 else len(boxes)
+        for i in range(0, len(boxes), step):
+            chunk = torch.stack([x[:, top:top + t, left:left + t] for top, left in boxes[i:i + step]], dim=0)
+            yield chunk.sub_(self.mean).div_(self.std).to(device)
+
+    def _reduce(self, logits, fractions):
+        """logits: [T, K] -> [K]"""
+        if self.reduce == "logit_mean":
+            return logits.mean(dim=0)
+        probs = F.softmax(logits.float(), dim=-1)
+        if self.reduce == "mean":
+            probs = probs.mean(dim=0)
+        elif self.reduce == "max":
+            probs = probs.max(dim=0)[0]
+        else:
+            weights = fractions.to(probs.device, probs.dtype)
+            probs = (probs * weights.unsqueeze(-1)).sum(dim=0) / weights.sum()
+        return torch.log(probs.clamp_min(1e-12)).to(logits.dtype)
+
+    def __call__(self, model, img, tta=None):
+        """
+        img: PIL.Image；tta: tta.TTA，给出时每块用测试时增强后的 logits（不能与 feature_mean 同时使用）
+        """
+        assert tta is None or self.reduce != "feature_mean", "feature_mean cannot be combined with TTA"
+        device = next(model.parameters()).device
+        x = self.to_tensor(img)
+        boxes, fractions = self.select_tiles(x)
+        if self.reduce == "feature_mean":
+            features = torch.cat([model.forward_features(chunk) for chunk in self._chunks(x, boxes, device)])
+            return model.head(features.mean(dim=0, keepdim=True))[0]
+        forward = model if tta is None else (lambda chunk: tta(model, chunk))
+        logits = torch.cat([forward(chunk) for chunk in self._chunks(x, boxes, device)], dim=0)
+        return self._reduce(logits, fractions)
+
+    def reset_stats(self):
+        # 统计被跳过的空白块比例
+        self.num_tiles = 0
+        self.num_kept = 0
+
+    def kept_fraction(self):
+        return self.num_kept / max(self.num_tiles, 1)
+
+
+def add_tiling_args(parser):
+    """predict.py 的分块推理命令行参数"""
+    parser.add_argument('--tiled', action='store_true',
+                        help='predict on overlapping full-resolution tiles instead of a centre crop')
+    parser.add_argument('--tile-overlap', type=float, default=0.25)
+    parser.add_argument('--tile-scale', type=float, default=1., help='resize the whole scan by this factor first')
+    parser.add_argument('--tile-reduce', type=str, default='mean', choices=REDUCTIONS)
+    parser.add_argument('--tile-batch-size', type=int, default=32, help='tiles per forward, bounds peak memory')
+    parser.add_argument('--tile-ink-threshold', type=float, default=0.6,
+                        help='grey level (0-1) below which a pixel counts as ink')
+    parser.add_argument('--tile-min-ink', type=float, default=0.002,
+                        help='tiles with a smaller fraction of ink pixels are skipped as blank paper')
+
+
+def tiling_from_args(args):
+    if not args.tiled:
+        return None
+    return TiledInference(tile_size=args.img_size, overlap=args.tile_overlap, scale=args.tile_scale,
+                          ink_threshold=args.tile_ink_threshold, min_ink=args.tile_min_ink,
+                          reduce=args.tile_reduce, max_batch_size=args.tile_batch_size)
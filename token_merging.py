@@ -0,0 +1,64 @@
+"""
+Token Merging（ToMe, Bolya et al. 2023）的二分软匹配，用于 Block 中的全局 Attention 和 FFN 分支。
+
+token 按奇偶位置分为 A、B 两组，A 中每个 token 找 B 中余弦相似度最高的 token，
+相似度最高的 r 条边上的 A token 被平均合并进对应的 B token，token 数由 N 变为 N - r。
+逐 token 的分支在合并后的 token 上计算，再由 unmerge 按合并关系复制回 N 个位置，
+因此卷积分支（proj、CoordAtt、Mlp）看到的仍是完整的 H × W 特征图。
+FFN 和全局 Attention 分支各自在自己的输入上匹配（FFN 之后 x 已经改变，不复用 FFN 的匹配结果）。
+
+匹配结果保存为一个 N -> N - r 的映射，merge 是一次 index_add_，unmerge 是一次 index_select，
+这样合并本身的开销远小于省下的计算。
+"""
+import torch
+
+
+class TokenMerge:
+    def __init__(self, metric, r):
+        """
+        metric: [B, N, C] 用于计算相似度的特征
+        r: 合并掉的 token 数，最多 N // 2
+        """
+        B, N, _ = metric.shape
+        self.B, self.N = B, N
+        self.r = r = min(r, N // 2)
+        self.num_out = N - r
+        device = metric.device
+        with torch.no_grad():
+            metric = metric / metric.norm(dim=-1, keepdim=True).clamp_min(1e-6)
+            a, b = metric[:, ::2, :], metric[:, 1::2, :]
+            Na, Nb = a.shape[1], b.shape[1]
+            scores = a @ b.transpose(-1, -2)                              # [B, Na, Nb]
+            node_max, node_idx = scores.max(dim=-1)                       # A 中每个 token 最相似的 B token
+            edge_idx = node_max.argsort(dim=-1, descending=True)
+            unm_idx = edge_idx[:, r:]                                     # 不合并的 A token
+            src_idx = edge_idx[:, :r]                                     # 被合并的 A token
+            dst_idx = node_idx.gather(dim=1, index=src_idx)               # 合并到的 B token
+
+            # 输出 token 的排列: [未合并的 A token (Na - r), 全部 B token (Nb)]
+            num_unm = Na - r
+            token_map = torch.empty(B, N, dtype=torch.long, device=device)
+            token_map[:, 1::2] = num_unm + torch.arange(Nb, device=device)
+            token_map.scatter_(1, 2 * unm_idx, torch.arange(num_unm, device=device).expand(B, num_unm))
+            token_map.scatter_(1, 2 * src_idx, num_unm + dst_idx)
+            counts = torch.zeros(B, self.num_out, device=device).scatter_add_(
+                1, token_map, torch.ones(B, N, device=device))
+            self.inv_count = (1. / counts).unsqueeze(-1)                  # [B, N - r, 1]
+            self.flat_map = (token_map + torch.arange(B, device=device).unsqueeze(1) * self.num_out).view(-1)
+            # 每个输出 token 对应的原始位置（合并后的 token 取 B 组中保留的那个）
+            self.rep_idx = torch.cat([2 * unm_idx, (2 * torch.arange(Nb, device=device) + 1).expand(B, Nb)], dim=1)
+
+    def merge(self, x):
+        """[B, N, C] -> [B, N - r, C]，合并的 token 取平均"""
+        C = x.shape[-1]
+        out = x.new_zeros(self.B * self.num_out, C).index_add_(0, self.flat_map, x.reshape(-1, C))
+        return out.view(self.B, self.num_out, C) * self.inv_count.to(x.dtype)
+
+    def unmerge(self, x):
+        """[B, N - r, C] -> [B, N, C]，被合并的 token 取合并后 token 的值"""
+        C = x.shape[-1]
+        return x.reshape(-1, C).index_select(0, self.flat_map).view(self.B, self.N, C)
+
+    def merge_rows(self, rows):
+        """与 batch 无关的逐 token 量 [N, D]（如相对位置偏置）-> [B, N - r, D]，取每个输出 token 的代表位置"""
+        return rows[self.rep_idx]
@@ -3,20 +3,25 @@ import os
 import sys
 import json
 import warnings
+from functools import partial
 
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torchvision import transforms, datasets
 from tqdm import tqdm
-from torch.utils.tensorboard import SummaryWriter
-import matplotlib.pyplot as plt
 
-from CoorLGNet import coorlgnet
-import xlwt
+from CoorLGNet import coorlgnet, select_exits, checkpoint_filter_fn
+from inference import load_model
 import sklearn.metrics as sm
 from my_dataset import MyDataSet
 from utils import read_split_data
+from tta import add_tta_args, tta_from_args
+from reporting import Reporter, add_reporting_args
+from checkpoint import CheckpointManager
+from async_eval import BackgroundEvaluator, eval_mode, subset_indices
+from distill import (SeededAugDataset, TeacherCache, Distiller, build_student, teacher_id_of, accuracy,
+                     measure_latency, STUDENTS)
 
 import torch.nn.functional as F
 import csv
@@ -24,20 +29,12 @@ import random
 import numpy as np
 
 
-book = xlwt.Workbook(encoding='utf-8')  # 创建Workbook，相当于创建Excel
-# 创建sheet，Sheet1为表的名字，cell_overwrite_ok为是否覆盖单元格
-sheet1 = book.add_sheet(u'Train_data', cell_overwrite_ok=True)
-# 向表中添加数据
-sheet1.write(0, 0, 'epoch')
-sheet1.write(0, 1, 'Train_Loss')
-sheet1.write(0, 2, 'Train_Acc')
-sheet1.write(0, 3, 'Val_Loss')
-sheet1.write(0, 4, 'Val_Acc')
-sheet1.write(0, 5, 'lr')
-sheet1.write(0, 6, 'Best val Acc')
-
-
-def train_one_epoch(model, optimizer, data_loader, device, epoch):
+def train_one_epoch(model, optimizer, data_loader, device, epoch, exit_weights=None, distiller=None, progress=True):
+    """
+    exit_weights: 早退模型各出口（exit_b, exit_c, 最终 head）损失的权重，为 None 时只训练最终 head
+    distiller: distill.Distiller，给出时用教师 logits 的 KL 损失加标签的 CE 损失训练（data_loader 需返回缓存键）
+    progress: 是否显示进度条
+    """
     model.train()
     loss_function = torch.nn.CrossEntropyLoss()
     accu_loss = torch.zeros(1).to(device)  # 累计损失
@@ -45,17 +42,25 @@ def train_one_epoch(model, optimizer, data_loader, device, epoch):
     optimizer.zero_grad()
 
     sample_num = 0
-    data_loader = tqdm(data_loader, file=sys.stdout)
+    data_loader = tqdm(data_loader, file=sys.stdout, disable=not progress)
 
     for step, data in enumerate(data_loader):
-        images, labels = data
+        images, labels = data[0], data[1]
         sample_num += images.shape[0]
 
-        pred = model(images.to(device))
+        if distiller is not None:
+            pred = model(images.to(device))
+            loss = distiller.loss(pred, labels.to(device), images, data[2])
+        elif exit_weights:
+            preds = model.forward_exits(images.to(device))
+            loss = sum(w * loss_function(p, labels.to(device)) for w, p in zip(exit_weights, preds))
+            pred = preds[-1]
+        else:
+            pred = model(images.to(device))
+            loss = loss_function(pred, labels.to(device))
         pred_classes = torch.max(pred, dim=1)[1]
         accu_num += torch.eq(pred_classes, labels.to(device)).sum()
 
-        loss = loss_function(pred, labels.to(device))
         loss.backward()
         accu_loss += loss.detach()
 
@@ -73,8 +78,52 @@ def train_one_epoch(model, optimizer, data_loader, device, epoch):
     return accu_loss.item() / (step + 1), accu_num.item() / sample_num
 
 
+class ExitStats:
+    """累计各出口的准确率，以及按阈值早退时各出口的退出比例、准确率和平均计算量"""
+
+    def __init__(self, num_exits, thresholds):
+        self.thresholds = thresholds
+        self.num = 0
+        self.correct = [0] * num_exits         # 所有样本都在该出口输出时的正确数
+        self.exited = [0] * num_exits          # 按阈值在该出口退出的样本数
+        self.exited_correct = [0] * num_exits  # 其中正确的样本数
+
+    def update(self, exit_logits, labels):
+        self.num += labels.shape[0]
+        for k, logits in enumerate(exit_logits):
+            self.correct[k] += torch.eq(logits.argmax(dim=1), labels).sum().item()
+        logits, exit_ids = select_exits(exit_logits, self.thresholds)
+        correct = torch.eq(logits.argmax(dim=1), labels)
+        for k in range(len(exit_logits)):
+            self.exited[k] += (exit_ids == k).sum().item()
+            self.exited_correct[k] += (correct & (exit_ids == k)).sum().item()
+
+    def report(self, flops=None):
+        names = ["exit_b", "exit_c", "final"]
+        print("early exit (thresholds {}):".format(list(self.thresholds)))
+        print("{:8} {:>9} {:>10} {:>13} {:>8}".format("exit", "acc(all)", "exit rate", "acc(exited)", "GFLOPs"))
+        for k in range(len(self.correct)):
+            print("{:8} {:>9.4f} {:>10.4f} {:>13.4f} {:>8.2f}".format(
+                names[k], self.correct[k] / self.num, self.exited[k] / self.num,
+                self.exited_correct[k] / max(self.exited[k], 1), flops[k] / 1e9 if flops else float("nan")))
+        acc = sum(self.exited_correct) / self.num
+        line = "early exit acc: {:.4f}".format(acc)
+        if flops:
+            avg = sum(n * f for n, f in zip(self.exited, flops)) / self.num
+            line += ", avg GFLOPs/image: {:.2f} ({:.1%} of full)".format(avg / 1e9, avg / flops[-1])
+        print(line)
+        return acc
+
+
 @torch.no_grad()
-def evaluate(model, data_loader, device, epoch):
+def evaluate(model, data_loader, device, epoch, exit_thresholds=None, tta=None, progress=True,
+             csv_path='CoorLGNet-old.csv'):
+    """
+    exit_thresholds: 早退模型各出口的置信度阈值，给出时额外报告各出口的准确率和平均计算量
+    tta: tta.TTA 实例，给出时用测试时增强后的 logits 计算指标
+    progress: 是否显示进度条（后台验证进程中关闭）
+    csv_path: 逐样本预测和指标追加写入的 CSV，为 None 时不写（多个进程同时验证时使用）
+    """
     warnings.filterwarnings("ignore")
     # loss_function = torch.nn.CrossEntropyLoss()
     #
@@ -135,9 +184,14 @@ def evaluate(model, data_loader, device, epoch):
 
 
     sample_num = 0
-    data_loader = tqdm(data_loader, file=sys.stdout)
-
-    out = open('CoorLGNet-old.csv', 'a', newline='')
+    data_loader = tqdm(data_loader, file=sys.stdout, disable=not progress)
+    # 早退统计的是各出口在原图上的输出，不能与 TTA 的多视图聚合同时使用
+    assert not (exit_thresholds and tta is not None), "exit_thresholds and tta are mutually exclusive"
+    exit_stats = ExitStats(model.num_exits, exit_thresholds) if exit_thresholds else None
+    if tta is not None:
+        tta.reset_stats()
+
+    out = open(csv_path or os.devnull, 'a', newline='')
     csv_write = csv.writer(out, dialect='excel')
     csv_write.writerow(
         ['acc', 'precision', 'recall', 'f1-score', 'true label', 'class0', 'class1', 'pred label'])
@@ -149,7 +203,14 @@ def evaluate(model, data_loader, device, epoch):
         sample_num += images.shape[0]
 
         label = labels.numpy().tolist()  # +
-        pred = model(images.to(device))
+        if exit_stats is not None:
+            preds = model.forward_exits(images.to(device))
+            exit_stats.update(preds, labels.to(device))
+            pred = preds[-1]
+        elif tta is not None:
+            pred = tta(model, images.to(device))
+        else:
+            pred = model(images.to(device))
         lb_pred = F.softmax(pred).cpu().numpy()  # +
 
         pred_classes = torch.max(pred, dim=1)[1]
@@ -190,9 +251,14 @@ def evaluate(model, data_loader, device, epoch):
     recall = r / k
     f1_score = f1 / k
     print("Precision: {:.5f}, Recall: {:.5f}, F1_score: {:.5f}".format(precision, recall, f1_score))
+    if tta is not None:
+        print("TTA: {} views, {}, {:.1%} of samples augmented".format(
+            tta.num_views, tta.aggregate, tta.augmented_fraction()))
+    if exit_stats is not None:
+        exit_stats.report(model.exit_flops(images.shape[-1]))
 
     # 保存指标
-    out = open('CoorLGNet-old.csv', 'a', newline='')
+    out = open(csv_path or os.devnull, 'a', newline='')
     csv_write = csv.writer(out, dialect='excel')
     csv_write.writerow([acc, precision, recall, f1_score, '', '', '', ''])
 
@@ -206,7 +272,8 @@ def main(args):
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     print("using {} device.".format(device))
 
-    tb_writer = SummaryWriter()
+    # TensorBoard、曲线图、xls 表格在后台线程中生成（见 reporting.py）
+    reporter = Reporter(plot_dir=args.report_plot_dir, xls_path=args.report_xls, min_interval=args.report_interval)
 
     train_images_path, train_images_label, val_images_path, val_images_label = read_split_data(args.data_path)
 
@@ -233,6 +300,10 @@ def main(args):
                             images_class=val_images_label,
                             transform=data_transform["val"])
 
+    # 蒸馏时训练集的增强由种子决定，教师 logits 按 (图片, 种子) 缓存
+    if args.distill_teacher:
+        train_dataset = SeededAugDataset(train_dataset, aug_seeds=args.aug_seeds)
+
     batch_size = args.batch_size
 
     # data_root = os.path.abspath(os.path.join(os.getcwd(), "../.."))  # get data root path
@@ -289,7 +360,34 @@ def main(args):
 
 
 
-    model = coorlgnet(num_classes=args.num_classes).to(device)
+    distiller = None
+    if args.distill_teacher:
+        assert not args.early_exits, "--early-exits is not supported for distillation students"
+        # 以下参数只作用于 CoorLGNet（--linear-rank 只在 --global-attn linear 时使用），CMT 学生没有对应的结构
+        assert args.global_attn == ['sr'], "--global-attn is not supported for distillation students"
+        assert not args.attn_mem_budget and not args.attn_checkpoint, \
+            "--attn-mem-budget / --attn-checkpoint are not supported for distillation students"
+        assert not args.profile, "--profile is not supported for distillation students"
+        # 冻结的 CoorLGNet 教师，学生为 upconstruction 中的 CMT 模型
+        teacher = load_model(args.distill_teacher, num_classes=args.num_classes, device=device)
+        for p in teacher.parameters():
+            p.requires_grad_(False)
+        cache = TeacherCache(teacher, device, cache_path=args.distill_cache,
+                             teacher_id=teacher_id_of(args.distill_teacher))
+        distiller = Distiller(cache, alpha=args.distill_alpha, temperature=args.distill_temperature)
+        model_fn = partial(build_student, args.student, num_classes=args.num_classes)
+        model = model_fn().to(device)
+    else:
+        model_fn = partial(coorlgnet, num_classes=args.num_classes, early_exits=args.early_exits,
+                           exit_c_block=args.exit_c_block, exit_thresholds=args.exit_thresholds,
+                           global_attn=args.global_attn[0] if len(args.global_attn) == 1 else args.global_attn,
+                           attn_mem_budget_mb=args.attn_mem_budget, attn_checkpoint=args.attn_checkpoint,
+                           linear_rank=args.linear_rank)
+        model = model_fn().to(device)
+    exit_weights = args.exit_weights if args.early_exits else None
+    exit_thresholds = args.exit_thresholds if args.early_exits else None
+    tta = tta_from_args(args)
+    assert exit_thresholds is None or tta is None, "--early-exits cannot be evaluated together with --tta"
 
     print("batch_size:", args.batch_size)
     print("lr:", args.lr)
@@ -303,6 +401,9 @@ def main(args):
         for k in list(weights_dict.keys()):
             if "fc" in k:
                 del weights_dict[k]
+        if distiller is None:
+            # 与 load_checkpoint 相同的转换: 'sr' 权重的 relative_pos 分解为 'linear' 阶段的低秩位置图，img_size 不同时插值
+            weights_dict = checkpoint_filter_fn(weights_dict, model)
         print(model.load_state_dict(weights_dict, strict=False))
 
 
@@ -317,8 +418,13 @@ def main(args):
 
 
 
-    images = torch.zeros(1, 3, 224, 224).to(device)       # 要求大小与输入图片的大小一致
-    tb_writer.add_graph(model, images, verbose=False)
+    if args.tb_graph:
+        images = torch.zeros(1, 3, 224, 224).to(device)       # 要求大小与输入图片的大小一致
+        reporter.add_graph(model, images)
+
+    # add_graph 之后再注册 hook，避免 trace 时也被计时
+    if args.profile:
+        profiler = model.enable_profiling(level=args.profile, trace=bool(args.profile_trace))
 
     epochs = args.epochs       # 训练轮数
     # construct an optimizer
@@ -331,77 +437,116 @@ def main(args):
     best_acc_epoch = 0
     save_path = './weight/best.pth'
     train_steps = len(train_loader)
-    train_loss_list, val_loss_list, train_acc_list, val_acc_list, epoch_list = [], [], [], [], []
-    for epoch in range(epochs):
+    # 每个 epoch 结束时在后台线程保存断点（见 checkpoint.py），--resume 时从最近的断点继续
+    checkpoints = CheckpointManager(args.checkpoint_dir, keep_top_k=args.keep_top_k, best_path=save_path,
+                                    resume=args.resume, model_config=getattr(model, "model_config", None))
+    start_epoch = 0
+    if args.resume:
+        start_epoch, state = checkpoints.resume(model, optimizer, scheduler)
+        best_acc = state.get("best_acc", best_acc)
+        best_acc_epoch = state.get("best_epoch", best_acc_epoch)
+
+    # --async-eval: 验证在单独的进程中进行，与下一个 epoch 的训练重叠（见 async_eval.py）
+    evaluator = None
+    if args.async_eval:
+        evaluator = BackgroundEvaluator(evaluate, model_fn, val_dataset, batch_size=batch_size,
+                                        device=args.eval_device or str(device), threads=args.eval_threads,
+                                        subset_fraction=args.eval_subset, exit_thresholds=exit_thresholds, tta=tta)
+    elif args.eval_subset > 0:
+        val_subset_loader = torch.utils.data.DataLoader(
+            torch.utils.data.Subset(val_dataset, subset_indices(len(val_dataset), args.eval_subset)),
+            batch_size=batch_size, shuffle=False, num_workers=nw, collate_fn=val_dataset.collate_fn)
+    last_val_acc = None
+
+    def report_eval(epoch, subset, val_loss, val_acc, state_dict=None):
+        """验证结果: 子集验证只记录到 TensorBoard / 曲线，完整验证还用于选择最优模型"""
+        nonlocal best_acc, best_acc_epoch, last_val_acc
+        if subset:
+            reporter.log_epoch(epoch, val_loss_subset=val_loss, val_acc_subset=val_acc)
+            return
+        reporter.log_epoch(epoch, val_loss=val_loss, val_acc=val_acc)
+        last_val_acc = val_acc
+        if val_acc > best_acc:
+            best_acc = val_acc
+            best_acc_epoch = epoch
+        if state_dict is not None:
+            checkpoints.record_score(epoch, val_acc, state_dict)
 
-        epoch_list.append(epoch)
+    for epoch in range(start_epoch, epochs):
 
-        sheet1.write(epoch + 1, 0, epoch + 1)
-        sheet1.write(epoch + 1, 5, str(optimizer.state_dict()['param_groups'][0]['lr']))
+        if distiller is not None:
+            train_dataset.set_epoch(epoch)
+
+        lr = optimizer.param_groups[0]["lr"]
 
         # train
         train_loss, train_acc = train_one_epoch(model=model,
                                                 optimizer=optimizer,
                                                 data_loader=train_loader,
                                                 device=device,
-                                                epoch=epoch)
+                                                epoch=epoch,
+                                                exit_weights=exit_weights,
+                                                distiller=distiller)
+        if distiller is not None:
+            print("teacher cache: {} hits, {} teacher forwards, {} logits cached".format(
+                distiller.cache.hits, distiller.cache.misses, len(distiller.cache.logits)))
+            distiller.cache.reset_stats()
+            distiller.cache.save()
 
         scheduler.step()   # 更新学习率
 
-        sheet1.write(epoch + 1, 1, str(train_loss))
-        sheet1.write(epoch + 1, 2, str(train_acc))
-
-        train_loss_list.append(train_loss)
-        train_acc_list.append(train_acc)
-
-        # validate
-        val_loss, val_acc = evaluate(model=model,
-                                     data_loader=val_loader,
-                                     device=device,
-                                     epoch=epoch)
-        val_loss_list.append(val_loss)
-        val_acc_list.append(val_acc)
-
-        sheet1.write(epoch + 1, 3, str(val_loss))
-        sheet1.write(epoch + 1, 4, str(val_acc))
-
-        tags = ["train_loss", "train_acc", "val_loss", "val_acc", "learning_rate"]
-        tb_writer.add_scalar(tags[0], train_loss, epoch)
-        tb_writer.add_scalar(tags[1], train_acc, epoch)
-        tb_writer.add_scalar(tags[2], val_loss, epoch)
-        tb_writer.add_scalar(tags[3], val_acc, epoch)
-        tb_writer.add_scalar(tags[4], optimizer.param_groups[0]["lr"], epoch)
-
-        if val_acc > best_acc:
-            best_acc = val_acc
-            best_acc_epoch = epoch
-            # torch.save(model.state_dict(), save_path)
-
-        fig = plt.figure(1)
-        plt.plot(epoch_list, train_loss_list, 'r-', label=u'Train Loss')
-        # 显示图例
-        plt.plot(epoch_list, val_loss_list, 'b-', label=u'Val Loss')
-        plt.legend(["Train Loss", "Val Loss"], loc="upper right")
-        plt.xlabel(u'epoch')
-        plt.ylabel(u'loss')
-        plt.title('Model Loss ')
-        plt.savefig("./loss.png")
-        plt.close(1)
-        fig2 = plt.figure(2)
-        plt.plot(epoch_list, train_acc_list, 'r-', label=u'Train Acc')
-        plt.plot(epoch_list, val_acc_list, 'b-', label=u'Val Acc')
-        plt.legend(["Train Acc", "Val Acc"], loc="lower right")
-        plt.title("Model Acc")
-        plt.ylabel("acc")
-        plt.xlabel("epoch")
-        plt.savefig("./acc.png")
-        plt.close(2)
-
-    sheet1.write(1, 6, str(best_acc))
-    # book.save('.\Train_data.xlsx')
+        reporter.log_epoch(epoch, train_loss=train_loss, train_acc=train_acc, lr=lr)
+
+        # validate: 每 eval-every 个 epoch 完整验证一次，其余 epoch 在子集上验证或跳过
+        mode = eval_mode(epoch, epochs, args.eval_every, args.eval_subset)
+        if evaluator is not None:
+            if mode is not None:
+                evaluator.submit(epoch, model, subset=mode == "subset")
+            checkpoints.save(epoch, model, optimizer, scheduler, None, best_acc=best_acc, best_epoch=best_acc_epoch)
+            for result in evaluator.poll():
+                report_eval(*result)
+        else:
+            if mode is not None:
+                val_loss, val_acc = evaluate(model=model,
+                                             data_loader=val_loader if mode == "full" else val_subset_loader,
+                                             device=device,
+                                             epoch=epoch,
+                                             exit_thresholds=exit_thresholds,
+                                             tta=tta)
+                report_eval(epoch, mode == "subset", val_loss, val_acc)
+            checkpoints.save(epoch, model, optimizer, scheduler, val_acc if mode == "full" else None,
+                             best_acc=best_acc, best_epoch=best_acc_epoch)
+
+    if evaluator is not None:
+        for result in evaluator.drain():
+            report_eval(*result)
+        evaluator.close()
+
+    if args.profile:
+        model.disable_profiling()
+        print(profiler.report())
+        if args.profile_trace:
+            profiler.export_chrome_trace(args.profile_trace)
+
+    checkpoints.close()
+    reporter.close(best_acc=best_acc)
     print("The Best Acc = : {:.4f}".format(best_acc))
     print("The Best_acc_epoch:", best_acc_epoch)
 
+    if distiller is not None:
+        teacher_acc = accuracy(teacher, val_loader, device)
+        teacher_ms = measure_latency(teacher, device)
+        student_ms = measure_latency(model, device)
+        # 这个进程中没有做过完整验证时（如 --resume 时已经训练完）重新计算学生的准确率
+        student_acc = last_val_acc if last_val_acc is not None else accuracy(model, val_loader, device)
+        print("distillation: student {} acc {:.4f} (best {:.4f}), teacher acc {:.4f}".format(
+            args.student, student_acc, best_acc, teacher_acc))
+        print("batch 1 latency: teacher {:.1f} ms, student {:.1f} ms, speedup {:.2f}x; "
+              "params: teacher {:.1f}M, student {:.1f}M".format(
+                  teacher_ms, student_ms, teacher_ms / student_ms,
+                  sum(p.numel() for p in teacher.parameters()) / 1e6,
+                  sum(p.numel() for p in model.parameters()) / 1e6))
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--num_classes', type=int, default=2)
@@ -427,6 +572,52 @@ if __name__ == '__main__':
     parser.add_argument('--freeze-layers', type=bool, default=False)
     # parser.add_argument('--device', default='cuda:0', help='device id (i.e. 0 or 0,1 or cpu)')
 
+    # 全局注意力分支: sr（空间缩减注意力）、bra（双层路由注意力）或 linear（线性注意力），一个值或每个阶段一个值
+    parser.add_argument('--global-attn', type=str, nargs='+', default=['sr'], choices=['sr', 'bra', 'linear'])
+    # linear 注意力中 relative_pos 低秩近似的秩
+    parser.add_argument('--linear-rank', type=int, default=4)
+    # 按 query 分块计算注意力: 每块注意力分数的内存上限（MB，0 表示不分块），以及反向时是否重算分数
+    parser.add_argument('--attn-mem-budget', type=float, default=0)
+    parser.add_argument('--attn-checkpoint', action='store_true')
+    # 早退出口：stage b 之后和 stage c 的第 exit-c-block 个 block 之后各加一个轻量分类头，与最终 head 联合训练
+    parser.add_argument('--early-exits', action='store_true')
+    parser.add_argument('--exit-c-block', type=int, default=7)
+    parser.add_argument('--exit-weights', type=float, nargs=3, default=[0.3, 0.3, 1.0],
+                        help='loss weights of exit_b, exit_c and the final head')
+    parser.add_argument('--exit-thresholds', type=float, nargs=2, default=[0.9, 0.9],
+                        help='softmax confidence needed to exit at exit_b / exit_c')
+
+    # 知识蒸馏：--distill-teacher 为 CoorLGNet 教师权重，训练 --student 指定的 CMT 学生模型（见 distill.py）
+    parser.add_argument('--distill-teacher', type=str, default='', help='frozen coorlgnet teacher weights')
+    parser.add_argument('--student', type=str, default='cmt_ti', choices=STUDENTS)
+    parser.add_argument('--distill-alpha', type=float, default=0.5, help='weight of the soft-target KL loss')
+    parser.add_argument('--distill-temperature', type=float, default=4.)
+    parser.add_argument('--aug-seeds', type=int, default=4, help='fixed augmentations per training image')
+    parser.add_argument('--distill-cache', type=str, default='', help='file to keep teacher logits between runs')
+
+    # 验证时的测试时增强（见 tta.py）
+    add_tta_args(parser)
+
+    # 断点: 保留验证准确率最高的 keep-top-k 个和最新的一个；--resume 从 checkpoint-dir 中最近的断点继续训练
+    parser.add_argument('--checkpoint-dir', type=str, default='./weight/checkpoints')
+    parser.add_argument('--keep-top-k', type=int, default=3)
+    parser.add_argument('--resume', action='store_true')
+
+    # 验证: --async-eval 在单独的进程中与下一个 epoch 的训练并行；每 eval-every 个 epoch（以及最后一个）完整验证一次，
+    # 其余 epoch 在 eval-subset 比例的固定子集上验证（0 表示跳过）
+    parser.add_argument('--async-eval', action='store_true')
+    parser.add_argument('--eval-every', type=int, default=1)
+    parser.add_argument('--eval-subset', type=float, default=0.)
+    parser.add_argument('--eval-device', type=str, default='', help='device of the evaluation process, default: same')
+    parser.add_argument('--eval-threads', type=int, default=2, help='torch threads of the evaluation process')
+
+    # 曲线图 / 表格 / TensorBoard 的后台生成（见 reporting.py）
+    add_reporting_args(parser)
+
+    # 各阶段 / Block / 分支的前向耗时，训练结束后打印（见 profiling.py），train 和 eval 分开统计
+    parser.add_argument('--profile', type=str, default='', choices=['', 'stage', 'block', 'branch'])
+    parser.add_argument('--profile-trace', type=str, default='', help='write a chrome trace json to this path')
+
     opt = parser.parse_args()
 
 
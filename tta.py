@@ -0,0 +1,135 @@
+"""
+批量测试时增强（TTA）：在已预处理的 batch 上直接生成多个视图（翻转、多尺度中心裁剪、小角度旋转），
+所有视图拼成一个大 batch 只做一次前向，再把各视图的 logits 聚合。
+
+    tta = TTA(["hflip", "scale:0.875", "rot:10", "rot:-10"], aggregate="mean")
+    logits = tta(model, images)          # images: [B, 3, H, W]，已 Normalize
+
+视图（原图总是包含在内）:
+    hflip / vflip       水平 / 垂直翻转
+    scale:S             中心裁剪 S 倍边长后缩放回原尺寸（S < 1 相当于放大）
+    rot:D               旋转 D 度，空出的区域填 0（Normalize 之后即为均值颜色）
+聚合方式:
+    mean                各视图 softmax 概率取平均
+    max                 各视图每个类别取最大概率
+    logit_mean          各视图 logits 取平均
+mean / max 返回概率的对数，可以直接用于 softmax / argmax / CrossEntropyLoss。
+
+adaptive_threshold > 0 时先只对原图前向，只有最大 softmax 概率低于阈值的样本才计算其余视图。
+"""
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+AGGREGATIONS = ("mean", "max", "logit_mean")
+
+
+def _parse_view(view):
+    name, _, value = view.partition(":")
+    if name in ("hflip", "vflip") and not value:
+        return name, None
+    if name in ("scale", "rot") and value:
+        return name, float(value)
+    raise ValueError("unknown TTA view {!r}, expected hflip, vflip, scale:S or rot:D".format(view))
+
+
+def apply_view(x, view):
+    """x: [B, C, H, W]"""
+    name, value = _parse_view(view) if isinstance(view, str) else view
+    if name == "hflip":
+        return torch.flip(x, dims=[3])
+    if name == "vflip":
+        return torch.flip(x, dims=[2])
+    H, W = x.shape[-2:]
+    if name == "scale":
+        h, w = max(1, int(round(H * value))), max(1, int(round(W * value)))
+        if value <= 1:
+            top, left = (H - h) // 2, (W - w) // 2
+            return F.interpolate(x[:, :, top:top + h, left:left + w], size=(H, W), mode="bilinear",
+                                 align_corners=False)
+        # S > 1: 先缩小再四周补 0，相当于看到更多的上下文
+        y = F.interpolate(x, size=(int(round(H / value)), int(round(W / value))), mode="bilinear",
+                          align_corners=False)
+        pad_h, pad_w = H - y.shape[2], W - y.shape[3]
+        return F.pad(y, (pad_w // 2, pad_w - pad_w // 2, pad_h // 2, pad_h - pad_h // 2))
+    # rot
+    angle = math.radians(value)
+    theta = torch.tensor([[math.cos(angle), -math.sin(angle), 0.], [math.sin(angle), math.cos(angle), 0.]],
+                         dtype=x.dtype, device=x.device).expand(x.shape[0], 2, 3)
+    grid = F.affine_grid(theta, list(x.shape), align_corners=False)
+    return F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+
+class TTA:
+    def __init__(self, views=("hflip",), aggregate="mean", adaptive_threshold=0., max_batch_size=0):
+        assert aggregate in AGGREGATIONS, "unknown aggregation {}, expected one of {}".format(
+            aggregate, AGGREGATIONS)
+        self.views = [_parse_view(v) for v in views]
+        self.aggregate = aggregate
+        self.adaptive_threshold = adaptive_threshold
+        self.max_batch_size = max_batch_size
+        self.reset_stats()
+
+    @property
+    def num_views(self):
+        return len(self.views) + 1
+
+    def _forward(self, model, x):
+        if self.max_batch_size <= 0 or x.shape[0] <= self.max_batch_size:
+            return model(x)
+        return torch.cat([model(chunk) for chunk in torch.split(x, self.max_batch_size)], dim=0)
+
+    def _reduce(self, logits):
+        """logits: [V, B, K] -> [B, K]"""
+        if self.aggregate == "logit_mean":
+            return logits.mean(dim=0)
+        probs = F.softmax(logits.float(), dim=-1)
+        probs = probs.mean(dim=0) if self.aggregate == "mean" else probs.max(dim=0)[0]
+        return torch.log(probs.clamp_min(1e-12)).to(logits.dtype)
+
+    def _augmented(self, model, x, base_logits):
+        views = torch.cat([apply_view(x, view) for view in self.views], dim=0)
+        logits = self._forward(model, views).view(len(self.views), x.shape[0], -1)
+        return self._reduce(torch.cat([base_logits.unsqueeze(0), logits], dim=0))
+
+    def __call__(self, model, x):
+        B = x.shape[0]
+        self.num_samples += B
+        if self.adaptive_threshold <= 0:
+            self.num_augmented += B
+            views = torch.cat([x] + [apply_view(x, view) for view in self.views], dim=0)
+            return self._reduce(self._forward(model, views).view(self.num_views, B, -1))
+
+        logits = self._forward(model, x)
+        low = F.softmax(logits.float(), dim=-1).max(dim=-1)[0] < self.adaptive_threshold
+        if not low.any():
+            return logits
+        self.num_augmented += int(low.sum())
+        out = logits.clone()
+        out[low] = self._augmented(model, x[low], logits[low]).to(out.dtype)
+        return out
+
+    def reset_stats(self):
+        # 统计自适应模式下实际做了 TTA 的样本比例
+        self.num_samples = 0
+        self.num_augmented = 0
+
+    def augmented_fraction(self):
+        return self.num_augmented / max(self.num_samples, 1)
+
+
+def add_tta_args(parser):
+    """predict.py / train.py 共用的 TTA 命令行参数"""
+    parser.add_argument('--tta', type=str, nargs='*', default=[],
+                        help='extra test-time views, e.g. hflip vflip scale:0.875 rot:10 rot:-10')
+    parser.add_argument('--tta-aggregate', type=str, default='mean', choices=AGGREGATIONS)
+    parser.add_argument('--tta-threshold', type=float, default=0.,
+                        help='adaptive TTA: only augment samples whose confidence is below this value')
+
+
+def tta_from_args(args):
+    if not args.tta:
+        return None
+    return TTA(args.tta, aggregate=args.tta_aggregate, adaptive_threshold=args.tta_threshold)
@@ -2,7 +2,6 @@ import os
 import sys
 import json
 import pickle
-import random
 
 import torch
 from tqdm import tqdm
@@ -14,49 +13,47 @@ import sklearn.metrics as sm
 import torch.nn.functional as F
 import csv
 
+from dataset_manifest import update_manifest, write_class_indices
 
-def read_split_data(root: str, val_rate: float = 0.3):
-    random.seed(0)  # 保证随机结果可复现
+
+def read_split_data(root: str, val_rate: float = 0.3, manifest_path: str = None, num_workers: int = 8):
     assert os.path.exists(root), "dataset root: {} does not exist.".format(root)
 
-    # 遍历文件夹，一个文件夹对应一个类别
-    flower_class = [cla for cla in os.listdir(root) if os.path.isdir(os.path.join(root, cla))]
-    # 排序，保证各平台顺序一致
-    flower_class.sort()
+    # 增量更新数据集清单：只校验新增或修改过的文件，划分结果固定保存在清单中
+    manifest = update_manifest(root, manifest_path=manifest_path, val_rate=val_rate, num_workers=num_workers)
+    # 遍历文件夹，一个文件夹对应一个类别（已排序，保证各平台顺序一致）
+    flower_class = manifest["classes"]
     # 生成类别名称以及对应的数字索引
     class_indices = dict((k, v) for v, k in enumerate(flower_class))
-    json_str = json.dumps(dict((val, key) for key, val in class_indices.items()), indent=4)
-    with open('class_indices.json', 'w') as json_file:
-        json_file.write(json_str)
+    write_class_indices(flower_class)
 
     train_images_path = []  # 存储训练集的所有图片路径
     train_images_label = []  # 存储训练集图片对应索引信息
     val_images_path = []  # 存储验证集的所有图片路径
     val_images_label = []  # 存储验证集图片对应索引信息
-    every_class_num = []  # 存储每个类别的样本总数
-    supported = [".jpg", ".JPG", ".png", ".PNG"]  # 支持的文件后缀类型
-    # 遍历每个文件夹下的文件
-    for cla in flower_class:
-        cla_path = os.path.join(root, cla)
-        # 遍历获取supported支持的所有文件路径
-        images = [os.path.join(root, cla, i) for i in os.listdir(cla_path)
-                  if os.path.splitext(i)[-1] in supported]
-        # 排序，保证各平台顺序一致
-        images.sort()
-        # 获取该类别对应的索引
-        image_class = class_indices[cla]
-        # 记录该类别的样本数量
-        every_class_num.append(len(images))
-        # 按比例随机采样验证样本
-        val_path = random.sample(images, k=int(len(images) * val_rate))
-
-        for img_path in images:
-            if img_path in val_path:  # 如果该路径在采样的验证集样本中则存入验证集
-                val_images_path.append(img_path)
-                val_images_label.append(image_class)
-            else:  # 否则存入训练集
-                train_images_path.append(img_path)
-                train_images_label.append(image_class)
+    every_class_num = [0] * len(flower_class)  # 存储每个类别的样本总数
+    invalid_images = []  # 非RGB或无法读取的图片
+    # 排序，保证各平台顺序一致
+    for rel_path in sorted(manifest["images"]):
+        info = manifest["images"][rel_path]
+        img_path = os.path.join(root, info["class"], rel_path.split("/", 1)[1])
+        # RGB为彩色图片，L为灰度图片
+        if info["mode"] != "RGB":
+            invalid_images.append((img_path, info["mode"]))
+            continue
+        image_class = class_indices[info["class"]]
+        every_class_num[image_class] += 1
+        if info["split"] == "val":  # 如果该路径在采样的验证集样本中则存入验证集
+            val_images_path.append(img_path)
+            val_images_label.append(image_class)
+        else:  # 否则存入训练集
+            train_images_path.append(img_path)
+            train_images_label.append(image_class)
+
+    if len(invalid_images) > 0:
+        print("WARNING: {} images are not RGB or unreadable and were skipped:".format(len(invalid_images)))
+        for img_path, mode in invalid_images[:10]:
+            print("    {} (mode: {})".format(img_path, mode))
 
     print("{} images were found in the dataset.".format(sum(every_class_num)))
     print("{} images for training.".format(len(train_images_path)))